@@ -0,0 +1,13 @@
+'''
+A benchmark suite for kr-git, run with `python -m benchmarks` from the src directory.
+
+A synthetic repository is generated from a RepoSpec, then commit (cold, warm and after changing some files),
+restore, gc and object lookups are timed, each in a fresh process so that its peak RSS is its own. Results are
+written as JSON and can be compared against an earlier run to catch regressions.
+
+Modules contained:
+    1. generator: builds and changes synthetic repositories
+    2. runner: runs and measures every benchmark step
+    3. worker: the process each step is measured in
+    4. compare: compares two result files against thresholds
+'''
@@ -0,0 +1,123 @@
+'''
+Command line entry point of the benchmark suite.
+
+    python -m benchmarks [run] [--files N] [--depth N] [--fan-out N] [--sizes tiny=0.3,small=0.5,...]
+                         [--huge-size BYTES] [--binary-ratio R] [--change-fraction R] [--seed N] [--jobs N]
+                         [--lookups N] [--work-dir PATH] [--keep] [--output FILE]
+                         [--compare BASELINE.json] [--threshold R] [--metric-threshold METRIC=R ...]
+    python -m benchmarks compare BASELINE.json CURRENT.json [--threshold R] [--metric-threshold METRIC=R ...]
+
+Both forms exit with status 1 if a measurement regressed beyond its threshold.
+'''
+from __future__ import annotations
+import argparse
+import json
+import sys
+from benchmarks.compare import DEFAULT_THRESHOLDS, compare_results, format_comparisons
+from benchmarks.generator import HUGE_SIZE_CLASS, SIZE_CLASSES, RepoSpec
+from benchmarks.runner import run_benchmarks
+
+
+def _parse_weights(weights_str: str) -> dict[str, float]:
+    weights: dict[str, float] = {size_class: 0.0 for size_class in [*SIZE_CLASSES, HUGE_SIZE_CLASS]}
+    for weight_str in weights_str.split(','):
+        size_class, _, weight = weight_str.partition('=')
+        if size_class not in weights:
+            raise argparse.ArgumentTypeError(f'Unknown size class {size_class}; expected one of {", ".join(weights)}')
+        weights[size_class] = float(weight)
+    return weights
+
+
+def _parse_metric_thresholds(metric_thresholds: list[str]) -> dict[str, float]:
+    thresholds: dict[str, float] = {}
+    for metric_threshold in metric_thresholds or []:
+        metric_name, _, threshold = metric_threshold.partition('=')
+        thresholds[metric_name] = float(threshold)
+    return thresholds
+
+
+def _add_threshold_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--threshold', type=float,
+                        help='relative increase tolerated for every measurement, e.g. 0.1 for 10%%')
+    parser.add_argument('--metric-threshold', action='append', metavar='METRIC=R',
+                        help=f'relative increase tolerated for one measurement ({", ".join(DEFAULT_THRESHOLDS)})')
+
+
+def _thresholds(args: argparse.Namespace) -> dict[str, float]:
+    thresholds: dict[str, float] = {}
+    if args.threshold is not None:
+        thresholds = {metric_name: args.threshold for metric_name in DEFAULT_THRESHOLDS}
+    thresholds.update(_parse_metric_thresholds(args.metric_threshold))
+    return thresholds
+
+
+def _report_regressions(baseline: dict, current: dict, args: argparse.Namespace) -> int:
+    comparisons = compare_results(baseline, current, _thresholds(args))
+    print(format_comparisons(comparisons), file=sys.stderr)
+    regressed_count: int = sum(1 for comparison in comparisons if comparison.regressed)
+    if regressed_count:
+        print(f'{regressed_count} measurements regressed', file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv: list[str]) -> int:
+    if argv and argv[0] == 'compare':
+        parser = argparse.ArgumentParser(prog='python -m benchmarks compare',
+                                         description='Compare two benchmark result files')
+        parser.add_argument('baseline')
+        parser.add_argument('current')
+        _add_threshold_arguments(parser)
+        args = parser.parse_args(argv[1:])
+        with open(args.baseline, 'r', encoding='utf8') as baseline_file:
+            baseline: dict = json.load(baseline_file)
+        with open(args.current, 'r', encoding='utf8') as current_file:
+            current: dict = json.load(current_file)
+        return _report_regressions(baseline, current, args)
+
+    if argv and argv[0] == 'run':
+        argv = argv[1:]
+    default_spec = RepoSpec()
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Benchmark kr-git on a synthetic repository')
+    parser.add_argument('--files', type=int, default=default_spec.file_count, help='number of files')
+    parser.add_argument('--depth', type=int, default=default_spec.depth, help='levels of directories')
+    parser.add_argument('--fan-out', type=int, default=default_spec.fan_out, help='subdirectories per directory')
+    parser.add_argument('--sizes', type=_parse_weights,
+                        help='relative share of each size class, e.g. tiny=0.3,small=0.5,medium=0.18,large=0.02,huge=0')
+    parser.add_argument('--huge-size', type=int, default=default_spec.huge_size,
+                        help='size in bytes of each (sparse) huge file')
+    parser.add_argument('--binary-ratio', type=float, default=default_spec.binary_ratio,
+                        help='share of files with random binary contents')
+    parser.add_argument('--change-fraction', type=float, default=default_spec.change_fraction,
+                        help='share of files changed before the third commit')
+    parser.add_argument('--seed', type=int, default=default_spec.seed)
+    parser.add_argument('--jobs', type=int, help='worker threads for commit and restore')
+    parser.add_argument('--lookups', type=int, default=1000, help='objects looked up by the lookup steps')
+    parser.add_argument('--work-dir', help='directory to generate the repository in')
+    parser.add_argument('--keep', action='store_true', help='leave the generated repository on disk')
+    parser.add_argument('--output', help='file to write the JSON results to (stdout by default)')
+    parser.add_argument('--compare', metavar='BASELINE', help='results of an earlier run to check for regressions')
+    _add_threshold_arguments(parser)
+    args = parser.parse_args(argv)
+
+    spec = RepoSpec(file_count=args.files, depth=args.depth, fan_out=args.fan_out,
+                    size_weights=args.sizes or default_spec.size_weights, huge_size=args.huge_size,
+                    binary_ratio=args.binary_ratio, change_fraction=args.change_fraction, seed=args.seed)
+    results: dict = run_benchmarks(spec, args.jobs, args.lookups, args.work_dir, args.keep,
+                                   log=lambda message: print(message, file=sys.stderr))
+    results_json: str = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as output_file:
+            output_file.write(results_json + '\n')
+    else:
+        print(results_json)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf8') as baseline_file:
+            return _report_regressions(json.load(baseline_file), results, args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,88 @@
+'''
+Compares two benchmark result files and reports the measurements that regressed beyond a threshold.
+'''
+from __future__ import annotations
+from dataclasses import dataclass
+
+# measurements where a larger value is worse, and the default relative increase tolerated for each
+DEFAULT_THRESHOLDS: dict[str, float] = {
+    'wall_seconds': 0.10,
+    'peak_rss_bytes': 0.10,
+    'bytes_on_disk': 0.05,
+    'objects_written': 0.0,
+    'hit_microseconds': 0.10,
+    'miss_microseconds': 0.10,
+    'open_microseconds': 0.10,
+}
+
+
+@dataclass
+class Comparison():
+    '''
+    One measurement of one step in both runs.
+
+    Attributes:
+        step_name (str): the benchmark step, e.g. 'commit_warm'
+        metric_name (str): the measurement, e.g. 'wall_seconds'
+        baseline_value (float): the measurement in the baseline run
+        current_value (float): the measurement in the current run
+        threshold (float): the relative increase tolerated
+    '''
+    step_name: str
+    metric_name: str
+    baseline_value: float
+    current_value: float
+    threshold: float
+
+    @property
+    def change(self) -> float:
+        '''
+        The relative change from the baseline, e.g. 0.25 for 25% larger.
+        '''
+        if not self.baseline_value:
+            return 0.0 if not self.current_value else float('inf')
+        return (self.current_value - self.baseline_value) / self.baseline_value
+
+    @property
+    def regressed(self) -> bool:
+        return self.change > self.threshold
+
+
+def compare_results(baseline: dict, current: dict, thresholds: dict[str, float] = None) -> list[Comparison]:
+    '''
+    Pairs up every measurement that both runs recorded for the same step.
+
+    Args:
+        baseline (dict): results of the earlier run
+        current (dict): results of the run being checked
+        thresholds (dict[str, float]): relative increase tolerated per measurement, overriding DEFAULT_THRESHOLDS
+
+    Returns:
+        list[Comparison]: one comparison per measurement, in step order
+    '''
+    merged_thresholds: dict[str, float] = dict(DEFAULT_THRESHOLDS)
+    merged_thresholds.update(thresholds or {})
+    comparisons: list[Comparison] = []
+    for step_name, current_measurements in current['steps'].items():
+        baseline_measurements: dict = baseline['steps'].get(step_name)
+        if baseline_measurements is None:
+            continue
+        for metric_name, threshold in merged_thresholds.items():
+            baseline_value = baseline_measurements.get(metric_name)
+            current_value = current_measurements.get(metric_name)
+            if baseline_value is None or current_value is None:
+                continue
+            comparisons.append(Comparison(step_name, metric_name, baseline_value, current_value, threshold))
+    return comparisons
+
+
+def format_comparisons(comparisons: list[Comparison]) -> str:
+    '''
+    Formats comparisons as a table, flagging the ones that regressed.
+    '''
+    lines: list[str] = [f'{"step":<16} {"metric":<18} {"baseline":>14} {"current":>14} {"change":>9}']
+    for comparison in comparisons:
+        flag: str = '  REGRESSED' if comparison.regressed else ''
+        lines.append(f'{comparison.step_name:<16} {comparison.metric_name:<18} {comparison.baseline_value:>14.6g} '
+                     f'{comparison.current_value:>14.6g} {comparison.change:>+8.1%}{flag}')
+    return '\n'.join(lines)
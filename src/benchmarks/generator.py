@@ -0,0 +1,131 @@
+'''
+Contains RepoSpec, which describes a synthetic repository, and the functions that build such a repository and
+change part of it between commits. Generation is seeded, so the same spec always produces the same files.
+'''
+from __future__ import annotations
+import os
+import random
+from dataclasses import dataclass, field
+
+# the range of sizes (in bytes) of each size class that RepoSpec.size_weights can pick from
+SIZE_CLASSES: dict[str, tuple[int, int]] = {
+    'tiny': (0, 64),
+    'small': (65, 4 * 1024),
+    'medium': (4 * 1024 + 1, 256 * 1024),
+    'large': (256 * 1024 + 1, 16 * 1024 * 1024),
+}
+# files of this class are sparse: only a little data at their start and end is written, the rest is a hole
+HUGE_SIZE_CLASS: str = 'huge'
+SPARSE_DATA_SIZE: int = 4096
+GENERATE_CHUNK_SIZE: int = 1024 * 1024
+
+_WORDS: list[str] = ('def return import class self for in if else while with as from try except raise yield lambda '
+                     'data value index result path file tree blob commit hash size count name list dict str int '
+                     'the of and to a is that it on was by at be this which or').split()
+
+
+@dataclass
+class RepoSpec():
+    '''
+    The shape of a synthetic repository.
+
+    Attributes:
+        file_count (int): number of files
+        depth (int): number of levels of directories below the root
+        fan_out (int): number of subdirectories in each directory above the deepest level
+        size_weights (dict[str, float]): relative share of files in each size class ('tiny', 'small', 'medium',
+            'large' and 'huge')
+        huge_size (int): size in bytes of every 'huge' file, which is written sparsely
+        binary_ratio (float): share of files holding random (incompressible) bytes rather than text
+        change_fraction (float): share of files rewritten by change_repo between commits
+        seed (int): seed of the random generator
+    '''
+    file_count: int = 2000
+    depth: int = 3
+    fan_out: int = 4
+    size_weights: dict[str, float] = field(
+        default_factory=lambda: {'tiny': 0.3, 'small': 0.5, 'medium': 0.18, 'large': 0.02, HUGE_SIZE_CLASS: 0.0})
+    huge_size: int = 2 * 1024 * 1024 * 1024
+    binary_ratio: float = 0.2
+    change_fraction: float = 0.05
+    seed: int = 0
+
+
+def _directory_paths(root_path: str, spec: RepoSpec) -> list[str]:
+    directory_paths: list[str] = [root_path]
+    curr_level: list[str] = [root_path]
+    for level in range(spec.depth):
+        next_level: list[str] = [os.path.join(parent_path, f'dir{level}_{child_idx}')
+                                 for parent_path in curr_level for child_idx in range(spec.fan_out)]
+        directory_paths.extend(next_level)
+        curr_level = next_level
+    return directory_paths
+
+
+def _iter_text(rng: random.Random, size: int):
+    remaining: int = size
+    while remaining > 0:
+        chunk: bytes = ' '.join(rng.choices(_WORDS, k=GENERATE_CHUNK_SIZE // 4)).encode()[:remaining]
+        # break the text into lines like source code
+        chunk = chunk.replace(b' the ', b'\nthe ')
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _write_file(file_path: str, rng: random.Random, size_class: str, is_binary: bool, spec: RepoSpec) -> None:
+    with open(file_path, 'wb') as out_file:
+        if size_class == HUGE_SIZE_CLASS:
+            out_file.write(rng.randbytes(SPARSE_DATA_SIZE))
+            out_file.seek(max(spec.huge_size - SPARSE_DATA_SIZE, SPARSE_DATA_SIZE))
+            out_file.write(rng.randbytes(SPARSE_DATA_SIZE))
+            out_file.truncate(max(spec.huge_size, 2 * SPARSE_DATA_SIZE))
+            return
+        size: int = rng.randint(*SIZE_CLASSES[size_class])
+        if is_binary:
+            for start in range(0, size, GENERATE_CHUNK_SIZE):
+                out_file.write(rng.randbytes(min(GENERATE_CHUNK_SIZE, size - start)))
+        else:
+            for chunk in _iter_text(rng, size):
+                out_file.write(chunk)
+
+
+def generate_repo(root_path: str, spec: RepoSpec) -> list[tuple[str, str, bool]]:
+    '''
+    Creates the directories and files of a synthetic repository under root_path.
+
+    Returns:
+        list[tuple[str, str, bool]]: the path, size class and whether it is binary of every generated file
+    '''
+    rng = random.Random(spec.seed)
+    directory_paths: list[str] = _directory_paths(root_path, spec)
+    for directory_path in directory_paths:
+        os.makedirs(directory_path, exist_ok=True)
+    size_classes: list[str] = list(spec.size_weights)
+    generated_files: list[tuple[str, str, bool]] = []
+    for file_idx in range(spec.file_count):
+        size_class: str = rng.choices(size_classes, weights=[spec.size_weights[name] for name in size_classes])[0]
+        is_binary: bool = rng.random() < spec.binary_ratio
+        file_path: str = os.path.join(rng.choice(directory_paths), f'file{file_idx}.{"bin" if is_binary else "txt"}')
+        _write_file(file_path, rng, size_class, is_binary, spec)
+        generated_files.append((file_path, size_class, is_binary))
+    return generated_files
+
+
+def change_repo(generated_files: list[tuple[str, str, bool]], spec: RepoSpec, round_idx: int = 1) -> int:
+    '''
+    Rewrites spec.change_fraction of the generated files with new contents of the same size class. Sparse files
+    only get a block of new data written into them.
+
+    Returns:
+        int: the number of files changed
+    '''
+    rng = random.Random(spec.seed + round_idx)
+    changed_count: int = round(len(generated_files) * spec.change_fraction)
+    for file_path, size_class, is_binary in rng.sample(generated_files, changed_count):
+        if size_class == HUGE_SIZE_CLASS:
+            with open(file_path, 'r+b') as out_file:
+                out_file.seek(rng.randrange(0, max(spec.huge_size - SPARSE_DATA_SIZE, 1)))
+                out_file.write(rng.randbytes(SPARSE_DATA_SIZE))
+        else:
+            _write_file(file_path, rng, size_class, is_binary, spec)
+    return changed_count
@@ -0,0 +1,148 @@
+'''
+Runs the benchmark steps against a synthetic repository and collects their measurements.
+
+Every step runs in a fresh worker process (see worker), and the object store is inspected before and after it to
+count the objects written and the bytes on disk.
+'''
+from __future__ import annotations
+import dataclasses
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.generator import RepoSpec, change_repo, generate_repo
+from classes.gitpack import GitPack
+
+RESULTS_VERSION: int = 1
+SRC_DIR_PATH: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def disk_usage(dir_path: str) -> tuple[int, int]:
+    '''
+    Returns the bytes allocated on disk and the apparent size (the sum of the file sizes) of everything under
+    dir_path. The two differ for sparse files.
+    '''
+    allocated_bytes: int = 0
+    apparent_bytes: int = 0
+    for curr_dir_path, _, file_names in os.walk(dir_path):
+        for file_name in file_names:
+            file_stat: os.stat_result = os.lstat(os.path.join(curr_dir_path, file_name))
+            apparent_bytes += file_stat.st_size
+            allocated_bytes += getattr(file_stat, 'st_blocks', file_stat.st_size // 512) * 512
+    return allocated_bytes, apparent_bytes
+
+
+def count_objects(kr_git_root: str) -> int:
+    '''
+    Returns the number of objects in the store, loose or packed.
+    '''
+    object_count: int = 0
+    for object_dir_name in ('blobs', 'trees', 'commits'):
+        object_dir_path: str = os.path.join(kr_git_root, object_dir_name)
+        if not os.path.isdir(object_dir_path):
+            continue
+        for fan_out_name in os.listdir(object_dir_path):
+            fan_out_path: str = os.path.join(object_dir_path, fan_out_name)
+            if len(fan_out_name) == 2 and os.path.isdir(fan_out_path):
+                object_count += len(os.listdir(fan_out_path))
+    return object_count + sum(pack.object_count for pack in GitPack.load_packs(kr_git_root, reload=True))
+
+
+def _run_worker(step_name: str, repo_path: str, options: dict) -> dict:
+    env: dict[str, str] = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SRC_DIR_PATH, env.get('PYTHONPATH')]))
+    completed = subprocess.run([sys.executable, '-m', 'benchmarks.worker', step_name, repo_path, json.dumps(options)],
+                               cwd=SRC_DIR_PATH, env=env, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure_step(step_name: str, repo_path: str, options: dict, measured_dir_path: str = None) -> dict:
+    '''
+    Runs one step in a worker and adds the objects it wrote and the size of measured_dir_path (the object store
+    by default) once it is done.
+    '''
+    kr_git_root: str = os.path.join(repo_path, '.kr_git')
+    objects_before: int = count_objects(kr_git_root)
+    measurements: dict = _run_worker(step_name, repo_path, options)
+    objects_after: int = count_objects(kr_git_root)
+    measurements['objects_written'] = max(objects_after - objects_before, 0)
+    measurements['object_count'] = objects_after
+    measurements['bytes_on_disk'], measurements['apparent_bytes'] = disk_usage(measured_dir_path or kr_git_root)
+    return measurements
+
+
+def _environment() -> dict:
+    try:
+        krgit_revision: str = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SRC_DIR_PATH, capture_output=True,
+                                             text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        krgit_revision = None
+    return {
+        'krgit_revision': krgit_revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_benchmarks(spec: RepoSpec, jobs: int = None, lookup_count: int = 1000, work_dir_path: str = None,
+                   keep: bool = False, log=print) -> dict:
+    '''
+    Generates a repository from spec and measures, in order: a cold commit (no index), a warm commit (nothing
+    changed), a commit after changing spec.change_fraction of the files, object lookups, a full restore, gc and
+    object lookups again once everything is packed.
+
+    Args:
+        spec (RepoSpec): the repository to generate
+        jobs (int): worker threads for commit and restore. Defaults to the CPU count.
+        lookup_count (int): number of objects looked up by the lookup steps
+        work_dir_path (str): directory to generate the repository in. A temporary directory by default.
+        keep (bool): leave the generated repository and restore on disk
+        log: called with a progress message before each step
+
+    Returns:
+        dict: the spec, the environment and the measurements of every step, ready to be written as JSON
+    '''
+    base_dir_path: str = work_dir_path or tempfile.mkdtemp(prefix='krgit-bench-')
+    repo_path: str = os.path.join(base_dir_path, 'repo')
+    restore_path: str = os.path.join(base_dir_path, 'restore')
+    results: dict = {'version': RESULTS_VERSION, 'spec': dataclasses.asdict(spec), 'environment': _environment(),
+                     'steps': {}}
+    try:
+        log(f'Generating {spec.file_count} files in {repo_path}')
+        start_time: float = time.perf_counter()
+        generated_files = generate_repo(repo_path, spec)
+        os.mkdir(os.path.join(repo_path, '.kr_git'))
+        allocated_bytes, apparent_bytes = disk_usage(repo_path)
+        results['repo'] = {'generate_seconds': time.perf_counter() - start_time, 'bytes_on_disk': allocated_bytes,
+                           'apparent_bytes': apparent_bytes}
+
+        step_options: dict = {'jobs': jobs, 'lookup_count': lookup_count, 'seed': spec.seed,
+                              'restore_path': restore_path}
+        steps: dict = results['steps']
+        log('Timing cold commit')
+        steps['commit_cold'] = measure_step('commit', repo_path, step_options)
+        log('Timing warm commit')
+        steps['commit_warm'] = measure_step('commit', repo_path, step_options)
+        changed_count: int = change_repo(generated_files, spec)
+        log(f'Timing commit after changing {changed_count} files')
+        steps['commit_changed'] = measure_step('commit', repo_path, step_options)
+        steps['commit_changed']['files_changed'] = changed_count
+        log('Timing loose object lookups')
+        steps['lookup_loose'] = measure_step('lookup', repo_path, step_options)
+        log('Timing restore')
+        os.makedirs(restore_path, exist_ok=True)
+        steps['restore'] = measure_step('restore', repo_path, step_options, restore_path)
+        log('Timing gc')
+        steps['gc'] = measure_step('gc', repo_path, step_options)
+        log('Timing packed object lookups')
+        steps['lookup_packed'] = measure_step('lookup', repo_path, step_options)
+    finally:
+        if not keep:
+            shutil.rmtree(base_dir_path if work_dir_path is None else repo_path, ignore_errors=True)
+            shutil.rmtree(restore_path, ignore_errors=True)
+    return results
@@ -0,0 +1,120 @@
+'''
+Runs a single benchmark step in its own process, so that the peak RSS it reports belongs to that step alone.
+
+Usage: python -m benchmarks.worker <step> <repo path> <options as JSON>
+
+The step's own output is discarded and a single JSON object with its measurements is printed instead.
+'''
+from __future__ import annotations
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where peak RSS is not reported
+    resource = None
+
+import command_functions as cmd
+from classes.gitobj import GitObject
+from classes.gitpack import GitPack
+from classes.gitrepository import Repository
+
+
+def peak_rss_bytes() -> int:
+    '''
+    Returns the peak resident set size of this process in bytes, or None if it cannot be measured.
+    '''
+    if resource is None:
+        return None
+    max_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _sample_objects(kr_git_root: str, sample_count: int, seed: int) -> list[tuple[str, str]]:
+    stored_objects: list[tuple[str, str]] = []
+    for object_dir_name in ('blobs', 'trees', 'commits'):
+        object_dir_path: str = os.path.join(kr_git_root, object_dir_name)
+        if not os.path.isdir(object_dir_path):
+            continue
+        for fan_out_name in os.listdir(object_dir_path):
+            fan_out_path: str = os.path.join(object_dir_path, fan_out_name)
+            if len(fan_out_name) == 2 and os.path.isdir(fan_out_path):
+                stored_objects.extend((object_dir_name, fan_out_name + object_file_name)
+                                      for object_file_name in os.listdir(fan_out_path))
+    for pack in GitPack.load_packs(kr_git_root, reload=True):
+        stored_objects.extend((pack_entry.object_dir_name, sha1) for sha1, pack_entry in pack.iter_entries())
+    rng = random.Random(seed)
+    return rng.sample(stored_objects, min(sample_count, len(stored_objects)))
+
+
+def lookup(options: dict) -> dict:
+    '''
+    Times checking for and opening a random sample of stored objects, plus checking for the same number of
+    objects that are not stored.
+    '''
+    kr_git_root: str = Repository.current().kr_git_root
+    sampled_objects: list[tuple[str, str]] = _sample_objects(kr_git_root, options.get('lookup_count', 1000),
+                                                             options.get('seed', 0))
+    rng = random.Random(options.get('seed', 0))
+    missing_sha1s: list[str] = [rng.randbytes(20).hex() for _ in sampled_objects]
+
+    start_time: float = time.perf_counter()
+    for object_dir_name, sha1 in sampled_objects:
+        GitObject.object_exists(object_dir_name, sha1)
+    hit_seconds: float = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for sha1 in missing_sha1s:
+        GitObject.object_exists('blobs', sha1)
+    miss_seconds: float = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for object_dir_name, sha1 in sampled_objects:
+        with GitObject.open_object(object_dir_name, sha1) as compressed_file:
+            compressed_file.read(1)
+    open_seconds: float = time.perf_counter() - start_time
+
+    lookup_count: int = max(len(sampled_objects), 1)
+    return {
+        'lookup_count': len(sampled_objects),
+        'hit_microseconds': hit_seconds / lookup_count * 1_000_000,
+        'miss_microseconds': miss_seconds / lookup_count * 1_000_000,
+        'open_microseconds': open_seconds / lookup_count * 1_000_000,
+    }
+
+
+STEPS: dict[str, Callable[[dict], dict]] = {
+    'commit': lambda options: cmd.make_commit(options.get('jobs')),
+    'restore': lambda options: cmd.restore(options['restore_path'], options.get('jobs')) and None,
+    'gc': lambda options: cmd.gc(),
+    'lookup': lookup,
+}
+
+
+def run_step(step_name: str, repo_path: str, options: dict) -> dict:
+    '''
+    Runs one step inside repo_path and measures it.
+
+    Returns:
+        dict: the step's wall time and peak RSS, along with any measurements of the step itself
+    '''
+    os.chdir(repo_path)
+    start_time: float = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        step_result: dict = STEPS[step_name](options)
+    wall_seconds: float = time.perf_counter() - start_time
+    measurements: dict = {'wall_seconds': wall_seconds, 'peak_rss_bytes': peak_rss_bytes()}
+    measurements.update(step_result or {})
+    return measurements
+
+
+if __name__ == '__main__':
+    print(json.dumps(run_step(sys.argv[1], sys.argv[2], json.loads(sys.argv[3]))))
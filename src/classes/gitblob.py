@@ -1,19 +1,37 @@
 '''
 Contains the gitblob class, which pertains to the Git BLOB object type
+
+Blobs are written in the v2 format, whose header is `blob {size}`, so that a blob's sha1 depends only on the file's
+contents and identical files share one object. The file name lives in the tree entry that points at the blob.
+Blobs in the v1 format, whose header was `blob {file_path} {size}`, can still be read.
+
+Files committed as CHUNKED tree entries are stored as chunks, each an ordinary v2 blob, and a manifest blob whose
+header is `chunked {size}` (size being that of the whole file) followed by a MANIFEST_RECORD per chunk: the raw
+20-byte sha1 of its blob and its size. Every reader in this module expands manifests, so the contents of a chunked
+file are streamed chunk by chunk wherever a blob's contents are read.
 '''
 from __future__ import annotations
-import zlib
+import hashlib
+import itertools
 import os
-from pathlib import Path
-from classes.utils import find_kr_git_root
-from classes.gitobj import GitObject
+import struct
+from typing import BinaryIO, Iterable, Iterator
+from classes.gitobj import GitObject, STREAM_CHUNK_SIZE
+from classes.gitrepository import ObjectStore, Repository
+from classes.gittrace import tracer
+from classes.utils import EntryType
+
+CHUNKED_HEADER_PREFIX: bytes = b'chunked '
+MANIFEST_RECORD = struct.Struct('>20sI')
 
 class GitBlob(GitObject):
     '''
     Represents a BLOB object (which is a representation for an individual code file).
 
     Attributes:
-        file_path (str): absolute path of the file that the object is representing.
+        file_path (str): absolute path of the file that the object is representing. Not part of the serialized
+            blob; when writing, it lets the compression policy see the file's extension, and only v1 blobs read
+            back from the repo carry it.
         binary_data (bytes): Uncompressed binary data of the file's contents.
         sha1 (str): sha1 hash of the GitBlob object. None if the object has not been written to a file yet.
     '''
@@ -36,31 +54,36 @@ class GitBlob(GitObject):
         Returns:
             bytes: the serialized (but uncompressed) data to put into the blob file
         '''
-        header: bytes = f'blob {self.file_path} {len(self.binary_data)}\0'.encode()
+        header: bytes = f'blob {len(self.binary_data)}\0'.encode()
         out: bytes = header + self.binary_data
         return out
 
 
-    def write_to_file(self: GitBlob) -> None:
+    def write_to_file(self: GitBlob, repository: Repository = None) -> None:
         '''
         Takes a GitBlob object, serializes it, compresses it,  and writes it to its appropriate location in .kr_git/blobs/...
 
         Args:
             self: the object to write to a file
+            repository (Repository): the repository to write to, if not the current one
         
         Returns:
             None
         '''
-        uncompressed_serialized_content: bytes = self.serialize()
-        uncompressed_sha1: str = self.hash(uncompressed_serialized_content)
-        compressed_content = zlib.compress(uncompressed_serialized_content)
-        kr_git_root_path: Path = find_kr_git_root(Path('.').resolve())
-        target_dir_path: Path = kr_git_root_path / 'blobs' / uncompressed_sha1[:2]
-        os.makedirs(target_dir_path, exist_ok=True)
-        target_file_path: Path = target_dir_path / uncompressed_sha1[2:]
-        with open(str(target_file_path), 'wb') as out_file:
-            out_file.write(compressed_content)
-        self.sha1 = uncompressed_sha1
+        self.sha1 = self._write_serialized(self.serialize(), self.file_path, repository)
+
+    @classmethod
+    def _write_serialized(cls, serialized_content: bytes, path_hint: str = None,
+                          repository: Repository = None) -> str:
+        uncompressed_sha1: str = cls.hash(serialized_content)
+        repository = repository or Repository.current()
+        object_store: ObjectStore = repository.object_store
+        # identical content is already stored under the same sha1, so there is nothing to compress or write
+        if not object_store.freshen('blobs', uncompressed_sha1):
+            object_store.write('blobs', uncompressed_sha1, cls.compress(serialized_content, path_hint, repository))
+        else:
+            tracer.count('objects_skipped')
+        return uncompressed_sha1
 
     @classmethod
     def init_gitblob_from_original_file(cls, target_file_path: str) -> GitBlob:
@@ -80,26 +103,329 @@ class GitBlob(GitObject):
             out_gb_obj.binary_data = f.read()
         return out_gb_obj
 
+    @classmethod
+    def write_original_file(cls, target_file_path: str, repository: Repository = None) -> str:
+        '''
+        Writes a blob for an original file. This is the unit of work that commits hand to their worker pool.
+
+        Files that fit in a single STREAM_CHUNK_SIZE piece are hashed first and only compressed if no blob with
+        the same sha1 exists yet. Larger files are streamed through write_from_chunks so that they are never held
+        in memory.
+
+        Args:
+            cls: the GitBlob class
+            target_file_path (str): the file path of the file to write a blob for.
+            repository (Repository): the repository to write to, if not the current one
+
+        Returns:
+            str: sha1 of the written blob
+
+        Throws:
+            OSError: if the file changed size while it was being read
+        '''
+        with open(target_file_path, 'rb') as in_file:
+            file_size: int = os.fstat(in_file.fileno()).st_size
+            if file_size <= STREAM_CHUNK_SIZE:
+                curr_gitblob: GitBlob = GitBlob()
+                curr_gitblob.file_path = target_file_path
+                with tracer.phase('read'):
+                    curr_gitblob.binary_data = in_file.read()
+                tracer.count('bytes_read', len(curr_gitblob.binary_data))
+                curr_gitblob.write_to_file(repository)
+                return curr_gitblob.sha1
+            return cls.write_from_chunks(cls._iter_file_chunks(in_file), file_size, target_file_path, repository)
+
+    @classmethod
+    def write_symlink(cls, link_path: str, repository: Repository = None) -> str:
+        '''
+        Writes a blob holding the target of a symlink, which is what a tree's SYMLINK entry points at. The link is
+        never followed.
+
+        Args:
+            cls: the GitBlob class
+            link_path (str): the path of the symlink
+            repository (Repository): the repository to write to, if not the current one
+
+        Returns:
+            str: sha1 of the written blob
+        '''
+        curr_gitblob: GitBlob = GitBlob()
+        curr_gitblob.binary_data = os.readlink(os.fsencode(link_path))
+        curr_gitblob.write_to_file(repository)
+        return curr_gitblob.sha1
+
+    @classmethod
+    def write_chunked_file(cls, target_file_path: str, repository: Repository = None) -> str:
+        '''
+        Writes a large file as content-defined chunks, cut by the repo's chunking policy, and a manifest listing
+        them. Chunks that are already stored, from an earlier version of the file or from any other file, are not
+        written again.
+
+        Args:
+            cls: the GitBlob class
+            target_file_path (str): the file path of the file to write
+            repository (Repository): the repository to write to, if not the current one
+
+        Returns:
+            str: sha1 of the manifest, which is what a CHUNKED tree entry points at
+        '''
+        repository = repository or Repository.current()
+        chunking_policy = repository.chunking_policy
+        manifest_records: list[bytes] = []
+        file_size: int = 0
+        with open(target_file_path, 'rb') as in_file:
+            for chunk in chunking_policy.split(cls._iter_file_chunks(in_file)):
+                chunk_gitblob: GitBlob = GitBlob()
+                chunk_gitblob.file_path = target_file_path
+                chunk_gitblob.binary_data = chunk
+                chunk_gitblob.write_to_file(repository)
+                tracer.count('chunks_cut')
+                manifest_records.append(MANIFEST_RECORD.pack(bytes.fromhex(chunk_gitblob.sha1), len(chunk)))
+                file_size += len(chunk)
+        return cls._write_serialized(f'chunked {file_size}\0'.encode() + b''.join(manifest_records),
+                                     repository=repository)
+
+    @classmethod
+    def write_entry(cls, file_path: str, entry_type: EntryType, repository: Repository = None) -> str:
+        '''
+        Writes the blob of a walked file, symlink or chunked file, depending on the type of its tree entry, to
+        repository if given and to the current repository otherwise.
+
+        Returns:
+            str: sha1 of the written blob (of the manifest for a chunked file)
+        '''
+        if entry_type == EntryType.SYMLINK:
+            return cls.write_symlink(file_path, repository)
+        if entry_type == EntryType.CHUNKED:
+            return cls.write_chunked_file(file_path, repository)
+        return cls.write_original_file(file_path, repository)
+
+    @classmethod
+    def parse_manifest(cls, manifest_records: bytes) -> list[tuple[str, int]]:
+        '''
+        Parses the records of a manifest (what follows its header) into the sha1 and size of each chunk, in order.
+        '''
+        return [(chunk_sha1.hex(), chunk_size)
+                for chunk_sha1, chunk_size in MANIFEST_RECORD.iter_unpack(manifest_records)]
+
+    @classmethod
+    def read_manifest(cls, blob_hash: str, object_store: ObjectStore = None) -> list[tuple[str, int]]:
+        '''
+        Reads the chunks listed by the manifest of a chunked file, from object_store if given and from the current
+        repository otherwise.
+
+        Returns:
+            list[tuple[str, int]]: the sha1 and size of each chunk, in order
+
+        Throws:
+            ValueError: if the blob is not a manifest
+        '''
+        serialized_manifest: bytes = cls.read_object('blobs', blob_hash, object_store)
+        if not serialized_manifest.startswith(CHUNKED_HEADER_PREFIX):
+            raise ValueError(f'Blob {blob_hash} is not the manifest of a chunked file')
+        return cls.parse_manifest(serialized_manifest[serialized_manifest.index(b'\0') + 1:])
+
+    @classmethod
+    def _iter_file_chunks(cls, in_file: BinaryIO) -> Iterator[bytes]:
+        while True:
+            with tracer.phase('read'):
+                chunk: bytes = in_file.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            tracer.count('bytes_read', len(chunk))
+            yield chunk
+
+    @classmethod
+    def write_from_chunks(cls, content_chunks: Iterable[bytes], content_size: int, source_name: str,
+                          repository: Repository = None) -> str:
+        '''
+        Writes a blob without holding its contents in memory. The contents are streamed through an incremental sha1
+        and compressor into a temporary file, which is renamed into .kr_git/blobs/... once the sha1 is known (or
+        discarded if a blob with that sha1 already exists). The codec is chosen by the repo's compression policy
+        from source_name and the first chunk of the contents.
+
+        Args:
+            cls: the GitBlob class
+            content_chunks (Iterable[bytes]): the contents of the blob, in order
+            content_size (int): total size of the contents, which goes into the blob header
+            source_name (str): name of where the contents come from, used in error messages
+            repository (Repository): the repository to write to, if not the current one
+
+        Returns:
+            str: sha1 of the written blob
+
+        Throws:
+            OSError: if content_chunks does not add up to content_size
+        '''
+        repository = repository or Repository.current()
+        object_store: ObjectStore = repository.object_store
+        header: bytes = f'blob {content_size}\0'.encode()
+        hasher = hashlib.sha1(header)
+        content_chunks = iter(content_chunks)
+        first_chunk: bytes = next(content_chunks, b'')
+        codec, level = repository.compression_policy.choose(first_chunk, content_size, source_name)
+        tracer.count(f'objects_{codec.name}')
+        compressor = codec.compressor(level)
+        temp_fd, temp_file_path = object_store.create_temp_file('blobs')
+        try:
+            with os.fdopen(temp_fd, 'wb') as out_file:
+                out_file.write(codec.header + compressor.compress(header))
+                bytes_read: int = 0
+                bytes_compressed: int = 0
+                for chunk in itertools.chain((first_chunk,), content_chunks):
+                    bytes_read += len(chunk)
+                    with tracer.phase('hash'):
+                        hasher.update(chunk)
+                    with tracer.phase('compress'):
+                        compressed_chunk: bytes = compressor.compress(chunk)
+                    with tracer.phase('write'):
+                        out_file.write(compressed_chunk)
+                    bytes_compressed += len(compressed_chunk)
+                compressed_chunk = compressor.flush()
+                with tracer.phase('write'):
+                    out_file.write(compressed_chunk)
+                tracer.count('bytes_hashed', len(header) + bytes_read)
+                tracer.count('bytes_raw', len(header) + bytes_read)
+                tracer.count('bytes_compressed', bytes_compressed + len(compressed_chunk))
+            if bytes_read != content_size:
+                raise OSError(f'{source_name} changed size while it was being committed')
+            uncompressed_sha1: str = hasher.hexdigest()
+            object_store.install_temp_file('blobs', uncompressed_sha1, temp_file_path)
+        except BaseException:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+        return uncompressed_sha1
+
+    @classmethod
+    def parse_header(cls, serialized_header: bytes) -> tuple[str, int]:
+        '''
+        Parses the header of a serialized blob in either the v1 (`blob {file_path} {size}`) or v2 (`blob {size}`)
+        format.
+
+        Args:
+            cls: the GitBlob class
+            serialized_header (bytes): the header, without its terminating null byte
+
+        Returns:
+            tuple[str, int]: the file path stored in the header (None for v2 blobs) and the size of the contents
+        '''
+        header: str = serialized_header.decode()
+        first_space_idx: int = header.find(' ')
+        last_space_idx: int = header.rfind(' ')
+        content_size: int = int(header[last_space_idx + 1:])
+        if first_space_idx == last_space_idx:
+            return None, content_size
+        return header[first_space_idx + 1:last_space_idx], content_size
+
+    @classmethod
+    def read_header_from_blob_file(cls, file_path: str) -> tuple[str, int]:
+        '''
+        Reads the header of a serialized blob file without inflating the rest of it. See parse_header.
+        '''
+        with open(file_path, 'rb') as blob_file:
+            return cls._read_header(blob_file)
+
+    @classmethod
+    def read_header_from_blob_hash(cls, blob_hash: str, object_store: ObjectStore = None) -> tuple[str, int]:
+        '''
+        Reads the header of the blob with the given hash without inflating the rest of it, from object_store if
+        given and from the current repository otherwise. See parse_header.
+        '''
+        with cls.open_object('blobs', blob_hash, object_store) as blob_file:
+            return cls._read_header(blob_file)
+
+    @classmethod
+    def _read_header(cls, compressed_file: BinaryIO) -> tuple[str, int]:
+        serialized_header = bytearray()
+        for decompressed_chunk in cls.inflate_stream(compressed_file):
+            null_byte_idx: int = decompressed_chunk.find(b'\0')
+            if null_byte_idx != -1:
+                serialized_header.extend(decompressed_chunk[:null_byte_idx])
+                break
+            serialized_header.extend(decompressed_chunk)
+        return cls.parse_header(bytes(serialized_header))
+
+    @classmethod
+    def iter_contents_from_blob_file(cls, file_path: str) -> Iterator[bytes]:
+        '''
+        Streams the contents of a serialized blob file (without its header) in pieces of at most about
+        STREAM_CHUNK_SIZE bytes, so that blobs of any size can be read back in bounded memory.
+
+        Args:
+            cls: the GitBlob class
+            file_path (str): path of the blob file in the .kr_git repo
+
+        Returns:
+            Iterator[bytes]: the contents of the original file, in order
+        '''
+        with open(file_path, 'rb') as blob_file:
+            yield from cls._iter_contents(blob_file)
+
+    @classmethod
+    def iter_contents_from_blob_hash(cls, blob_hash: str, object_store: ObjectStore = None) -> Iterator[bytes]:
+        '''
+        Streams the contents of the blob with the given hash, whether it is loose or packed, from object_store if
+        given and from the current repository otherwise. See iter_contents_from_blob_file.
+        '''
+        with cls.open_object('blobs', blob_hash, object_store) as blob_file:
+            yield from cls._iter_contents(blob_file, object_store)
+
+    @classmethod
+    def _iter_contents(cls, compressed_file: BinaryIO, object_store: ObjectStore = None) -> Iterator[bytes]:
+        decompressed_chunks: Iterator[bytes] = cls.inflate_stream(compressed_file)
+        serialized_header = bytearray()
+        for decompressed_chunk in decompressed_chunks:
+            null_byte_idx: int = decompressed_chunk.find(b'\0')
+            if null_byte_idx != -1:
+                serialized_header.extend(decompressed_chunk[:null_byte_idx])
+                decompressed_chunk = decompressed_chunk[null_byte_idx + 1:]
+                break
+            serialized_header.extend(decompressed_chunk)
+        else:
+            return
+        if serialized_header.startswith(CHUNKED_HEADER_PREFIX):
+            # the contents of a chunked file are those of its chunks, streamed one after the other
+            manifest_records: bytes = b''.join(itertools.chain((decompressed_chunk,), decompressed_chunks))
+            for chunk_sha1, _ in cls.parse_manifest(manifest_records):
+                yield from cls.iter_contents_from_blob_hash(chunk_sha1, object_store)
+            return
+        if decompressed_chunk:
+            yield decompressed_chunk
+        yield from decompressed_chunks
+
     @classmethod
     def init_gitblob_from_blob_file(cls, file_path: str) -> GitBlob:
         '''
         Takes in a serialized blob file (that would be stored in the .kr_git repo) and creates a GitBlob object out of it. This is a class method.
         '''
-        decompressed_file_contents: bytes = GitBlob.deserialize(file_path)
+        file_path_arr: list[str] = file_path.split('/')
+        with open(file_path, 'rb') as blob_file:
+            return cls._init_from_compressed_file(blob_file, file_path_arr[-2] + file_path_arr[-1])
+
+    @classmethod
+    def init_gitblob_from_blob_hash(cls, blob_hash: str) -> GitBlob:
+        '''
+        Creates a GitBlob object out of the blob with the given hash, whether it is loose or packed.
+        '''
+        with cls.open_object('blobs', blob_hash) as blob_file:
+            return cls._init_from_compressed_file(blob_file, blob_hash)
+
+    @classmethod
+    def _init_from_compressed_file(cls, compressed_file: BinaryIO, blob_hash: str) -> GitBlob:
+        decompressed_file_contents = bytearray()
+        for decompressed_chunk in cls.inflate_stream(compressed_file):
+            decompressed_file_contents.extend(decompressed_chunk)
         null_byte_idx: int = decompressed_file_contents.find(b'\0')
         serialized_header: bytes = decompressed_file_contents[:null_byte_idx]
-        print(serialized_header.decode().split())
-        _, curr_file_path, _ = serialized_header.decode().split()
-        serialized_blob_contents: bytes = decompressed_file_contents[null_byte_idx + 1:]
+        curr_file_path, _ = GitBlob.parse_header(bytes(serialized_header))
+        serialized_blob_contents: bytes = bytes(memoryview(decompressed_file_contents)[null_byte_idx + 1:])
+        if serialized_header.startswith(CHUNKED_HEADER_PREFIX):
+            serialized_blob_contents = b''.join(
+                b''.join(cls.iter_contents_from_blob_hash(chunk_sha1))
+                for chunk_sha1, _ in cls.parse_manifest(serialized_blob_contents))
         out_gitblob_obj = GitBlob()
         out_gitblob_obj.binary_data = serialized_blob_contents
         out_gitblob_obj.file_path = curr_file_path
-        file_path_arr: list[str] = file_path.split('/')
-        out_gitblob_obj.sha1 = file_path_arr[-2] + file_path_arr[-1]
+        out_gitblob_obj.sha1 = blob_hash
         return out_gitblob_obj
-
-    @classmethod
-    def init_gitblob_from_blob_hash(cls, blob_hash: str) -> GitBlob:
-        kr_git_root_path: str = find_kr_git_root(Path.cwd())
-        target_blob_file_path: str = os.path.join(kr_git_root_path, 'blobs', blob_hash[:2], blob_hash[2:])
-        return cls.init_gitblob_from_blob_file(target_blob_file_path)
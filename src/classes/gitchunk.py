@@ -0,0 +1,209 @@
+'''
+A module that contains the content-defined chunker that large files are split with, and the policy that decides
+which files are split.
+
+Files of at least min_file_size bytes are committed as CHUNKED tree entries: the file is cut into chunks, each
+chunk is stored as an ordinary blob, and the tree entry points at a manifest listing the chunks' blobs in order
+(see GitBlob.write_chunked_file). Since chunk boundaries depend on the contents around them rather than on their
+offset, an edit, insertion or deletion only changes the chunks it touches, and the rest are shared with earlier
+versions of the file and with every other file that holds the same data.
+
+Cut points are found FastCDC-style: a chunk ends after a byte where a rolling hash of the last CHUNK_WINDOW bytes
+has every bit of a mask clear. The mask has one bit more than log2(avg_chunk_size) until a chunk reaches the
+average size and one bit fewer after it, which pulls chunk sizes towards the average, and no chunk is cut shorter
+than min_chunk_size or longer than max_chunk_size. The hash at each byte is the sum of the last CHUNK_WINDOW bytes'
+random gear values, each shifted left by its distance from the byte, modulo 2 ** GEAR_BITS. Rather than rolling
+it byte by byte in Python, the gear values of a whole piece are laid out one per field of a big integer and summed
+with a handful of shifted additions, so every hash of the piece is computed by a few large-integer operations.
+
+The policy is read from .kr_git/chunking.json, if it exists, and otherwise uses the defaults of ChunkingPolicy:
+
+    {
+        "min_file_size": 16777216,    files at least this large are chunked; null to never chunk
+        "min_chunk_size": 262144,
+        "avg_chunk_size": 1048576,    rounded down to a power of two, at most 2 ** (GEAR_BITS - 1)
+        "max_chunk_size": 4194304
+    }
+
+Changing the policy only affects files committed from then on; their chunks then differ from earlier versions'.
+
+Classes contained:
+    1. ChunkingPolicy
+'''
+from __future__ import annotations
+import json
+import os
+import random
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+from classes.gittrace import tracer
+from classes.utils import EntryType
+
+POLICY_FILE_NAME: str = 'chunking.json'
+
+DEFAULT_MIN_FILE_SIZE: int = 16 * 1024 * 1024
+DEFAULT_MIN_CHUNK_SIZE: int = 256 * 1024
+DEFAULT_AVG_CHUNK_SIZE: int = 1024 * 1024
+DEFAULT_MAX_CHUNK_SIZE: int = 4 * 1024 * 1024
+
+GEAR_BITS: int = 24
+CHUNK_WINDOW: int = 16
+# a field holds the sum of CHUNK_WINDOW gear values shifted by up to CHUNK_WINDOW - 1 bits without overflowing
+_FIELD_SIZE: int = (GEAR_BITS + CHUNK_WINDOW + CHUNK_WINDOW.bit_length() + 7) // 8
+_GEAR_BYTES: int = GEAR_BITS // 8
+# the gear values are fixed forever: changing them would move every chunk boundary
+_GEAR_RANDOM: random.Random = random.Random(0x6b72676974)
+_GEAR: list[int] = [_GEAR_RANDOM.getrandbits(GEAR_BITS) for _ in range(256)]
+_GEAR_PLANES: list[bytes] = [bytes((gear >> (8 * plane_idx)) & 0xff for gear in _GEAR)
+                             for plane_idx in range(_GEAR_BYTES)]
+
+
+def _cut_mask(bit_count: int) -> int:
+    # the top bits of the hash depend on every byte of the window
+    return ((1 << bit_count) - 1) << (GEAR_BITS - bit_count)
+
+
+def _hash_fields(data: bytes, context: bytes) -> bytes:
+    '''
+    Computes the rolling hash at every byte of context + data, as the little-endian fields of a big integer.
+    '''
+    window_data: bytes = context + data
+    gear_fields = bytearray(len(window_data) * _FIELD_SIZE)
+    for plane_idx in range(_GEAR_BYTES):
+        gear_fields[plane_idx::_FIELD_SIZE] = window_data.translate(_GEAR_PLANES[plane_idx])
+    hash_sum: int = int.from_bytes(gear_fields, 'little')
+    # each addition doubles the number of window bytes summed into a field, the new ones shifted one bit further
+    term_count: int = 1
+    while term_count < CHUNK_WINDOW:
+        hash_sum += hash_sum << (term_count * (_FIELD_SIZE * 8 + 1))
+        term_count *= 2
+    # the sums carried past the last field are dropped along with them
+    return hash_sum.to_bytes(len(gear_fields) + CHUNK_WINDOW * (_FIELD_SIZE + 1), 'little')
+
+
+def _zero_map(hash_fields: bytes, first_field: int, field_count: int, mask: int) -> bytes:
+    '''
+    Returns a byte per hash field that is zero exactly where the hash has every bit of mask clear.
+    '''
+    zero_map: int = 0
+    for plane_idx in range(_GEAR_BYTES):
+        plane_mask: int = (mask >> (8 * plane_idx)) & 0xff
+        if not plane_mask:
+            continue
+        plane: bytes = hash_fields[first_field * _FIELD_SIZE + plane_idx:(first_field + field_count) * _FIELD_SIZE:
+                                   _FIELD_SIZE]
+        if plane_mask != 0xff:
+            plane = plane.translate(bytes(byte & plane_mask for byte in range(256)))
+        zero_map |= int.from_bytes(plane, 'little')
+    return zero_map.to_bytes(field_count, 'little')
+
+
+@dataclass
+class ChunkingPolicy():
+    '''
+    Decides which files are split into content-defined chunks, and splits them.
+
+    Attributes:
+        min_file_size (int): files of at least this many bytes are chunked, or None to never chunk
+        min_chunk_size (int): the smallest chunk cut, except at the end of a file
+        avg_chunk_size (int): the chunk size aimed for, a power of two
+        max_chunk_size (int): the largest chunk cut
+    '''
+    min_file_size: int = DEFAULT_MIN_FILE_SIZE
+    min_chunk_size: int = DEFAULT_MIN_CHUNK_SIZE
+    avg_chunk_size: int = DEFAULT_AVG_CHUNK_SIZE
+    max_chunk_size: int = DEFAULT_MAX_CHUNK_SIZE
+    _small_mask: int = field(init=False, repr=False)
+    _large_mask: int = field(init=False, repr=False)
+
+    def __post_init__(self):
+        avg_bits: int = max(round(self.avg_chunk_size).bit_length() - 1, 2)
+        if avg_bits + 1 > GEAR_BITS:
+            raise ValueError(f'avg_chunk_size can be at most {1 << (GEAR_BITS - 1)} bytes')
+        self.avg_chunk_size = 1 << avg_bits
+        if not 0 < self.min_chunk_size <= self.avg_chunk_size <= self.max_chunk_size:
+            raise ValueError('Chunk sizes must satisfy 0 < min_chunk_size <= avg_chunk_size <= max_chunk_size')
+        self._small_mask = _cut_mask(avg_bits + 1)
+        self._large_mask = _cut_mask(avg_bits - 1)
+
+    @classmethod
+    def load(cls, kr_git_root: str) -> ChunkingPolicy:
+        '''
+        Reads the policy of a repo from .kr_git/chunking.json, or returns the default policy if there is none.
+
+        Throws:
+            ValueError: if the file is not valid JSON or its chunk sizes are inconsistent
+        '''
+        try:
+            with open(os.path.join(kr_git_root, POLICY_FILE_NAME), 'r', encoding='utf8') as policy_file:
+                policy_dict: dict = json.load(policy_file)
+        except FileNotFoundError:
+            return cls()
+        return cls(min_file_size=policy_dict.get('min_file_size', DEFAULT_MIN_FILE_SIZE),
+                   min_chunk_size=policy_dict.get('min_chunk_size', DEFAULT_MIN_CHUNK_SIZE),
+                   avg_chunk_size=policy_dict.get('avg_chunk_size', DEFAULT_AVG_CHUNK_SIZE),
+                   max_chunk_size=policy_dict.get('max_chunk_size', DEFAULT_MAX_CHUNK_SIZE))
+
+    def file_entry_type(self, entry_type: EntryType, size: int) -> EntryType:
+        '''
+        Returns the tree entry type that a walked file of the given size is committed as: CHUNKED for regular files
+        of at least min_file_size bytes, and entry_type otherwise.
+        '''
+        if entry_type == EntryType.BLOB and self.min_file_size is not None and size >= self.min_file_size:
+            return EntryType.CHUNKED
+        return entry_type
+
+    def _find_cut(self, small_zero_map: bytearray, large_zero_map: bytearray, available: int) -> int:
+        if available <= self.min_chunk_size:
+            return available
+        # a cut after byte i makes a chunk of i + 1 bytes
+        cut_idx: int = small_zero_map.find(0, self.min_chunk_size - 1, min(self.avg_chunk_size, available))
+        if cut_idx == -1 and available > self.avg_chunk_size:
+            cut_idx = large_zero_map.find(0, self.avg_chunk_size, min(self.max_chunk_size, available))
+        if cut_idx == -1:
+            return min(self.max_chunk_size, available)
+        return cut_idx + 1
+
+    def split(self, pieces: Iterable[bytes]) -> Iterator[bytes]:
+        '''
+        Cuts a stream of data into content-defined chunks. The same data is always cut at the same places, however
+        it is split into pieces.
+
+        Args:
+            pieces (Iterable[bytes]): the data, in order, in pieces of any size
+
+        Returns:
+            Iterator[bytes]: the chunks, in order
+        '''
+        buffer = bytearray()
+        small_zero_map = bytearray()
+        large_zero_map = bytearray()
+        context: bytes = b''
+        for piece in pieces:
+            if not piece:
+                continue
+            with tracer.phase('chunk'):
+                if len(piece) > CHUNK_WINDOW and piece.count(piece[:1]) == len(piece):
+                    # a run of one byte value, like the holes of a sparse file, hashes the same everywhere once
+                    # the window is inside it, so only its first window is hashed
+                    hash_fields: bytes = _hash_fields(piece[:CHUNK_WINDOW], context)
+                    run_length: int = len(piece) - CHUNK_WINDOW
+                    small_zero_map += _zero_map(hash_fields, len(context), CHUNK_WINDOW, self._small_mask)
+                    small_zero_map += small_zero_map[-1:] * run_length
+                    large_zero_map += _zero_map(hash_fields, len(context), CHUNK_WINDOW, self._large_mask)
+                    large_zero_map += large_zero_map[-1:] * run_length
+                else:
+                    hash_fields: bytes = _hash_fields(piece, context)
+                    small_zero_map += _zero_map(hash_fields, len(context), len(piece), self._small_mask)
+                    large_zero_map += _zero_map(hash_fields, len(context), len(piece), self._large_mask)
+            tracer.count('bytes_chunked', len(piece))
+            buffer += piece
+            context = (context + piece[-(CHUNK_WINDOW - 1):])[-(CHUNK_WINDOW - 1):]
+            while len(buffer) >= self.max_chunk_size:
+                cut: int = self._find_cut(small_zero_map, large_zero_map, len(buffer))
+                yield bytes(buffer[:cut])
+                del buffer[:cut], small_zero_map[:cut], large_zero_map[:cut]
+        while buffer:
+            cut: int = self._find_cut(small_zero_map, large_zero_map, len(buffer))
+            yield bytes(buffer[:cut])
+            del buffer[:cut], small_zero_map[:cut], large_zero_map[:cut]
@@ -1,10 +1,15 @@
+'''
+Contains the GitCommit class, which pertains to the Git COMMIT object type
+
+Commits are written in the v2 format, whose body holds a `tree {sha1}` line followed by one `parent {sha1}` line per
+parent commit, so that history can be walked back from any commit. Commits in the v1 format, whose body was just
+the sha1 of the root tree, can still be read and have no parents.
+'''
 from __future__ import annotations
-import os
-from pathlib import Path
 from datetime import datetime
 from classes.gitobj import GitObject
 from classes.gittree import GitTree
-from classes.utils import find_kr_git_root
+from classes.gitrepository import ObjectStore, Repository
 class GitCommit(GitObject):
     '''
     An object to represent a git commit.
@@ -12,43 +17,48 @@ class GitCommit(GitObject):
     Attributes:
         root_tree_sha1 (str): sha1 of the root tree that this commit will point to.
         commit_sha1 (str): sha1 of the contents of the commit. None if the commit has not been written to a file yet
+        commit_time (str): when the commit was made, as a local ISO 8601 date and time
+        parent_sha1s (list[str]): sha1s of the commits this commit was made on top of. Empty for the first commit
     '''
 
     def __init__(self):
         self.root_tree_sha1: str = None
         self.commit_sha1: str = None
         self.commit_time: str = None
+        self.parent_sha1s: list[str] = []
     
     def serialize(self) -> bytes:
         header: bytes = f'COMMIT {self.commit_time}\0'.encode()
-        body: bytes = f'{self.root_tree_sha1}'.encode()
-        return header + body
+        body: str = f'tree {self.root_tree_sha1}\n'
+        for parent_sha1 in self.parent_sha1s:
+            body += f'parent {parent_sha1}\n'
+        return header + body.encode()
+
+    def commit_timestamp(self) -> int:
+        '''
+        Returns commit_time as the number of microseconds since the epoch.
+        '''
+        commit_datetime: datetime = datetime.fromisoformat(self.commit_time)
+        return int(commit_datetime.timestamp()) * 1_000_000 + commit_datetime.microsecond
     
-    def write_commit_to_file(self) -> None:
-        kr_git_root_path: str = find_kr_git_root(Path.cwd())
-        
+    def write_commit_to_file(self, repository: Repository = None) -> None:
+        repository = repository or Repository.current()
         uncompressed_content: bytes = self.serialize()
         uncompressed_sha1: str = GitCommit.hash(uncompressed_content)
-        compressed_content: bytes = GitCommit.compress(uncompressed_content)
-
-        target_file_path: str = os.path.join(kr_git_root_path, 'commits', uncompressed_sha1[:2])
-        os.makedirs(target_file_path, exist_ok=True)
-        target_file_path = os.path.join(target_file_path, uncompressed_sha1[2:])
-        
-        with open(target_file_path, 'wb') as out_file:
-            out_file.write(compressed_content)
-        
+        compressed_content: bytes = GitCommit.compress(uncompressed_content, repository=repository)
+        repository.object_store.write('commits', uncompressed_sha1, compressed_content)
         self.commit_sha1 = uncompressed_sha1
 
 
     @classmethod
-    def init_from_tree_object(cls, root_tree: GitTree) -> GitCommit:
+    def init_from_tree_object(cls, root_tree: GitTree, parent_sha1s: list[str] = None) -> GitCommit:
         '''
         Creates a GitCommit object from a GitTree. Instantiates the root_tree_sha1 field, but does not compute the hash of the GitCommit object.
 
         Args:
             cls: the GitCommit class
             root_tree (GitTree): the object representing the root tree of the repository.
+            parent_sha1s (list[str]): sha1s of the commits the new commit is made on top of
 
         Returns:
             GitCommit: the GitCommit object representing a commit that uses root_tree as the main tree.
@@ -59,25 +69,39 @@ class GitCommit(GitObject):
         curr_commit_obj: GitCommit = GitCommit()
         curr_commit_obj.root_tree_sha1 = root_tree.sha1
         curr_commit_obj.commit_time = str(datetime.now())
+        curr_commit_obj.parent_sha1s = list(parent_sha1s or [])
         return curr_commit_obj
 
     @classmethod
     def init_from_commit_file(cls, commit_file_path: str) -> GitCommit:
+        split_commit_file_path: list[str] = commit_file_path.split('/')
+        commit_sha1: str = split_commit_file_path[-2] + split_commit_file_path[-1]
+        return cls.init_from_serialized(GitCommit.deserialize(commit_file_path), commit_sha1)
+
+    @classmethod
+    def init_from_serialized(cls, deserialized_content: bytes, commit_sha1: str) -> GitCommit:
+        '''
+        Creates a GitCommit out of the decompressed contents of a commit object.
+        '''
         curr_commit_obj: GitCommit = GitCommit()
-        deserialized_content: bytes = GitCommit.deserialize(commit_file_path)
         null_byte_idx: int = deserialized_content.find(b'\0')
         header: str = deserialized_content[:null_byte_idx].decode()
         first_space_idx: int = header.find(' ')
         commit_time = header[first_space_idx + 1:]
         curr_commit_obj.commit_time = commit_time
         body: str = deserialized_content[null_byte_idx + 1:].decode()
-        curr_commit_obj.root_tree_sha1 = body.strip()
-        split_commit_file_path: list[str] = commit_file_path.split('/')
-        curr_commit_obj.commit_sha1 = split_commit_file_path[-2] + split_commit_file_path[-1]
+        if not body.startswith('tree '):
+            # a v1 commit, whose body is only the sha1 of the root tree
+            curr_commit_obj.root_tree_sha1 = body.strip()
+        for body_line in body.splitlines():
+            field_name, _, field_value = body_line.partition(' ')
+            if field_name == 'tree':
+                curr_commit_obj.root_tree_sha1 = field_value
+            elif field_name == 'parent':
+                curr_commit_obj.parent_sha1s.append(field_value)
+        curr_commit_obj.commit_sha1 = commit_sha1
         return curr_commit_obj
 
     @classmethod
-    def init_from_commit_hash(cls, commit_hash: str) -> GitCommit:
-        kr_git_root_path: str = find_kr_git_root(Path.cwd())
-        commit_file_path: str = os.path.join(kr_git_root_path, 'commits', commit_hash[:2], commit_hash[2:])
-        return cls.init_from_commit_file(commit_file_path)
+    def init_from_commit_hash(cls, commit_hash: str, object_store: ObjectStore = None) -> GitCommit:
+        return cls.init_from_serialized(GitCommit.read_object('commits', commit_hash, object_store), commit_hash)
@@ -0,0 +1,338 @@
+'''
+A module that contains the GitCommitGraph class, which caches the shape of the commit history in
+.kr_git/commit-graph so that history can be walked without inflating a commit object per step.
+
+The file holds GRAPH_MAGIC, a version byte and then:
+
+    a 256-entry fan-out table (the number of commits whose sha1 starts with a byte <= i)
+    the sorted binary sha1s of every commit
+    for each sorted sha1, the position of that commit's record
+    one fixed-width record per commit, in the order the commits were added (parents always come before their
+        children): the commit's sha1, its root tree sha1, its timestamp in microseconds, its generation number and
+        the positions of its first two parents
+    the extra edge list, holding the parents of commits that have more than two
+
+A parent position of NO_PARENT means there is no such parent. If the second parent position has EXTRA_EDGES_FLAG
+set, the rest of its bits are an index into the extra edge list, which holds every parent after the first and
+marks the last one with LAST_EDGE_FLAG.
+
+The generation number of a commit is one more than the largest generation number of its parents (commits without
+parents have generation 1), so a commit can only be an ancestor of commits with a larger generation number.
+
+Classes contained:
+    1. CommitGraphEntry
+    2. GitCommitGraph
+'''
+from __future__ import annotations
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+from classes.gitcommit import GitCommit
+from classes.gitrepository import ObjectStore, Repository
+
+GRAPH_MAGIC: bytes = b'KRGRAPH\0'
+GRAPH_VERSION: int = 1
+GRAPH_FILE_NAME: str = 'commit-graph'
+# held by every writer of the graph, including ref updates while they add their commit and move the ref
+GRAPH_LOCK_FILE_NAME: str = 'commit-graph.lock'
+GRAPH_LOCK_TIMEOUT_SECONDS: float = 30.0
+
+NO_PARENT: int = 0xffffffff
+EXTRA_EDGES_FLAG: int = 0x80000000
+LAST_EDGE_FLAG: int = 0x80000000
+
+FAN_OUT_STRUCT = struct.Struct('>256I')
+POSITION_STRUCT = struct.Struct('>I')
+GRAPH_RECORD_STRUCT = struct.Struct('>20s20sqIII')
+
+_loaded_graphs: dict[str, tuple[tuple[int, int, int], GitCommitGraph]] = {}
+# the .kr_git roots whose graph lock the current thread holds, so that the lock can be taken again while held
+_held_graph_locks = threading.local()
+
+
+@dataclass
+class CommitGraphEntry():
+    '''
+    What the commit-graph knows about one commit.
+
+    Attributes:
+        commit_sha1 (str): hex sha1 of the commit
+        root_tree_sha1 (str): hex sha1 of the commit's root tree
+        timestamp (int): when the commit was made, in microseconds since the epoch
+        generation (int): one more than the largest generation number of the commit's parents
+        parent_sha1s (list[str]): hex sha1s of the commit's parents
+    '''
+    commit_sha1: str
+    root_tree_sha1: str
+    timestamp: int
+    generation: int
+    parent_sha1s: list[str]
+
+
+class GitCommitGraph:
+    '''
+    A memory-mapped commit-graph file.
+
+    Attributes:
+        graph_file_path (str): path of the commit-graph file
+        commit_count (int): number of commits in the graph
+    '''
+
+    def __init__(self, graph_file_path: str):
+        self.graph_file_path: str = graph_file_path
+        with open(graph_file_path, 'rb') as graph_file:
+            self._graph_map: mmap.mmap = mmap.mmap(graph_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._graph_map[:len(GRAPH_MAGIC)] != GRAPH_MAGIC or self._graph_map[len(GRAPH_MAGIC)] != GRAPH_VERSION:
+            raise ValueError(f'{graph_file_path} is not a commit-graph')
+        self._fan_out: tuple[int, ...] = FAN_OUT_STRUCT.unpack_from(self._graph_map, len(GRAPH_MAGIC) + 1)
+        self.commit_count: int = self._fan_out[255]
+        self._sha1_table_offset: int = len(GRAPH_MAGIC) + 1 + FAN_OUT_STRUCT.size
+        self._lookup_table_offset: int = self._sha1_table_offset + 20 * self.commit_count
+        self._record_table_offset: int = self._lookup_table_offset + POSITION_STRUCT.size * self.commit_count
+        self._extra_edges_offset: int = self._record_table_offset + GRAPH_RECORD_STRUCT.size * self.commit_count
+
+    def _find_position(self, sha1_bytes: bytes) -> int:
+        '''
+        Binary searches the sorted sha1 table for a commit, only looking at the commits whose sha1 starts with the
+        same byte.
+
+        Returns:
+            int: the position of the commit's record, or -1 if the graph does not contain it
+        '''
+        first_byte: int = sha1_bytes[0]
+        low: int = self._fan_out[first_byte - 1] if first_byte else 0
+        high: int = self._fan_out[first_byte]
+        while low < high:
+            mid: int = (low + high) // 2
+            mid_offset: int = self._sha1_table_offset + 20 * mid
+            mid_sha1: bytes = self._graph_map[mid_offset:mid_offset + 20]
+            if mid_sha1 < sha1_bytes:
+                low = mid + 1
+            elif mid_sha1 > sha1_bytes:
+                high = mid
+            else:
+                return POSITION_STRUCT.unpack_from(
+                    self._graph_map, self._lookup_table_offset + POSITION_STRUCT.size * mid)[0]
+        return -1
+
+    def _record_at(self, position: int) -> tuple[bytes, bytes, int, int, int, int]:
+        return GRAPH_RECORD_STRUCT.unpack_from(
+            self._graph_map, self._record_table_offset + GRAPH_RECORD_STRUCT.size * position)
+
+    def _sha1_at(self, position: int) -> bytes:
+        record_offset: int = self._record_table_offset + GRAPH_RECORD_STRUCT.size * position
+        return self._graph_map[record_offset:record_offset + 20]
+
+    def _parent_positions(self, first_parent: int, second_parent: int) -> list[int]:
+        if first_parent == NO_PARENT:
+            return []
+        if second_parent == NO_PARENT:
+            return [first_parent]
+        if not second_parent & EXTRA_EDGES_FLAG:
+            return [first_parent, second_parent]
+        parent_positions: list[int] = [first_parent]
+        edge_idx: int = second_parent & ~EXTRA_EDGES_FLAG
+        while True:
+            edge: int = POSITION_STRUCT.unpack_from(
+                self._graph_map, self._extra_edges_offset + POSITION_STRUCT.size * edge_idx)[0]
+            parent_positions.append(edge & ~LAST_EDGE_FLAG)
+            if edge & LAST_EDGE_FLAG:
+                return parent_positions
+            edge_idx += 1
+
+    def find(self, commit_sha1: str) -> CommitGraphEntry:
+        '''
+        Looks up a commit in the graph.
+
+        Args:
+            commit_sha1 (str): hex sha1 of the commit
+
+        Returns:
+            CommitGraphEntry: what the graph knows about the commit, or None if the graph does not contain it
+        '''
+        position: int = self._find_position(bytes.fromhex(commit_sha1))
+        if position < 0:
+            return None
+        _, root_tree_sha1, timestamp, generation, first_parent, second_parent = self._record_at(position)
+        return CommitGraphEntry(commit_sha1, root_tree_sha1.hex(), timestamp, generation,
+                                [self._sha1_at(parent_position).hex() for parent_position
+                                 in self._parent_positions(first_parent, second_parent)])
+
+    def iter_sha1s_with_prefix(self, sha1_prefix: str) -> Iterable[str]:
+        '''
+        Yields the hex sha1 of every commit in the graph that starts with sha1_prefix.
+        '''
+        first_byte: int = int(sha1_prefix[:2], 16)
+        low: int = self._fan_out[first_byte - 1] if first_byte else 0
+        for sorted_idx in range(low, self._fan_out[first_byte]):
+            sha1_offset: int = self._sha1_table_offset + 20 * sorted_idx
+            commit_sha1: str = self._graph_map[sha1_offset:sha1_offset + 20].hex()
+            if commit_sha1.startswith(sha1_prefix):
+                yield commit_sha1
+
+    def close(self) -> None:
+        self._graph_map.close()
+
+    @classmethod
+    def load(cls, kr_git_root: str) -> GitCommitGraph:
+        '''
+        Returns the commit-graph of a repo, or None if it has not been written yet. The graph is only mapped again
+        when its file has been replaced since the last call.
+        '''
+        graph_file_path: str = os.path.join(kr_git_root, GRAPH_FILE_NAME)
+        try:
+            graph_stat: os.stat_result = os.stat(graph_file_path)
+        except FileNotFoundError:
+            _loaded_graphs.pop(kr_git_root, None)
+            return None
+        graph_identity: tuple[int, int, int] = (graph_stat.st_ino, graph_stat.st_mtime_ns, graph_stat.st_size)
+        loaded: tuple[tuple[int, int, int], GitCommitGraph] = _loaded_graphs.get(kr_git_root)
+        if loaded is None or loaded[0] != graph_identity:
+            loaded = (graph_identity, cls(graph_file_path))
+            _loaded_graphs[kr_git_root] = loaded
+        return loaded[1]
+
+    @classmethod
+    @contextmanager
+    def locked(cls, kr_git_root: str) -> Iterator[None]:
+        '''
+        Holds the lock of a repo's commit-graph for the duration of the block, waiting for another holder to
+        release it. A thread that already holds the lock can take it again.
+
+        Throws:
+            RuntimeError: if the lock is still held by someone else after GRAPH_LOCK_TIMEOUT_SECONDS
+        '''
+        kr_git_root = os.path.abspath(kr_git_root)
+        held_roots: set[str] = _held_graph_locks.__dict__.setdefault('roots', set())
+        if kr_git_root in held_roots:
+            yield
+            return
+        lock_file_path: str = os.path.join(kr_git_root, GRAPH_LOCK_FILE_NAME)
+        deadline: float = time.monotonic() + GRAPH_LOCK_TIMEOUT_SECONDS
+        while True:
+            try:
+                os.close(os.open(lock_file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+                break
+            except FileExistsError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'The commit-graph is locked by another update (delete {lock_file_path} if '
+                                       'it is stale)')
+                time.sleep(0.01)
+        held_roots.add(kr_git_root)
+        try:
+            yield
+        finally:
+            held_roots.discard(kr_git_root)
+            os.remove(lock_file_path)
+
+    @classmethod
+    def update(cls, kr_git_root: str, tip_commit_sha1s: Iterable[str], rebuild: bool = False) -> int:
+        '''
+        Adds every commit reachable from tip_commit_sha1s that the graph does not hold yet. The walk stops at commits
+        that are already in the graph, so adding a new commit on top of graphed history only inflates that commit.
+        The existing records are kept as they are and the new ones are appended after them. The graph's lock is
+        held throughout, so concurrent updates never lose each other's commits.
+
+        Args:
+            kr_git_root (str): path of the .kr_git repo
+            tip_commit_sha1s (Iterable[str]): hex sha1s of the commits to add, along with their ancestors
+            rebuild (bool): whether to replace the graph with one of just these commits, e.g. after commits that
+                the graph lists were deleted
+
+        Returns:
+            int: the number of commits added
+        '''
+        with cls.locked(kr_git_root):
+            return cls._update(kr_git_root, tip_commit_sha1s, rebuild)
+
+    @classmethod
+    def _update(cls, kr_git_root: str, tip_commit_sha1s: Iterable[str], rebuild: bool) -> int:
+        commit_graph: GitCommitGraph = None if rebuild else cls.load(kr_git_root)
+        # the commits are read from the repo whose graph this is, which need not be the current one
+        object_store: ObjectStore = Repository.open(kr_git_root).object_store
+        positions: dict[str, int] = {}
+        generations: dict[str, int] = {}
+
+        def graphed_position(commit_sha1: str) -> int:
+            if commit_sha1 not in positions and commit_graph is not None:
+                position: int = commit_graph._find_position(bytes.fromhex(commit_sha1))
+                if position >= 0:
+                    positions[commit_sha1] = position
+                    generations[commit_sha1] = commit_graph._record_at(position)[3]
+            return positions.get(commit_sha1, -1)
+
+        # walk back from the tips, ordering the new commits so that parents come before their children
+        new_commits: list[GitCommit] = []
+        loaded_commits: dict[str, GitCommit] = {}
+        pending_sha1s: list[str] = [sha1 for sha1 in tip_commit_sha1s if graphed_position(sha1) < 0]
+        while pending_sha1s:
+            commit_sha1: str = pending_sha1s[-1]
+            if commit_sha1 in generations:
+                pending_sha1s.pop()
+                continue
+            if commit_sha1 not in loaded_commits:
+                loaded_commits[commit_sha1] = GitCommit.init_from_commit_hash(commit_sha1, object_store)
+            curr_commit_obj: GitCommit = loaded_commits[commit_sha1]
+            missing_parent_sha1s: list[str] = [parent_sha1 for parent_sha1 in curr_commit_obj.parent_sha1s
+                                               if parent_sha1 not in generations and graphed_position(parent_sha1) < 0]
+            if missing_parent_sha1s:
+                pending_sha1s.extend(missing_parent_sha1s)
+                continue
+            pending_sha1s.pop()
+            previous_count: int = commit_graph.commit_count if commit_graph is not None else 0
+            positions[commit_sha1] = previous_count + len(new_commits)
+            generations[commit_sha1] = 1 + max(
+                (generations[parent_sha1] for parent_sha1 in curr_commit_obj.parent_sha1s), default=0)
+            new_commits.append(curr_commit_obj)
+        if not new_commits:
+            if rebuild and os.path.exists(os.path.join(kr_git_root, GRAPH_FILE_NAME)):
+                os.remove(os.path.join(kr_git_root, GRAPH_FILE_NAME))
+            return 0
+
+        if commit_graph is not None:
+            records = bytearray(commit_graph._graph_map[commit_graph._record_table_offset:commit_graph._extra_edges_offset])
+            extra_edges = bytearray(commit_graph._graph_map[commit_graph._extra_edges_offset:])
+        else:
+            records = bytearray()
+            extra_edges = bytearray()
+        for curr_commit_obj in new_commits:
+            parent_positions: list[int] = [positions[parent_sha1] for parent_sha1 in curr_commit_obj.parent_sha1s]
+            first_parent: int = parent_positions[0] if parent_positions else NO_PARENT
+            second_parent: int = parent_positions[1] if len(parent_positions) == 2 else NO_PARENT
+            if len(parent_positions) > 2:
+                second_parent = EXTRA_EDGES_FLAG | (len(extra_edges) // POSITION_STRUCT.size)
+                for parent_position in parent_positions[1:-1]:
+                    extra_edges += POSITION_STRUCT.pack(parent_position)
+                extra_edges += POSITION_STRUCT.pack(LAST_EDGE_FLAG | parent_positions[-1])
+            records += GRAPH_RECORD_STRUCT.pack(
+                bytes.fromhex(curr_commit_obj.commit_sha1), bytes.fromhex(curr_commit_obj.root_tree_sha1),
+                curr_commit_obj.commit_timestamp(), generations[curr_commit_obj.commit_sha1], first_parent,
+                second_parent)
+
+        commit_count: int = len(records) // GRAPH_RECORD_STRUCT.size
+        record_view = memoryview(records)
+        sorted_positions: list[int] = sorted(
+            range(commit_count),
+            key=lambda position: record_view[GRAPH_RECORD_STRUCT.size * position:
+                                             GRAPH_RECORD_STRUCT.size * position + 20].tobytes())
+        sha1_table = bytearray()
+        lookup_table = bytearray()
+        fan_out: list[int] = [0] * 256
+        for position in sorted_positions:
+            record_offset: int = GRAPH_RECORD_STRUCT.size * position
+            sha1_table += record_view[record_offset:record_offset + 20]
+            lookup_table += POSITION_STRUCT.pack(position)
+            fan_out[records[record_offset]] += 1
+        for byte_value in range(1, 256):
+            fan_out[byte_value] += fan_out[byte_value - 1]
+
+        Repository.open(kr_git_root).object_store.write_repo_file(
+            GRAPH_FILE_NAME,
+            GRAPH_MAGIC + bytes([GRAPH_VERSION]) + FAN_OUT_STRUCT.pack(*fan_out) + sha1_table + lookup_table
+            + records + extra_edges)
+        return len(new_commits)
@@ -0,0 +1,338 @@
+'''
+A module that contains the codecs that objects are compressed with and the policy that picks one for each object.
+
+Every object written by kr-git starts with a codec header: CODEC_MAGIC followed by the id byte of its codec, then
+the object's data as that codec encodes it. Objects written before the header existed are bare zlib streams, whose
+first byte (0x78) can never be mistaken for CODEC_MAGIC, so readers dispatch on the header and fall back to zlib.
+The codecs are:
+
+    z: zlib, at the level chosen by the policy
+    x: lzma (xz container), which is slower but smaller for large, very compressible files
+    s: stored, the data as is, for content that is already compressed
+
+The compression policy is read from .kr_git/compression.json, if it exists, and otherwise uses the defaults of
+CompressionPolicy:
+
+    {
+        "level": 6,                   zlib level for objects that no rule matches
+        "min_savings": 0.1,           the share of the size compression has to save for it to be used at all
+        "probe_size": 65536,          how much of a large object is compressed at level 1 to estimate its savings
+        "store_extensions": [...],    extensions of formats that are already compressed, stored without probing
+        "rules": [                    checked in order; the first one that matches picks the codec
+            {"codec": "lzma", "level": 6, "extensions": [".csv", ".json"], "min_size": 1048576}
+        ]
+    }
+
+Classes contained:
+    1. Codec
+    2. CompressionRule
+    3. CompressionPolicy
+'''
+from __future__ import annotations
+import json
+import lzma
+import os
+import zlib
+from dataclasses import dataclass, field
+from classes.gittrace import tracer
+
+CODEC_MAGIC: bytes = b'KR'
+CODEC_HEADER_SIZE: int = len(CODEC_MAGIC) + 1
+POLICY_FILE_NAME: str = 'compression.json'
+
+DEFAULT_ZLIB_LEVEL: int = 6
+DEFAULT_LZMA_LEVEL: int = 6
+DEFAULT_MIN_SAVINGS: float = 0.1
+DEFAULT_PROBE_SIZE: int = 64 * 1024
+# formats that are already compressed, which zlib cannot shrink any further
+DEFAULT_STORE_EXTENSIONS: frozenset[str] = frozenset({
+    '.7z', '.avif', '.br', '.bz2', '.docx', '.flac', '.gif', '.gz', '.heic', '.jar', '.jpeg', '.jpg', '.lz4',
+    '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.npz', '.ogg', '.orc', '.parquet', '.pdf', '.png', '.pptx', '.rar',
+    '.tgz', '.webm', '.webp', '.whl', '.woff', '.woff2', '.xlsx', '.xz', '.zip', '.zst',
+})
+
+
+class _ZlibDecompressor:
+    '''
+    Gives a zlib decompressor the interface of lzma.LZMADecompressor, which the readers are written against.
+    '''
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj()
+
+    @property
+    def eof(self) -> bool:
+        return self._decompressor.eof
+
+    @property
+    def needs_input(self) -> bool:
+        return not self._decompressor.unconsumed_tail
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        # like LZMADecompressor, new data is only passed in once the previous data has been consumed
+        out: bytes = self._decompressor.decompress(data or self._decompressor.unconsumed_tail, max_length)
+        if self._decompressor.eof:
+            out += self._decompressor.flush()
+        return out
+
+
+class _StoredDecompressor:
+    '''
+    Hands stored data back as is. Stored data has no end marker, so it ends where the object's data does.
+    '''
+    eof: bool = False
+    needs_input: bool = True
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        return data
+
+
+class _StoredCompressor:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+
+@dataclass(frozen=True)
+class Codec():
+    '''
+    One way of encoding an object's data.
+
+    Attributes:
+        name (str): the name used in the policy file and in trace counters
+        codec_id (bytes): the byte that follows CODEC_MAGIC in the header of the objects it encodes
+        default_level (int): the level used when the policy does not give one
+    '''
+    name: str
+    codec_id: bytes
+    default_level: int = None
+
+    @property
+    def header(self) -> bytes:
+        return CODEC_MAGIC + self.codec_id
+
+    @property
+    def ends_at_eof(self) -> bool:
+        '''
+        Whether the encoded data runs until the end of the object instead of ending with its own end marker.
+        '''
+        return self is STORED
+
+    def compressor(self, level: int = None):
+        '''
+        Returns an incremental compressor with compress(data) and flush() methods. The header is not included.
+        '''
+        level = self.default_level if level is None else level
+        if self is ZLIB:
+            return zlib.compressobj(level)
+        if self is LZMA:
+            return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=level)
+        return _StoredCompressor()
+
+    def decompressor(self):
+        '''
+        Returns an incremental decompressor with the interface of lzma.LZMADecompressor (decompress(data,
+        max_length), eof and needs_input).
+        '''
+        if self is ZLIB:
+            return _ZlibDecompressor()
+        if self is LZMA:
+            return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+        return _StoredDecompressor()
+
+    def compress(self, data: bytes, level: int = None) -> bytes:
+        '''
+        Returns the header followed by data encoded with this codec.
+        '''
+        compressor = self.compressor(level)
+        return b''.join((self.header, compressor.compress(data), compressor.flush()))
+
+
+ZLIB: Codec = Codec('zlib', b'z', DEFAULT_ZLIB_LEVEL)
+LZMA: Codec = Codec('lzma', b'x', DEFAULT_LZMA_LEVEL)
+STORED: Codec = Codec('stored', b's')
+CODECS_BY_NAME: dict[str, Codec] = {codec.name: codec for codec in (ZLIB, LZMA, STORED)}
+CODECS_BY_ID: dict[bytes, Codec] = {codec.codec_id: codec for codec in (ZLIB, LZMA, STORED)}
+
+
+def split_codec_header(data: bytes) -> tuple[Codec, bytes]:
+    '''
+    Finds the codec of an object from the start of its stored data.
+
+    Args:
+        data (bytes): the stored data, or at least its first CODEC_HEADER_SIZE bytes
+
+    Returns:
+        tuple[Codec, bytes]: the codec, and data with the header removed. Objects without a header are zlib.
+
+    Throws:
+        ValueError: if the header names a codec that does not exist
+    '''
+    if not data.startswith(CODEC_MAGIC):
+        return ZLIB, data
+    codec: Codec = CODECS_BY_ID.get(bytes(data[len(CODEC_MAGIC):CODEC_HEADER_SIZE]))
+    if codec is None:
+        raise ValueError(f'Unknown codec {bytes(data[:CODEC_HEADER_SIZE])!r} in object header')
+    return codec, data[CODEC_HEADER_SIZE:]
+
+
+def decompress(data: bytes) -> bytes:
+    '''
+    Decodes the whole stored data of an object, whatever codec it was written with.
+    '''
+    codec, encoded_data = split_codec_header(data)
+    if codec is ZLIB:
+        return zlib.decompress(encoded_data)
+    if codec is LZMA:
+        return lzma.decompress(encoded_data, format=lzma.FORMAT_XZ)
+    return bytes(encoded_data)
+
+
+def _sample(data: bytes, probe_size: int) -> bytes:
+    # the start, middle and end of the data, since files often begin with an uncompressed header
+    if len(data) <= probe_size:
+        return data
+    slice_size: int = probe_size // 3
+    middle: int = (len(data) - slice_size) // 2
+    data_view = memoryview(data)
+    return b''.join((data_view[:slice_size], data_view[middle:middle + slice_size], data_view[-slice_size:]))
+
+
+@dataclass
+class CompressionRule():
+    '''
+    Picks a codec for the objects that match it.
+
+    Attributes:
+        codec (Codec): the codec to use
+        level (int): the codec's level, or None for its default
+        extensions (frozenset[str]): lowercase file extensions (with the dot) to match, or None to match any file.
+            Objects that are not files, like trees and commits, only match rules without extensions.
+        min_size (int): the smallest object to match
+        max_size (int): the largest object to match, or None for no limit
+    '''
+    codec: Codec
+    level: int = None
+    extensions: frozenset[str] = None
+    min_size: int = 0
+    max_size: int = None
+
+    @classmethod
+    def from_dict(cls, rule_dict: dict) -> CompressionRule:
+        codec: Codec = CODECS_BY_NAME.get(rule_dict.get('codec'))
+        if codec is None:
+            raise ValueError(f'Unknown codec {rule_dict.get("codec")!r} in compression rule; '
+                             f'expected one of {", ".join(CODECS_BY_NAME)}')
+        extensions = rule_dict.get('extensions')
+        return cls(codec, rule_dict.get('level'),
+                   None if extensions is None else frozenset(extension.lower() for extension in extensions),
+                   rule_dict.get('min_size', 0), rule_dict.get('max_size'))
+
+    def matches(self, extension: str, size: int) -> bool:
+        if self.extensions is not None and extension not in self.extensions:
+            return False
+        return size >= self.min_size and (self.max_size is None or size <= self.max_size)
+
+
+@dataclass
+class CompressionPolicy():
+    '''
+    Chooses the codec of each object written. In order: the first rule that matches the object's extension and
+    size, stored for extensions of already-compressed formats, and otherwise zlib at level, unless a probe shows
+    that zlib would save less than min_savings of the size, in which case the object is stored.
+
+    Attributes:
+        level (int): zlib level for objects that no rule matches
+        min_savings (float): the share of the size that compression has to save for it to be used
+        probe_size (int): how many bytes of a larger object are compressed at level 1 to estimate its savings
+        store_extensions (frozenset[str]): lowercase extensions of formats that are stored without probing
+        rules (list[CompressionRule]): rules checked before anything else, in order
+    '''
+    level: int = DEFAULT_ZLIB_LEVEL
+    min_savings: float = DEFAULT_MIN_SAVINGS
+    probe_size: int = DEFAULT_PROBE_SIZE
+    store_extensions: frozenset[str] = DEFAULT_STORE_EXTENSIONS
+    rules: list[CompressionRule] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, kr_git_root: str) -> CompressionPolicy:
+        '''
+        Reads the policy of a repo from .kr_git/compression.json, or returns the default policy if there is none.
+
+        Throws:
+            ValueError: if the file is not valid JSON or names a codec that does not exist
+        '''
+        try:
+            with open(os.path.join(kr_git_root, POLICY_FILE_NAME), 'r', encoding='utf8') as policy_file:
+                policy_dict: dict = json.load(policy_file)
+        except FileNotFoundError:
+            return cls()
+        store_extensions = policy_dict.get('store_extensions')
+        return cls(level=policy_dict.get('level', DEFAULT_ZLIB_LEVEL),
+                   min_savings=policy_dict.get('min_savings', DEFAULT_MIN_SAVINGS),
+                   probe_size=policy_dict.get('probe_size', DEFAULT_PROBE_SIZE),
+                   store_extensions=DEFAULT_STORE_EXTENSIONS if store_extensions is None else frozenset(
+                       extension.lower() for extension in store_extensions),
+                   rules=[CompressionRule.from_dict(rule_dict) for rule_dict in policy_dict.get('rules', [])])
+
+    def _choose_by_name(self, path_hint: str, size: int) -> tuple[Codec, int]:
+        extension: str = os.path.splitext(path_hint)[1].lower() if path_hint else None
+        for rule in self.rules:
+            if rule.matches(extension, size):
+                return rule.codec, rule.level
+        if extension in self.store_extensions:
+            return STORED, None
+        return None, None
+
+    def _is_compressible(self, sample: bytes) -> bool:
+        with tracer.phase('probe'):
+            probed_size: int = len(zlib.compress(sample, 1))
+        tracer.count('bytes_probed', len(sample))
+        return probed_size <= len(sample) * (1 - self.min_savings)
+
+    def choose(self, sample: bytes, size: int, path_hint: str = None) -> tuple[Codec, int]:
+        '''
+        Chooses the codec of an object that is about to be streamed into the store.
+
+        Args:
+            sample (bytes): the start of the object's data, at least probe_size bytes of it if it is that large
+            size (int): the full size of the object's data
+            path_hint (str): the path of the file the object holds, if it holds one
+
+        Returns:
+            tuple[Codec, int]: the codec and its level
+        '''
+        codec, level = self._choose_by_name(path_hint, size)
+        if codec is not None:
+            return codec, level
+        if not self._is_compressible(_sample(sample, self.probe_size)):
+            return STORED, None
+        return ZLIB, self.level
+
+    def compress(self, data: bytes, path_hint: str = None) -> bytes:
+        '''
+        Encodes an object held in memory with the codec the policy chooses for it, header included. Objects no
+        larger than probe_size are compressed directly and stored instead if that did not save enough.
+
+        Args:
+            data (bytes): the object's serialized data
+            path_hint (str): the path of the file the object holds, if it holds one
+
+        Returns:
+            bytes: the data to store
+        '''
+        codec, level = self._choose_by_name(path_hint, len(data))
+        if codec is None and len(data) <= self.probe_size:
+            compressed_data: bytes = ZLIB.compress(data, self.level)
+            if len(compressed_data) <= CODEC_HEADER_SIZE + len(data) * (1 - self.min_savings):
+                tracer.count('objects_zlib')
+                return compressed_data
+            codec = STORED
+        elif codec is None and not self._is_compressible(_sample(data, self.probe_size)):
+            codec = STORED
+        elif codec is None:
+            codec, level = ZLIB, self.level
+        tracer.count(f'objects_{codec.name}')
+        return codec.compress(data, level)
@@ -0,0 +1,223 @@
+'''
+Functions for creating and applying copy/insert deltas between two versions of an object, plus a small cache of
+recently reconstructed delta bases.
+
+A delta starts with the sizes of the base and of the target (as little-endian base-128 varints), followed by
+a sequence of instructions that rebuild the target:
+
+    copy:   a byte with the high bit set, whose low 7 bits say which of the following offset bytes (bits 0-3) and
+            size bytes (bits 4-6) are present. Copies `size` bytes starting at `offset` in the base. A size of 0
+            means 0x10000.
+    insert: a byte n between 1 and 127, followed by n literal bytes to append.
+
+This is the same instruction encoding that git uses in its pack files.
+'''
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+
+# targets are matched against the base in blocks of this many bytes
+DELTA_BLOCK_SIZE: int = 16
+MAX_INSERT_SIZE: int = 0x7f
+MAX_COPY_SIZE: int = 0xffffff
+_MATCH_STEP: int = 256
+
+
+def _encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        curr_byte: int = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(curr_byte | 0x80)
+        else:
+            out.append(curr_byte)
+            return bytes(out)
+
+
+def _decode_varint(data: bytes, position: int) -> tuple[int, int]:
+    value: int = 0
+    shift: int = 0
+    while True:
+        curr_byte: int = data[position]
+        position += 1
+        value |= (curr_byte & 0x7f) << shift
+        shift += 7
+        if not curr_byte & 0x80:
+            return value, position
+
+
+def _emit_insert(out: bytearray, literal: bytes) -> None:
+    for start in range(0, len(literal), MAX_INSERT_SIZE):
+        piece: bytes = literal[start:start + MAX_INSERT_SIZE]
+        out.append(len(piece))
+        out.extend(piece)
+
+
+def _emit_copy(out: bytearray, offset: int, size: int) -> None:
+    while size:
+        copy_size: int = min(size, MAX_COPY_SIZE)
+        opcode: int = 0x80
+        operands = bytearray()
+        for byte_idx in range(4):
+            offset_byte: int = (offset >> (8 * byte_idx)) & 0xff
+            if offset_byte:
+                opcode |= 1 << byte_idx
+                operands.append(offset_byte)
+        encoded_size: int = 0 if copy_size == 0x10000 else copy_size
+        for byte_idx in range(3):
+            size_byte: int = (encoded_size >> (8 * byte_idx)) & 0xff
+            if size_byte:
+                opcode |= 1 << (4 + byte_idx)
+                operands.append(size_byte)
+        out.append(opcode)
+        out.extend(operands)
+        offset += copy_size
+        size -= copy_size
+
+
+def _match_length(base: bytes, base_offset: int, target: bytes, target_offset: int) -> int:
+    '''
+    Returns how many bytes match going forward from the given offsets, comparing in large slices first.
+    '''
+    limit: int = min(len(base) - base_offset, len(target) - target_offset)
+    length: int = 0
+    while length < limit:
+        step: int = min(_MATCH_STEP, limit - length)
+        if base[base_offset + length:base_offset + length + step] == target[target_offset + length:target_offset + length + step]:
+            length += step
+            continue
+        while length < limit and base[base_offset + length] == target[target_offset + length]:
+            length += 1
+        break
+    return length
+
+
+def create_delta(base: bytes, target: bytes, max_delta_size: int = None) -> bytes:
+    '''
+    Creates a delta that rebuilds target out of base. Every DELTA_BLOCK_SIZE-aligned block of the base is indexed,
+    and the target is scanned for those blocks; each hit is extended in both directions and becomes a copy, and
+    everything in between becomes an insert.
+
+    Args:
+        base (bytes): the object to delta against
+        target (bytes): the object to encode
+        max_delta_size (int): give up (returning None) once the delta grows beyond this many bytes
+
+    Returns:
+        bytes: the delta, or None if it would exceed max_delta_size
+    '''
+    out = bytearray(_encode_varint(len(base)) + _encode_varint(len(target)))
+    block_offsets: dict[bytes, int] = {}
+    for offset in range(0, len(base) - DELTA_BLOCK_SIZE + 1, DELTA_BLOCK_SIZE):
+        block_offsets.setdefault(base[offset:offset + DELTA_BLOCK_SIZE], offset)
+
+    insert_start: int = 0
+    target_offset: int = 0
+    last_block_offset: int = len(target) - DELTA_BLOCK_SIZE
+    while target_offset <= last_block_offset:
+        base_offset: int = block_offsets.get(target[target_offset:target_offset + DELTA_BLOCK_SIZE])
+        if base_offset is None:
+            target_offset += 1
+            if max_delta_size is not None and len(out) + target_offset - insert_start > max_delta_size:
+                return None
+            continue
+        # pull bytes that are still waiting to be inserted into the copy if they match too
+        while target_offset > insert_start and base_offset > 0 and target[target_offset - 1] == base[base_offset - 1]:
+            target_offset -= 1
+            base_offset -= 1
+        match_length: int = _match_length(base, base_offset, target, target_offset)
+        _emit_insert(out, target[insert_start:target_offset])
+        _emit_copy(out, base_offset, match_length)
+        target_offset += match_length
+        insert_start = target_offset
+        if max_delta_size is not None and len(out) > max_delta_size:
+            return None
+
+    _emit_insert(out, target[insert_start:])
+    if max_delta_size is not None and len(out) > max_delta_size:
+        return None
+    return bytes(out)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    '''
+    Rebuilds a target object out of its base and a delta created by create_delta.
+
+    Args:
+        base (bytes): the object the delta was created against
+        delta (bytes): the delta
+
+    Returns:
+        bytes: the target object
+
+    Throws:
+        ValueError: if the delta does not match the base or is malformed
+    '''
+    base_size, position = _decode_varint(delta, 0)
+    target_size, position = _decode_varint(delta, position)
+    if base_size != len(base):
+        raise ValueError(f'Delta expects a base of {base_size} bytes but got {len(base)}')
+    base_view = memoryview(base)
+    out = bytearray()
+    while position < len(delta):
+        opcode: int = delta[position]
+        position += 1
+        if opcode & 0x80:
+            offset: int = 0
+            for byte_idx in range(4):
+                if opcode & (1 << byte_idx):
+                    offset |= delta[position] << (8 * byte_idx)
+                    position += 1
+            size: int = 0
+            for byte_idx in range(3):
+                if opcode & (1 << (4 + byte_idx)):
+                    size |= delta[position] << (8 * byte_idx)
+                    position += 1
+            if size == 0:
+                size = 0x10000
+            if offset + size > len(base):
+                raise ValueError('Delta copies past the end of its base')
+            out.extend(base_view[offset:offset + size])
+        elif opcode:
+            out.extend(delta[position:position + opcode])
+            position += opcode
+        else:
+            raise ValueError('Delta contains a reserved opcode')
+    if len(out) != target_size:
+        raise ValueError(f'Delta produced {len(out)} bytes but expected {target_size}')
+    return bytes(out)
+
+
+class DeltaBaseCache:
+    '''
+    A least-recently-used cache of reconstructed objects, so that restoring many objects that share a delta chain
+    does not inflate the same bases over and over. Safe to share between threads.
+
+    Attributes:
+        max_bytes (int): the total size of the cached objects is kept at or below this
+        total_bytes (int): the total size of the cached objects
+    '''
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.total_bytes: int = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sha1: str) -> bytes:
+        with self._lock:
+            data: bytes = self._entries.get(sha1)
+            if data is not None:
+                self._entries.move_to_end(sha1)
+            return data
+
+    def put(self, sha1: str, data: bytes) -> None:
+        with self._lock:
+            if sha1 in self._entries or len(data) > self.max_bytes:
+                return
+            self._entries[sha1] = data
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted_data = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted_data)
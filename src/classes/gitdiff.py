@@ -0,0 +1,167 @@
+'''
+A module that contains the classes used to compare two snapshots of a repository.
+
+Trees are compared level by level. A subdirectory whose tree sha1 is the same on both sides is skipped without
+being read, and blobs are never inflated (their sha1s say whether they changed), so the cost of a diff is
+proportional to the part of the repository that changed rather than to its size.
+
+Classes contained:
+    1. DiffStatus
+    2. DiffEntry
+    3. GitDiff
+'''
+from __future__ import annotations
+from dataclasses import dataclass
+from enum import Enum
+from typing import Iterator
+from classes.githistory import GitHistory
+from classes.gittree import GitTree, GitTreeEntry
+from classes.utils import EntryType
+
+# a file stored whole and the same file stored as chunks are two versions of one file
+_FILE_ENTRY_TYPES: frozenset[EntryType] = frozenset({EntryType.BLOB, EntryType.CHUNKED})
+
+
+class DiffStatus(Enum):
+    ADDED = 'A'
+    REMOVED = 'D'
+    MODIFIED = 'M'
+    RENAMED = 'R'
+
+
+@dataclass
+class DiffEntry():
+    '''
+    A single file that differs between two snapshots.
+
+    Attributes:
+        status (DiffStatus): how the file changed
+        path (str): path of the file relative to the repository root (its new path, for a rename)
+        old_sha1 (str): sha1 of the file's blob in the old snapshot, or None if it was added
+        new_sha1 (str): sha1 of the file's blob in the new snapshot, or None if it was removed
+        old_path (str): for a rename, the path of the file in the old snapshot
+    '''
+    status: DiffStatus
+    path: str
+    old_sha1: str
+    new_sha1: str
+    old_path: str = None
+
+
+class GitDiff:
+    '''
+    Compares two snapshots of a repository.
+
+    Attributes:
+        detect_renames (bool): whether to pair removed and added files whose blobs have the same sha1 into renames
+    '''
+
+    def __init__(self, detect_renames: bool = False):
+        self.detect_renames: bool = detect_renames
+
+    def _add_subtree(self, diff_entries: list[DiffEntry], status: DiffStatus, tree_sha1: str, tree_path: str) -> None:
+        '''
+        Reports every file under a directory that only exists on one side as added or removed.
+        '''
+        pending_trees: list[tuple[str, str]] = [(tree_sha1, tree_path)]
+        while pending_trees:
+            curr_tree_sha1, curr_tree_path = pending_trees.pop()
+            for curr_tree_entry in GitTree.init_from_tree_hash(curr_tree_sha1).iter_entries():
+                self._add_entry(diff_entries, status, curr_tree_entry, f'{curr_tree_path}{curr_tree_entry.entry_name}',
+                                pending_trees)
+
+    def _add_entry(self, diff_entries: list[DiffEntry], status: DiffStatus, tree_entry: GitTreeEntry, entry_path: str,
+                   pending_trees: list[tuple[str, str]] = None) -> None:
+        if tree_entry.entry_type == EntryType.TREE:
+            if pending_trees is None:
+                self._add_subtree(diff_entries, status, tree_entry.entry_hash, f'{entry_path}/')
+            else:
+                pending_trees.append((tree_entry.entry_hash, f'{entry_path}/'))
+        elif status == DiffStatus.ADDED:
+            diff_entries.append(DiffEntry(status, entry_path, None, tree_entry.entry_hash))
+        else:
+            diff_entries.append(DiffEntry(status, entry_path, tree_entry.entry_hash, None))
+
+    def _pair_renames(self, diff_entries: list[DiffEntry]) -> list[DiffEntry]:
+        '''
+        Replaces each removed file whose blob reappears as an added file with a single rename.
+        '''
+        removed_by_sha1: dict[str, list[DiffEntry]] = {}
+        for diff_entry in diff_entries:
+            if diff_entry.status == DiffStatus.REMOVED:
+                removed_by_sha1.setdefault(diff_entry.old_sha1, []).append(diff_entry)
+        paired_entries: list[DiffEntry] = []
+        renamed_paths: set[str] = set()
+        for diff_entry in diff_entries:
+            if diff_entry.status != DiffStatus.ADDED or not removed_by_sha1.get(diff_entry.new_sha1):
+                paired_entries.append(diff_entry)
+                continue
+            removed_entry: DiffEntry = removed_by_sha1[diff_entry.new_sha1].pop(0)
+            renamed_paths.add(removed_entry.path)
+            paired_entries.append(DiffEntry(DiffStatus.RENAMED, diff_entry.path, removed_entry.old_sha1,
+                                            diff_entry.new_sha1, removed_entry.path))
+        return [diff_entry for diff_entry in paired_entries
+                if diff_entry.status != DiffStatus.REMOVED or diff_entry.path not in renamed_paths]
+
+    def diff_trees(self, old_tree_sha1: str, new_tree_sha1: str) -> list[DiffEntry]:
+        '''
+        Compares two root trees.
+
+        Args:
+            old_tree_sha1 (str): sha1 of the tree of the old snapshot
+            new_tree_sha1 (str): sha1 of the tree of the new snapshot
+
+        Returns:
+            list[DiffEntry]: every file that differs, sorted by path
+        '''
+        diff_entries: list[DiffEntry] = []
+        pending_pairs: list[tuple[str, str, str]] = [(old_tree_sha1, new_tree_sha1, '')]
+        while pending_pairs:
+            curr_old_sha1, curr_new_sha1, curr_tree_path = pending_pairs.pop()
+            if curr_old_sha1 == curr_new_sha1:
+                continue
+            # both trees list their entries sorted by name, so they are walked side by side
+            old_entries: Iterator[GitTreeEntry] = GitTree.init_from_tree_hash(curr_old_sha1).iter_entries()
+            new_entries: Iterator[GitTreeEntry] = GitTree.init_from_tree_hash(curr_new_sha1).iter_entries()
+            old_entry: GitTreeEntry = next(old_entries, None)
+            new_entry: GitTreeEntry = next(new_entries, None)
+            while old_entry is not None or new_entry is not None:
+                if new_entry is None or (old_entry is not None and old_entry.entry_name < new_entry.entry_name):
+                    self._add_entry(diff_entries, DiffStatus.REMOVED, old_entry,
+                                    f'{curr_tree_path}{old_entry.entry_name}')
+                    old_entry = next(old_entries, None)
+                    continue
+                if old_entry is None or new_entry.entry_name < old_entry.entry_name:
+                    self._add_entry(diff_entries, DiffStatus.ADDED, new_entry,
+                                    f'{curr_tree_path}{new_entry.entry_name}')
+                    new_entry = next(new_entries, None)
+                    continue
+                entry_path: str = f'{curr_tree_path}{old_entry.entry_name}'
+                if old_entry.entry_hash == new_entry.entry_hash and old_entry.entry_type == new_entry.entry_type:
+                    pass
+                elif old_entry.entry_type == EntryType.TREE and new_entry.entry_type == EntryType.TREE:
+                    pending_pairs.append((old_entry.entry_hash, new_entry.entry_hash, f'{entry_path}/'))
+                elif (old_entry.entry_type == new_entry.entry_type
+                      or {old_entry.entry_type, new_entry.entry_type} <= _FILE_ENTRY_TYPES):
+                    # two versions of a file (stored whole or as chunks), or of a symlink's target
+                    diff_entries.append(DiffEntry(DiffStatus.MODIFIED, entry_path, old_entry.entry_hash,
+                                                  new_entry.entry_hash))
+                else:
+                    # a file, directory or symlink replaced by one of another kind
+                    self._add_entry(diff_entries, DiffStatus.REMOVED, old_entry, entry_path)
+                    self._add_entry(diff_entries, DiffStatus.ADDED, new_entry, entry_path)
+                old_entry = next(old_entries, None)
+                new_entry = next(new_entries, None)
+
+        diff_entries.sort(key=lambda diff_entry: diff_entry.path)
+        if self.detect_renames:
+            return self._pair_renames(diff_entries)
+        return diff_entries
+
+    def diff_commits(self, old_commit_sha1: str, new_commit_sha1: str) -> list[DiffEntry]:
+        '''
+        Compares the snapshots of two commits. See diff_trees.
+        '''
+        history: GitHistory = GitHistory()
+        return self.diff_trees(history.entry(old_commit_sha1).root_tree_sha1,
+                               history.entry(new_commit_sha1).root_tree_sha1)
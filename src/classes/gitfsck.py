@@ -0,0 +1,238 @@
+'''
+Contains the GitFsck class, which checks the integrity of the object store of a .kr_git repo.
+
+Every object, loose or packed, is read back, inflated and hashed, and the sha1 is compared with the one the object
+is stored under. Trees, commits and the manifests of chunked files are also parsed, and every object they reference
+is looked up. The checks are split into one task per loose fan-out directory, one per range of FSCK_RANGE_SIZE
+pack entries, and one per pack to verify its trailing checksum. The tasks run on a pool of processes, since
+inflating, hashing and parsing are CPU bound.
+'''
+from __future__ import annotations
+import hashlib
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable
+from classes.gitblob import CHUNKED_HEADER_PREFIX, GitBlob
+from classes.gitcommit import GitCommit
+from classes.gitobj import GitObject
+from classes.gitpack import COPY_BUFFER_SIZE, GitPack
+from classes.gitref import GitRef
+from classes.gitrepository import ObjectStore, Repository
+from classes.gittree import GitTree
+from classes.utils import EntryType, find_commit_hash_from_head_file
+
+# the number of pack entries checked by one task
+FSCK_RANGE_SIZE: int = 16384
+
+_OBJECT_KINDS: dict[str, str] = {'blobs': 'blob', 'trees': 'tree', 'commits': 'commit'}
+
+
+@dataclass
+class FsckResult():
+    '''
+    What one or more fsck tasks found.
+
+    Attributes:
+        object_count (int): number of objects checked
+        byte_count (int): number of bytes inflated and hashed
+        problems (list[str]): a line describing each corrupt or missing object
+    '''
+    object_count: int = 0
+    byte_count: int = 0
+    problems: list[str] = field(default_factory=list)
+
+    def add(self, other: FsckResult) -> None:
+        self.object_count += other.object_count
+        self.byte_count += other.byte_count
+        self.problems.extend(other.problems)
+
+
+def _referenced_objects(object_dir_name: str, sha1: str, data: bytes) -> list[tuple[str, str]]:
+    '''
+    Returns (object dir name, sha1) of every object that a decompressed object references.
+    '''
+    if object_dir_name == 'trees':
+        return [('trees' if curr_tree_entry.entry_type == EntryType.TREE else 'blobs', curr_tree_entry.entry_hash)
+                for curr_tree_entry in GitTree.init_from_serialized(data, sha1).iter_entries()]
+    if object_dir_name == 'commits':
+        curr_commit_obj: GitCommit = GitCommit.init_from_serialized(data, sha1)
+        return ([('trees', curr_commit_obj.root_tree_sha1)]
+                + [('commits', parent_sha1) for parent_sha1 in curr_commit_obj.parent_sha1s])
+    if data.startswith(CHUNKED_HEADER_PREFIX):
+        return [('blobs', chunk_sha1) for chunk_sha1, _ in GitBlob.parse_manifest(data[data.index(b'\0') + 1:])]
+    return []
+
+
+def _check_object(object_store: ObjectStore, object_dir_name: str, sha1: str, compressed_file: BinaryIO,
+                  found_sha1s: set[str], result: FsckResult) -> None:
+    '''
+    Inflates and hashes one object, then looks up every object it references.
+    '''
+    kind: str = _OBJECT_KINDS[object_dir_name]
+    hasher = hashlib.sha1()
+    # blobs are only held in memory when they turn out to be manifests
+    kept_pieces: list[bytes] = []
+    keep_data: bool = object_dir_name != 'blobs'
+    try:
+        for piece_idx, piece in enumerate(GitObject.inflate_stream(compressed_file)):
+            hasher.update(piece)
+            result.byte_count += len(piece)
+            if piece_idx == 0 and piece.startswith(CHUNKED_HEADER_PREFIX):
+                keep_data = True
+            if keep_data:
+                kept_pieces.append(piece)
+        data: bytes = b''.join(kept_pieces)
+        referenced_objects: list[tuple[str, str]] = _referenced_objects(object_dir_name, sha1, data)
+    except Exception as read_error:
+        result.problems.append(f'corrupt {kind} {sha1}: {read_error}')
+        return
+    finally:
+        result.object_count += 1
+    if hasher.hexdigest() != sha1:
+        result.problems.append(f'corrupt {kind} {sha1}: contents hash to {hasher.hexdigest()}')
+        return
+    for referenced_dir_name, referenced_sha1 in referenced_objects:
+        if referenced_sha1 in found_sha1s:
+            continue
+        if object_store.has(referenced_dir_name, referenced_sha1):
+            found_sha1s.add(referenced_sha1)
+        else:
+            result.problems.append(f'missing {_OBJECT_KINDS[referenced_dir_name]} {referenced_sha1} '
+                                   f'(referenced by {kind} {sha1})')
+
+
+def _find_pack(kr_git_root: str, idx_file_path: str) -> GitPack:
+    for pack in GitPack.load_packs(kr_git_root):
+        if pack.idx_file_path == idx_file_path:
+            return pack
+    raise FileNotFoundError(f'{idx_file_path} was removed while it was being checked')
+
+
+def check_loose_objects(kr_git_root: str, object_dir_name: str, fan_out_name: str) -> FsckResult:
+    '''
+    Checks every loose object in one fan-out directory. Run on the worker processes.
+    '''
+    object_store: ObjectStore = Repository.open(kr_git_root).object_store
+    result = FsckResult()
+    found_sha1s: set[str] = set()
+    for dir_entry in object_store.iter_loose_objects(object_dir_name, fan_out_name):
+        if not dir_entry.is_file():
+            continue
+        with open(dir_entry.path, 'rb') as compressed_file:
+            _check_object(object_store, object_dir_name, fan_out_name + dir_entry.name, compressed_file,
+                          found_sha1s, result)
+    return result
+
+
+def check_packed_objects(kr_git_root: str, idx_file_path: str, start: int, end: int) -> FsckResult:
+    '''
+    Checks the pack entries at positions start to end of a pack's index. Run on the worker processes.
+    '''
+    object_store: ObjectStore = Repository.open(kr_git_root).object_store
+    pack: GitPack = _find_pack(kr_git_root, idx_file_path)
+    result = FsckResult()
+    found_sha1s: set[str] = set()
+    for sha1, pack_entry in pack.iter_entries(start, end):
+        try:
+            compressed_file: BinaryIO = pack.open_object(pack_entry.object_dir_name, sha1)
+        except Exception as read_error:
+            result.object_count += 1
+            result.problems.append(f'corrupt {_OBJECT_KINDS[pack_entry.object_dir_name]} {sha1}: {read_error}')
+            continue
+        with compressed_file:
+            _check_object(object_store, pack_entry.object_dir_name, sha1, compressed_file, found_sha1s, result)
+    return result
+
+
+def check_pack_checksum(kr_git_root: str, idx_file_path: str) -> FsckResult:
+    '''
+    Checks the trailing sha1 of a pack file against its contents. Run on the worker processes.
+    '''
+    pack: GitPack = _find_pack(kr_git_root, idx_file_path)
+    result = FsckResult()
+    pack_hasher = hashlib.sha1()
+    with open(pack.pack_file_path, 'rb') as pack_file:
+        pack_size: int = os.fstat(pack_file.fileno()).st_size
+        remaining: int = pack_size - 20
+        while remaining > 0 and (chunk := pack_file.read(min(COPY_BUFFER_SIZE, remaining))):
+            pack_hasher.update(chunk)
+            remaining -= len(chunk)
+        result.byte_count += pack_size
+        if pack_size < 20 or pack_file.read(20) != pack_hasher.digest():
+            result.problems.append(f'corrupt pack {os.path.basename(pack.pack_file_path)}: checksum mismatch')
+    return result
+
+
+class GitFsck:
+    '''
+    Checks every object of a .kr_git repo, and that refs, HEAD and every tree, commit and manifest point at objects
+    that exist.
+
+    Attributes:
+        repository (Repository): the repository to check
+        jobs (int): number of worker processes
+    '''
+
+    def __init__(self, jobs: int = None):
+        self.repository: Repository = Repository.current()
+        self.jobs: int = jobs or os.cpu_count() or 1
+
+    def _iter_tasks(self) -> list[tuple[Callable[..., FsckResult], tuple]]:
+        kr_git_root: str = self.repository.kr_git_root
+        tasks: list[tuple[Callable[..., FsckResult], tuple]] = []
+        for pack in GitPack.load_packs(kr_git_root, reload=True):
+            tasks.append((check_pack_checksum, (kr_git_root, pack.idx_file_path)))
+            for start in range(0, pack.object_count, FSCK_RANGE_SIZE):
+                tasks.append((check_packed_objects, (kr_git_root, pack.idx_file_path, start,
+                                                     min(start + FSCK_RANGE_SIZE, pack.object_count))))
+        for object_dir_name, fan_out_name in self.repository.object_store.iter_fan_out_dirs():
+            tasks.append((check_loose_objects, (kr_git_root, object_dir_name, fan_out_name)))
+        return tasks
+
+    def _check_refs(self) -> list[str]:
+        '''
+        Checks that every ref and HEAD points at a commit that exists.
+        '''
+        problems: list[str] = []
+        ref_commit_sha1s: list[tuple[str, str]] = []
+        for ref_name, ref_file_path in GitRef.iter_ref_files(self.repository.kr_git_root):
+            try:
+                ref_commit_sha1s.append((f'ref {ref_name}', GitRef.init_from_ref_file(ref_file_path).target_commit_sha1))
+            except Exception as read_error:
+                problems.append(f'corrupt ref {ref_name}: {read_error}')
+        head_file_path: str = os.path.join(self.repository.kr_git_root, 'HEAD')
+        if os.path.isfile(head_file_path):
+            ref_commit_sha1s.append(('HEAD', find_commit_hash_from_head_file(head_file_path)))
+        for ref_description, commit_sha1 in ref_commit_sha1s:
+            if not self.repository.object_store.has('commits', commit_sha1):
+                problems.append(f'missing commit {commit_sha1} (pointed at by {ref_description})')
+        return problems
+
+    def fsck(self) -> bool:
+        '''
+        Runs every check and prints each problem found, followed by a summary.
+
+        Returns:
+            bool: whether the repository is intact
+        '''
+        start_time: float = time.perf_counter()
+        result = FsckResult(problems=self._check_refs())
+        tasks: list[tuple[Callable[..., FsckResult], tuple]] = self._iter_tasks()
+        if self.jobs > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                futures: list[Future] = [executor.submit(task_function, *task_args)
+                                         for task_function, task_args in tasks]
+                for future in futures:
+                    result.add(future.result())
+        else:
+            for task_function, task_args in tasks:
+                result.add(task_function(*task_args))
+
+        for problem in sorted(result.problems):
+            print(problem)
+        elapsed_seconds: float = time.perf_counter() - start_time
+        print(f'Checked {result.object_count} objects ({result.byte_count} bytes) in {elapsed_seconds:.2f}s: '
+              f'{len(result.problems) or "no"} problems found')
+        return not result.problems
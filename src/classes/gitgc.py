@@ -0,0 +1,236 @@
+'''
+Contains the GitGC class, which packs the loose objects of a .kr_git repo into a single pack file.
+
+While packing, blobs that are versions of the same file (found by walking every commit's trees) are stored as
+deltas against each other when that is smaller than storing them in full.
+'''
+import io
+import os
+from collections import deque
+from typing import BinaryIO, Iterator
+from classes.gitblob import GitBlob
+from classes.gitcommit import GitCommit
+from classes.gitcommitgraph import GitCommitGraph
+from classes.gitdelta import create_delta
+from classes.gitpack import GitPack, PackEntry, PACK_OBJECT_TYPES
+from classes.gitrepository import Repository
+from classes.gittree import GitTree
+from classes.utils import EntryType
+
+DEFAULT_DELTA_WINDOW: int = 10
+DEFAULT_MAX_DELTA_DEPTH: int = 50
+# blobs larger than this are always stored in full, since deltas are computed and applied in memory
+MAX_DELTA_OBJECT_SIZE: int = 16 * 1024 * 1024
+
+
+class GitGC:
+    '''
+    Repacks every object of a .kr_git repo (loose or already packed) into one new pack, then removes the loose
+    object files and the old packs.
+
+    Attributes:
+        kr_git_root (str): path of the .kr_git repo
+        delta_window (int): how many other versions of the same file each blob is tried against as a delta base
+        max_delta_depth (int): the longest chain of deltas allowed, which bounds how many deltas a read applies
+        objects (dict[str, tuple[str, str | tuple[GitPack, PackEntry]]]): every object to pack, from its sha1 to
+            its object dir name and its source (a loose file path, or a pack and the object's entry in it)
+        deltas (dict[str, tuple[str, bytes]]): the blobs chosen to be stored as deltas, from their sha1 to the sha1
+            of their base and the compressed delta
+        full_lengths (dict[str, int]): compressed size of each object when stored in full
+    '''
+
+    def __init__(self, delta_window: int = DEFAULT_DELTA_WINDOW, max_delta_depth: int = DEFAULT_MAX_DELTA_DEPTH):
+        self.kr_git_root: str = Repository.current().kr_git_root
+        self.delta_window: int = delta_window
+        self.max_delta_depth: int = max_delta_depth
+        self.objects: dict[str, tuple[str, str | tuple[GitPack, PackEntry]]] = {}
+        self.deltas: dict[str, tuple[str, bytes]] = {}
+        self.full_lengths: dict[str, int] = {}
+
+    def _collect_objects(self, old_packs: list[GitPack]) -> None:
+        for pack in old_packs:
+            for sha1, pack_entry in pack.iter_entries():
+                self.objects.setdefault(sha1, (pack_entry.object_dir_name, (pack, pack_entry)))
+        for object_dir_name in PACK_OBJECT_TYPES:
+            object_dir_path: str = os.path.join(self.kr_git_root, object_dir_name)
+            if not os.path.isdir(object_dir_path):
+                continue
+            for fan_out_name in os.listdir(object_dir_path):
+                fan_out_path: str = os.path.join(object_dir_path, fan_out_name)
+                if len(fan_out_name) != 2 or not os.path.isdir(fan_out_path):
+                    continue
+                for object_file_name in os.listdir(fan_out_path):
+                    # loose objects take precedence so that their files are removed once they are packed
+                    self.objects[fan_out_name + object_file_name] = (
+                        object_dir_name, os.path.join(fan_out_path, object_file_name))
+
+    def _open_full(self, sha1: str) -> BinaryIO:
+        '''
+        Opens the compressed data of an object as it would be stored in full.
+        '''
+        object_dir_name, source = self.objects[sha1]
+        if isinstance(source, str):
+            return open(source, 'rb')
+        pack, pack_entry = source
+        if pack_entry.is_delta:
+            return io.BytesIO(GitBlob.compress(pack.resolve_delta(sha1, pack_entry)))
+        return pack.open_object(object_dir_name, sha1)
+
+    def _full_length(self, sha1: str) -> int:
+        if sha1 not in self.full_lengths:
+            _, source = self.objects[sha1]
+            if isinstance(source, str):
+                self.full_lengths[sha1] = os.path.getsize(source)
+            elif not source[1].is_delta:
+                self.full_lengths[sha1] = source[1].length
+            else:
+                with self._open_full(sha1) as compressed_file:
+                    self.full_lengths[sha1] = len(compressed_file.read())
+        return self.full_lengths[sha1]
+
+    def _collect_blob_paths(self) -> dict[str, list[str]]:
+        '''
+        Walks the trees of every commit and groups the blobs by the path they were committed at. A blob committed
+        at several paths is only grouped under the first one found.
+
+        Returns:
+            dict[str, list[str]]: path within the repo to the sha1s of every version of the file at that path
+        '''
+        blob_paths: dict[str, str] = {}
+        visited_tree_sha1s: set[str] = set()
+
+        def walk_tree(tree_sha1: str, tree_path: str) -> None:
+            if tree_sha1 in visited_tree_sha1s:
+                return
+            visited_tree_sha1s.add(tree_sha1)
+            curr_tree_object: GitTree = GitTree.init_from_tree_hash(tree_sha1)
+            for curr_tree_entry in curr_tree_object.iter_entries():
+                entry_path: str = f'{tree_path}/{curr_tree_entry.entry_name}'
+                if curr_tree_entry.entry_type == EntryType.BLOB:
+                    blob_paths.setdefault(curr_tree_entry.entry_hash, entry_path)
+                elif curr_tree_entry.entry_type == EntryType.TREE:
+                    walk_tree(curr_tree_entry.entry_hash, entry_path)
+
+        for sha1, (object_dir_name, _) in list(self.objects.items()):
+            if object_dir_name == 'commits':
+                walk_tree(GitCommit.init_from_commit_hash(sha1).root_tree_sha1, '')
+
+        grouped_blobs: dict[str, list[str]] = {}
+        for blob_sha1, blob_path in blob_paths.items():
+            if blob_sha1 in self.objects:
+                grouped_blobs.setdefault(blob_path, []).append(blob_sha1)
+        return grouped_blobs
+
+    def _delta_depth(self, sha1: str) -> int:
+        depth: int = 0
+        while sha1 in self.deltas:
+            sha1 = self.deltas[sha1][0]
+            depth += 1
+        return depth
+
+    def _chain_contains(self, sha1: str, target_sha1: str) -> bool:
+        while sha1 in self.deltas:
+            sha1 = self.deltas[sha1][0]
+            if sha1 == target_sha1:
+                return True
+        return False
+
+    def _select_deltas(self) -> None:
+        '''
+        Chooses which blobs to store as deltas. The versions of each file are visited from largest to smallest
+        (deleting from a base makes for smaller deltas than inserting into one), and each is tried against the
+        previous delta_window versions. The smallest delta is kept if it beats storing the blob in full.
+        '''
+        for blob_sha1s in self._collect_blob_paths().values():
+            if len(blob_sha1s) < 2:
+                continue
+            blob_sizes: dict[str, int] = {}
+            for blob_sha1 in blob_sha1s:
+                blob_sizes[blob_sha1] = GitBlob.read_header_from_blob_hash(blob_sha1)[1]
+            candidates: deque[tuple[str, bytes]] = deque(maxlen=self.delta_window)
+            for blob_sha1 in sorted(blob_sha1s, key=lambda sha1: blob_sizes[sha1], reverse=True):
+                if blob_sizes[blob_sha1] > MAX_DELTA_OBJECT_SIZE:
+                    continue
+                blob_data: bytes = GitBlob.read_object('blobs', blob_sha1)
+                if blob_sha1 not in self.deltas:
+                    best_delta: tuple[str, bytes] = None
+                    best_length: int = self._full_length(blob_sha1) - 20
+                    for base_sha1, base_data in candidates:
+                        if self._delta_depth(base_sha1) >= self.max_delta_depth:
+                            continue
+                        if self._chain_contains(base_sha1, blob_sha1):
+                            continue
+                        delta: bytes = create_delta(base_data, blob_data, max_delta_size=len(blob_data) // 2)
+                        if delta is None:
+                            continue
+                        compressed_delta: bytes = GitBlob.compress(delta)
+                        if len(compressed_delta) < best_length:
+                            best_delta = (base_sha1, compressed_delta)
+                            best_length = len(compressed_delta)
+                    if best_delta is not None:
+                        self.deltas[blob_sha1] = best_delta
+                candidates.append((blob_sha1, blob_data))
+
+    def _iter_pack_objects(self) -> Iterator[tuple[str, str, BinaryIO, str]]:
+        for sha1, (object_dir_name, _) in self.objects.items():
+            if sha1 in self.deltas:
+                base_sha1, compressed_delta = self.deltas[sha1]
+                yield object_dir_name, sha1, io.BytesIO(compressed_delta), base_sha1
+            else:
+                with self._open_full(sha1) as compressed_file:
+                    yield object_dir_name, sha1, compressed_file, None
+
+    def _store_size(self) -> int:
+        total_size: int = 0
+        for dir_path, _, file_names in os.walk(self.kr_git_root):
+            if os.path.basename(dir_path) == 'refs':
+                continue
+            for file_name in file_names:
+                total_size += os.path.getsize(os.path.join(dir_path, file_name))
+        return total_size
+
+    def gc(self) -> None:
+        '''
+        Writes every object into a new pack and, once the pack is safely on disk, deletes the loose object files,
+        the now-empty fan-out directories and the old packs. Reports the number of objects packed, how much the
+        pack shrank thanks to deltas, and the size of the repo before and after.
+        '''
+        size_before: int = self._store_size()
+        old_packs: list[GitPack] = GitPack.load_packs(self.kr_git_root, reload=True)
+        self._collect_objects(old_packs)
+        loose_object_paths: list[str] = [source for _, source in self.objects.values() if isinstance(source, str)]
+        self._select_deltas()
+
+        pack_file_path, object_count = GitPack.write_pack(self.kr_git_root, self._iter_pack_objects())
+
+        for object_file_path in loose_object_paths:
+            os.remove(object_file_path)
+        for object_dir_name in PACK_OBJECT_TYPES:
+            object_dir_path: str = os.path.join(self.kr_git_root, object_dir_name)
+            if not os.path.isdir(object_dir_path):
+                continue
+            for fan_out_name in os.listdir(object_dir_path):
+                fan_out_path: str = os.path.join(object_dir_path, fan_out_name)
+                if len(fan_out_name) == 2 and os.path.isdir(fan_out_path) and not os.listdir(fan_out_path):
+                    os.rmdir(fan_out_path)
+        for old_pack in old_packs:
+            # repacking into an identical pack keeps the old pack, which has the same name
+            if old_pack.pack_file_path != pack_file_path:
+                os.remove(old_pack.idx_file_path)
+                os.remove(old_pack.pack_file_path)
+        GitPack.load_packs(self.kr_git_root, reload=True)
+        # make sure every packed commit is in the commit-graph, e.g. ones made before it existed
+        GitCommitGraph.update(self.kr_git_root, [sha1 for sha1, (object_dir_name, _) in self.objects.items()
+                                                 if object_dir_name == 'commits'])
+
+        size_after: int = self._store_size()
+        pack_size: int = os.path.getsize(pack_file_path)
+        full_pack_size: int = pack_size + sum(
+            self._full_length(sha1) - 20 - len(compressed_delta)
+            for sha1, (_, compressed_delta) in self.deltas.items())
+        max_depth: int = max((self._delta_depth(sha1) for sha1 in self.deltas), default=0)
+        print(f'Packed {object_count} objects ({len(loose_object_paths)} loose, '
+              f'{len(old_packs)} old packs) into {os.path.basename(pack_file_path)}')
+        print(f'Stored {len(self.deltas)} blobs as deltas (longest chain: {max_depth}); '
+              f'pack size without deltas: {full_pack_size} bytes, with deltas: {pack_size} bytes')
+        print(f'Repository size: {size_before} bytes -> {size_after} bytes')
@@ -0,0 +1,211 @@
+'''
+Contains the GitHistory class, which walks the commit history of a .kr_git repo to list commits and answer ancestry
+questions.
+
+Commits are looked up in the commit-graph first, which is a fixed-width record lookup, and only inflated from the
+object store when the graph does not hold them yet. Generation numbers bound every walk: a commit can only be an
+ancestor of commits with a larger generation number, so walks stop descending as soon as they pass below the
+generation of the commit they are looking for.
+'''
+from __future__ import annotations
+import heapq
+import os
+import re
+from datetime import datetime
+from typing import Iterator
+from classes.gitcommit import GitCommit
+from classes.gitcommitgraph import CommitGraphEntry, GitCommitGraph
+from classes.gitref import GitRef
+from classes.gitrepository import Repository
+from classes.utils import find_commit_hash_from_head_file
+
+# flags used while painting the history of two commits down to their common ancestors
+_REACHABLE_FROM_FIRST: int = 1
+_REACHABLE_FROM_SECOND: int = 2
+_STALE: int = 4
+_MERGE_BASE: int = 8
+
+_SHA1_PREFIX_PATTERN = re.compile(r'[0-9a-f]{4,40}')
+
+
+class GitHistory:
+    '''
+    The commit history of a .kr_git repo.
+
+    Attributes:
+        repository (Repository): the repository whose history is walked
+        kr_git_root (str): path of the .kr_git repo
+        commit_graph (GitCommitGraph): the repo's commit-graph, or None if it has not been written yet
+    '''
+
+    def __init__(self, repository: Repository = None):
+        self.repository: Repository = repository or Repository.current()
+        self.kr_git_root: str = self.repository.kr_git_root
+        self.commit_graph: GitCommitGraph = GitCommitGraph.load(self.kr_git_root)
+        self._entries: dict[str, CommitGraphEntry] = {}
+
+    def entry(self, commit_sha1: str) -> CommitGraphEntry:
+        '''
+        Returns the root tree, timestamp, generation number and parents of a commit.
+
+        Throws:
+            FileNotFoundError: if the commit is not in the repo
+        '''
+        if commit_sha1 in self._entries:
+            return self._entries[commit_sha1]
+        if self.commit_graph is not None:
+            graph_entry: CommitGraphEntry = self.commit_graph.find(commit_sha1)
+            if graph_entry is not None:
+                self._entries[commit_sha1] = graph_entry
+                return graph_entry
+
+        # not in the graph: inflate the commit, and its parents until graphed ones are reached, to get a generation
+        loaded_commits: dict[str, GitCommit] = {}
+        pending_sha1s: list[str] = [commit_sha1]
+        while pending_sha1s:
+            curr_sha1: str = pending_sha1s[-1]
+            if curr_sha1 in self._entries:
+                pending_sha1s.pop()
+                continue
+            if curr_sha1 not in loaded_commits:
+                graph_entry = self.commit_graph.find(curr_sha1) if self.commit_graph is not None else None
+                if graph_entry is not None:
+                    self._entries[curr_sha1] = graph_entry
+                    pending_sha1s.pop()
+                    continue
+                loaded_commits[curr_sha1] = GitCommit.init_from_commit_hash(curr_sha1, self.repository.object_store)
+            curr_commit_obj: GitCommit = loaded_commits[curr_sha1]
+            missing_parent_sha1s: list[str] = [parent_sha1 for parent_sha1 in curr_commit_obj.parent_sha1s
+                                               if parent_sha1 not in self._entries]
+            if missing_parent_sha1s:
+                pending_sha1s.extend(missing_parent_sha1s)
+                continue
+            pending_sha1s.pop()
+            self._entries[curr_sha1] = CommitGraphEntry(
+                curr_sha1, curr_commit_obj.root_tree_sha1, curr_commit_obj.commit_timestamp(),
+                1 + max((self._entries[parent_sha1].generation for parent_sha1 in curr_commit_obj.parent_sha1s),
+                        default=0),
+                list(curr_commit_obj.parent_sha1s))
+        return self._entries[commit_sha1]
+
+    def resolve(self, commit_name: str) -> str:
+        '''
+        Resolves HEAD, the name of a ref, or a full or abbreviated (at least 4 characters) commit sha1 to the full
+        sha1 of a commit.
+
+        Throws:
+            ValueError: if commit_name does not name exactly one commit
+        '''
+        if commit_name == 'HEAD':
+            head_file_path: str = os.path.join(self.kr_git_root, 'HEAD')
+            if not os.path.isfile(head_file_path):
+                raise ValueError('HEAD does not point at a commit yet')
+            return find_commit_hash_from_head_file(head_file_path)
+        ref_file_path: str = os.path.join(self.kr_git_root, 'refs', commit_name)
+        if os.path.isfile(ref_file_path):
+            return GitRef.init_from_ref_file(ref_file_path).target_commit_sha1
+        # sha1s are matched case-insensitively, but errors name the commit the way the user spelled it
+        sha1_prefix: str = commit_name.lower()
+        if not _SHA1_PREFIX_PATTERN.fullmatch(sha1_prefix):
+            raise ValueError(f'{commit_name} is not a ref or a commit sha1')
+        if len(sha1_prefix) == 40:
+            if not self.repository.object_store.has('commits', sha1_prefix):
+                raise ValueError(f'There is no commit {commit_name}')
+            return sha1_prefix
+
+        matching_sha1s: set[str] = set()
+        if self.commit_graph is not None:
+            matching_sha1s.update(self.commit_graph.iter_sha1s_with_prefix(sha1_prefix))
+        fan_out_path: str = os.path.join(self.kr_git_root, 'commits', sha1_prefix[:2])
+        if os.path.isdir(fan_out_path):
+            matching_sha1s.update(sha1_prefix[:2] + object_file_name for object_file_name in os.listdir(fan_out_path)
+                                  if object_file_name.startswith(sha1_prefix[2:]))
+        if len(matching_sha1s) != 1:
+            raise ValueError(f'{commit_name} matches {len(matching_sha1s)} commits')
+        return matching_sha1s.pop()
+
+    def iter_log(self, tip_commit_sha1s: list[str]) -> Iterator[CommitGraphEntry]:
+        '''
+        Yields every commit reachable from tip_commit_sha1s once, newest first.
+        '''
+        queue: list[tuple[int, str]] = []
+        seen_sha1s: set[str] = set()
+        for commit_sha1 in tip_commit_sha1s:
+            if commit_sha1 not in seen_sha1s:
+                seen_sha1s.add(commit_sha1)
+                heapq.heappush(queue, (-self.entry(commit_sha1).timestamp, commit_sha1))
+        while queue:
+            _, commit_sha1 = heapq.heappop(queue)
+            curr_entry: CommitGraphEntry = self.entry(commit_sha1)
+            yield curr_entry
+            for parent_sha1 in curr_entry.parent_sha1s:
+                if parent_sha1 not in seen_sha1s:
+                    seen_sha1s.add(parent_sha1)
+                    heapq.heappush(queue, (-self.entry(parent_sha1).timestamp, parent_sha1))
+
+    def is_ancestor(self, ancestor_sha1: str, descendant_sha1: str) -> bool:
+        '''
+        Checks whether ancestor_sha1 is reachable from descendant_sha1 (a commit counts as its own ancestor). Only
+        commits whose generation number is above the ancestor's are walked.
+        '''
+        ancestor_generation: int = self.entry(ancestor_sha1).generation
+        pending_sha1s: list[str] = [descendant_sha1]
+        seen_sha1s: set[str] = {descendant_sha1}
+        while pending_sha1s:
+            commit_sha1: str = pending_sha1s.pop()
+            if commit_sha1 == ancestor_sha1:
+                return True
+            curr_entry: CommitGraphEntry = self.entry(commit_sha1)
+            if curr_entry.generation <= ancestor_generation:
+                continue
+            for parent_sha1 in curr_entry.parent_sha1s:
+                if parent_sha1 not in seen_sha1s:
+                    seen_sha1s.add(parent_sha1)
+                    pending_sha1s.append(parent_sha1)
+        return False
+
+    def merge_bases(self, first_sha1: str, second_sha1: str) -> list[str]:
+        '''
+        Finds the best common ancestors of two commits: the common ancestors that are not ancestors of another
+        common ancestor. Commits are visited from the highest generation number down, so every descendant of a
+        commit is visited before it, and the walk stops once only commits below a common ancestor are left.
+
+        Returns:
+            list[str]: hex sha1s of the best common ancestors, newest first. Empty if the commits share no history
+        '''
+        if first_sha1 == second_sha1:
+            return [first_sha1]
+        flags: dict[str, int] = {first_sha1: _REACHABLE_FROM_FIRST, second_sha1: _REACHABLE_FROM_SECOND}
+        queue: list[tuple[int, int, str]] = []
+        for commit_sha1 in (first_sha1, second_sha1):
+            curr_entry: CommitGraphEntry = self.entry(commit_sha1)
+            heapq.heappush(queue, (-curr_entry.generation, -curr_entry.timestamp, commit_sha1))
+        candidate_sha1s: list[str] = []
+        while any(not flags[commit_sha1] & _STALE for _, _, commit_sha1 in queue):
+            _, _, commit_sha1 = heapq.heappop(queue)
+            commit_flags: int = flags[commit_sha1] & ~_MERGE_BASE
+            if (commit_flags & _REACHABLE_FROM_FIRST) and (commit_flags & _REACHABLE_FROM_SECOND):
+                if not flags[commit_sha1] & _MERGE_BASE:
+                    flags[commit_sha1] |= _MERGE_BASE
+                    candidate_sha1s.append(commit_sha1)
+                # the ancestors of a common ancestor are common ancestors too, but never the best ones
+                commit_flags |= _STALE
+            for parent_sha1 in self.entry(commit_sha1).parent_sha1s:
+                parent_flags: int = flags.get(parent_sha1, 0)
+                if parent_flags & commit_flags == commit_flags:
+                    continue
+                flags[parent_sha1] = parent_flags | commit_flags
+                parent_entry: CommitGraphEntry = self.entry(parent_sha1)
+                heapq.heappush(queue, (-parent_entry.generation, -parent_entry.timestamp, parent_sha1))
+
+        # a candidate found before the walk marked it stale may still be an ancestor of another candidate
+        return [candidate_sha1 for candidate_sha1 in candidate_sha1s
+                if not any(other_sha1 != candidate_sha1 and self.is_ancestor(candidate_sha1, other_sha1)
+                           for other_sha1 in candidate_sha1s)]
+
+    @classmethod
+    def format_timestamp(cls, timestamp: int) -> str:
+        '''
+        Formats a timestamp in microseconds since the epoch the same way commit times are written.
+        '''
+        return str(datetime.fromtimestamp(timestamp // 1_000_000).replace(microsecond=timestamp % 1_000_000))
@@ -0,0 +1,192 @@
+'''
+A module that contains IgnoreRules, the compiled patterns of a .krgitignore file.
+
+.krgitignore files use the gitignore pattern syntax and may be placed in any directory of the repository, where
+they apply to everything below that directory:
+
+    * blank lines and lines starting with # are skipped; a backslash escapes a leading # or !, or a trailing space
+    * a leading ! re-includes paths that an earlier pattern ignored (but not paths inside an ignored directory,
+      since ignored directories are never descended into)
+    * a trailing / only matches directories
+    * a pattern with a / anywhere else is relative to the directory of the .krgitignore file; one without matches
+      a name at any depth below it
+    * * and ? match anything but a /, [...] matches one character of a class, a leading **/ matches any number of
+      leading directories, a trailing /** everything inside a directory and /**/ any number of directories
+
+Later patterns override earlier ones, and patterns in a deeper .krgitignore override those of its parents. Each
+file is compiled once into a handful of regular expressions (one per run of patterns with the same sign), so
+checking a path costs a few regex matches no matter how many patterns there are.
+
+Classes contained:
+    1. IgnoreRules
+'''
+from __future__ import annotations
+import os
+import re
+
+IGNORE_FILE_NAME: str = '.krgitignore'
+
+_loaded_rules: dict[tuple[str, str], tuple[tuple[int, int], IgnoreRules]] = {}
+
+
+def _translate_glob(glob: str) -> str:
+    '''
+    Translates a gitignore glob (without its leading / or trailing /) into a regular expression.
+    '''
+    regex_parts: list[str] = []
+    position: int = 0
+    while position < len(glob):
+        char: str = glob[position]
+        if char == '*':
+            star_end: int = position
+            while star_end < len(glob) and glob[star_end] == '*':
+                star_end += 1
+            at_segment_start: bool = position == 0 or glob[position - 1] == '/'
+            if star_end - position == 2 and at_segment_start and star_end == len(glob):
+                regex_parts.append('.*')
+            elif star_end - position == 2 and at_segment_start and glob[star_end] == '/':
+                regex_parts.append('(?:.*/)?')
+                star_end += 1
+            else:
+                regex_parts.append('[^/]*')
+            position = star_end
+            continue
+        if char == '?':
+            regex_parts.append('[^/]')
+        elif char == '[':
+            class_end: int = position + 1
+            if class_end < len(glob) and glob[class_end] in '!^':
+                class_end += 1
+            if class_end < len(glob) and glob[class_end] == ']':
+                class_end += 1
+            class_end = glob.find(']', class_end)
+            if class_end == -1:
+                regex_parts.append(re.escape(char))
+            else:
+                class_body: str = glob[position + 1:class_end].replace('\\', '\\\\').replace('[', '\\[')
+                if class_body[0] in '!^':
+                    class_body = '^' + class_body[1:]
+                regex_parts.append(f'[{class_body}]')
+                position = class_end
+        elif char == '\\' and position + 1 < len(glob):
+            position += 1
+            regex_parts.append(re.escape(glob[position]))
+        else:
+            regex_parts.append(re.escape(char))
+        position += 1
+    return ''.join(regex_parts)
+
+
+def _parse_pattern(line: str) -> tuple[bool, bool, str]:
+    '''
+    Parses one line of a .krgitignore file.
+
+    Returns:
+        tuple[bool, bool, str]: whether the pattern is negated, whether it only matches directories and its
+            regular expression, or None if the line holds no pattern
+    '''
+    line = line.rstrip('\r')
+    while line.endswith(' ') and not line.endswith('\\ '):
+        line = line[:-1]
+    if not line or line.startswith('#'):
+        return None
+    negated: bool = line.startswith('!')
+    if negated:
+        line = line[1:]
+    dir_only: bool = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    anchored: bool = '/' in line
+    line = line.lstrip('/')
+    return negated, dir_only, ('' if anchored else '(?:.*/)?') + _translate_glob(line)
+
+
+def _compile(regexes: list[str]) -> re.Pattern:
+    if not regexes:
+        return None
+    return re.compile('|'.join(f'(?:{regex})' for regex in regexes), re.DOTALL)
+
+
+class IgnoreRules:
+    '''
+    The patterns of one .krgitignore file.
+
+    Attributes:
+        base_path (str): path of the file's directory relative to the root of the walk ('' for the root itself)
+        segments (list[tuple[bool, re.Pattern, re.Pattern]]): every run of consecutive patterns with the same sign,
+            in order, as whether the run is negated, the combined expression of its patterns that match files and
+            that of all of its patterns (which match directories)
+    '''
+
+    def __init__(self, patterns: list[str], base_path: str = ''):
+        self.base_path: str = base_path
+        self.segments: list[tuple[bool, re.Pattern, re.Pattern]] = []
+        parsed_patterns: list[tuple[bool, bool, str]] = [
+            parsed_pattern for parsed_pattern in map(_parse_pattern, patterns) if parsed_pattern is not None]
+        run_start: int = 0
+        for run_end in range(1, len(parsed_patterns) + 1):
+            if run_end < len(parsed_patterns) and parsed_patterns[run_end][0] == parsed_patterns[run_start][0]:
+                continue
+            run: list[tuple[bool, bool, str]] = parsed_patterns[run_start:run_end]
+            self.segments.append((run[0][0], _compile([regex for _, dir_only, regex in run if not dir_only]),
+                                  _compile([regex for _, _, regex in run])))
+            run_start = run_end
+
+    @classmethod
+    def load(cls, ignore_file_path: str, base_path: str = '') -> IgnoreRules:
+        '''
+        Reads and compiles a .krgitignore file. A file is only compiled again once it has changed.
+
+        Args:
+            ignore_file_path (str): path of the .krgitignore file
+            base_path (str): path of its directory relative to the root of the walk
+
+        Returns:
+            IgnoreRules: the compiled rules, or None if the file holds no patterns
+        '''
+        ignore_file_stat: os.stat_result = os.stat(ignore_file_path)
+        stat_key: tuple[int, int] = (ignore_file_stat.st_mtime_ns, ignore_file_stat.st_size)
+        cached_rules: tuple[tuple[int, int], IgnoreRules] = _loaded_rules.get((ignore_file_path, base_path))
+        if cached_rules is not None and cached_rules[0] == stat_key:
+            return cached_rules[1]
+        with open(ignore_file_path, 'r', encoding='utf8', errors='surrogateescape') as ignore_file:
+            ignore_rules: IgnoreRules = cls(ignore_file.read().split('\n'), base_path)
+        if not ignore_rules.segments:
+            ignore_rules = None
+        _loaded_rules[(ignore_file_path, base_path)] = (stat_key, ignore_rules)
+        return ignore_rules
+
+    def match(self, rel_path: str, is_dir: bool) -> bool:
+        '''
+        Checks a path against the patterns, the last matching pattern deciding.
+
+        Args:
+            rel_path (str): path relative to the file's directory, with / separators
+            is_dir (bool): whether the path is a directory
+
+        Returns:
+            bool: whether the path is ignored, or None if no pattern matches it
+        '''
+        for negated, file_pattern, dir_pattern in reversed(self.segments):
+            pattern: re.Pattern = dir_pattern if is_dir else file_pattern
+            if pattern is not None and pattern.fullmatch(rel_path):
+                return not negated
+        return None
+
+    @classmethod
+    def is_ignored(cls, rules_chain: tuple[IgnoreRules, ...], rel_path: str, is_dir: bool) -> bool:
+        '''
+        Checks a path against every .krgitignore file that applies to it, the deepest file deciding first.
+
+        Args:
+            rules_chain (tuple[IgnoreRules, ...]): the rules of the directory's .krgitignore files, outermost first
+            rel_path (str): path relative to the root of the walk, with / separators
+            is_dir (bool): whether the path is a directory
+        '''
+        for ignore_rules in reversed(rules_chain):
+            base_path: str = ignore_rules.base_path
+            ignored: bool = ignore_rules.match(rel_path[len(base_path) + 1:] if base_path else rel_path, is_dir)
+            if ignored is not None:
+                return ignored
+        return False
@@ -0,0 +1,227 @@
+'''
+Contains the GitIndex class, a stat cache that lets a commit skip rehashing files that have not changed.
+
+The index lives at .kr_git/index and records, for every file and symlink in the last commit, its size, mtime and
+inode along with the sha1 of its blob. It also records the sha1 and entry count of every directory's tree so that
+whole subtrees whose entries are all unchanged can reuse their previous sha1 without being re-serialized.
+'''
+from __future__ import annotations
+import os
+from dataclasses import dataclass
+from classes.gitrepository import write_file_atomically
+from classes.utils import EntryType
+
+INDEX_MAGIC: bytes = b'KRINDEX'
+INDEX_VERSION: int = 2
+# the record type of each kind of file entry in the index file
+_RECORD_TYPES: dict[EntryType, str] = {EntryType.BLOB: 'B', EntryType.SYMLINK: 'L', EntryType.CHUNKED: 'C'}
+_ENTRY_TYPES_BY_RECORD: dict[str, EntryType] = {record_type: entry_type
+                                                for entry_type, record_type in _RECORD_TYPES.items()}
+
+
+@dataclass
+class GitIndexEntry():
+    '''
+    Cached stat data for a single file in the working directory.
+
+    Attributes:
+        file_path (str): path of the file relative to the repository root
+        size (int): size of the file in bytes
+        mtime_ns (int): modification time of the file in nanoseconds
+        inode (int): inode number of the file
+        sha1 (str): sha1 of the blob that was written for the file
+        entry_type (EntryType): BLOB for a file, SYMLINK for a symlink (whose blob holds the link's target) and
+            CHUNKED for a file stored as chunks (whose sha1 is that of its manifest)
+    '''
+    file_path: str
+    size: int
+    mtime_ns: int
+    inode: int
+    sha1: str
+    entry_type: EntryType = EntryType.BLOB
+
+
+class GitIndex:
+    '''
+    A persistent stat cache for the working directory.
+
+    Lookups are answered from the index that was loaded from disk, while the entries seen during the current
+    walk are collected separately so that files which no longer exist drop out when the index is written back.
+
+    Attributes:
+        index_file_path (str): path of the index file inside the .kr_git repo
+        repo_root_path (str): absolute path of the repository root that the index describes
+        index_mtime_ns (int): mtime of the index file when it was loaded. Files modified at or after this time are
+            treated as changed, since a modification within the same timestamp granularity would not be visible.
+        blob_entries (dict[str, GitIndexEntry]): cached file entries loaded from disk, keyed by relative path
+        tree_entries (dict[str, tuple[str, int]]): cached (sha1, entry count) of each directory, keyed by relative path
+        new_blob_entries (dict[str, GitIndexEntry]): file entries seen during the current walk
+        new_tree_entries (dict[str, tuple[str, int]]): directory entries seen during the current walk
+    '''
+
+    def __init__(self, index_file_path: str, repo_root_path: str):
+        self.index_file_path: str = index_file_path
+        self.repo_root_path: str = os.path.normpath(repo_root_path)
+        self.index_mtime_ns: int = 0
+        self.blob_entries: dict[str, GitIndexEntry] = {}
+        self.tree_entries: dict[str, tuple[str, int]] = {}
+        self.new_blob_entries: dict[str, GitIndexEntry] = {}
+        self.new_tree_entries: dict[str, tuple[str, int]] = {}
+
+    def relative_path(self, full_path: str) -> str:
+        '''
+        Converts an absolute path under the repository root into the key used by the index.
+
+        Args:
+            full_path (str): absolute path of a file or directory inside the repository
+
+        Returns:
+            str: the path relative to the repository root ('.' for the root itself)
+        '''
+        if full_path == self.repo_root_path:
+            return '.'
+        return full_path[len(self.repo_root_path) + 1:]
+
+    def lookup_blob(self, rel_path: str, file_stat: os.stat_result, entry_type: EntryType = EntryType.BLOB) -> str:
+        '''
+        Returns the cached blob sha1 of a file if its stat data is unchanged since the last commit.
+        A hit is also recorded into the index that will be written back.
+
+        Args:
+            rel_path (str): path of the file relative to the repository root
+            file_stat (os.stat_result): the current stat data of the file (of the link itself for a symlink)
+            entry_type (EntryType): the type of tree entry the file is committed as
+
+        Returns:
+            str: the cached sha1, or None if the file has to be rehashed
+        '''
+        cached_entry: GitIndexEntry = self.blob_entries.get(rel_path)
+        if cached_entry is None:
+            return None
+        if (cached_entry.entry_type != entry_type
+                or cached_entry.size != file_stat.st_size
+                or cached_entry.mtime_ns != file_stat.st_mtime_ns
+                or cached_entry.inode != file_stat.st_ino
+                or file_stat.st_mtime_ns >= self.index_mtime_ns):
+            return None
+        self.new_blob_entries[rel_path] = cached_entry
+        return cached_entry.sha1
+
+    def record_blob(self, rel_path: str, file_stat: os.stat_result, sha1: str,
+                    entry_type: EntryType = EntryType.BLOB) -> None:
+        '''
+        Records the stat data and blob sha1 of a file or symlink that was hashed during the current walk.
+        '''
+        self.new_blob_entries[rel_path] = GitIndexEntry(
+            rel_path, file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino, sha1, entry_type)
+
+    def previous_sha1(self, rel_path: str, entry_type: EntryType = EntryType.BLOB) -> str:
+        '''
+        Returns the sha1 that a file or directory had in the loaded index, or None if it was not present. A file
+        whose entry type has since changed (to a symlink, say) was not present, even if its sha1 is the same.
+        '''
+        cached_entry: GitIndexEntry = self.blob_entries.get(rel_path)
+        if cached_entry is not None:
+            return cached_entry.sha1 if cached_entry.entry_type == entry_type else None
+        cached_tree: tuple[str, int] = self.tree_entries.get(rel_path)
+        if cached_tree is not None:
+            return cached_tree[0]
+        return None
+
+    def lookup_tree(self, rel_path: str, entry_count: int) -> str:
+        '''
+        Returns the cached sha1 of a directory's tree. Callers must only use the result when every entry of the
+        directory has the same sha1 as it had in the loaded index; together with a matching entry count this
+        guarantees that the tree would serialize to the same bytes.
+
+        Args:
+            rel_path (str): path of the directory relative to the repository root
+            entry_count (int): number of entries currently in the directory
+
+        Returns:
+            str: the cached tree sha1, or None if the directory was not cached with the same number of entries
+        '''
+        cached_tree: tuple[str, int] = self.tree_entries.get(rel_path)
+        if cached_tree is None or cached_tree[1] != entry_count:
+            return None
+        return cached_tree[0]
+
+    def record_tree(self, rel_path: str, sha1: str, entry_count: int) -> None:
+        '''
+        Records the sha1 and entry count of a directory's tree seen during the current walk.
+        '''
+        self.new_tree_entries[rel_path] = (sha1, entry_count)
+
+    def serialize(self) -> bytes:
+        '''
+        Serializes the entries seen during the current walk. Fields are NUL separated so that paths may contain
+        spaces and newlines.
+
+        Returns:
+            bytes: the contents of the index file
+        '''
+        fields: list[str] = [str(INDEX_VERSION), self.repo_root_path]
+        for entry in self.new_blob_entries.values():
+            fields.extend((_RECORD_TYPES[entry.entry_type], entry.file_path, str(entry.size), str(entry.mtime_ns), str(entry.inode), entry.sha1))
+        for rel_path, (sha1, entry_count) in self.new_tree_entries.items():
+            fields.extend(('T', rel_path, sha1, str(entry_count)))
+        return INDEX_MAGIC + b'\0' + '\0'.join(fields).encode('utf-8', 'surrogateescape')
+
+    def write(self) -> None:
+        '''
+        Writes the entries seen during the current walk to the index file. The file is written to a temporary
+        path and renamed into place so that an interrupted write cannot leave a truncated index behind. It is not
+        synced, since a lost index only means that the next commit rehashes the files.
+        '''
+        write_file_atomically(self.index_file_path, self.serialize(), sync=False)
+
+    @classmethod
+    def load(cls, kr_git_root_path: str, repo_root_path: str) -> GitIndex:
+        '''
+        Loads the index of a repository. A missing, unreadable or outdated index (including one written for a
+        repository at a different path) yields an empty index, which simply makes every file a cache miss.
+
+        Args:
+            cls: the GitIndex class
+            kr_git_root_path (str): path of the .kr_git repo
+            repo_root_path (str): absolute path of the repository root
+
+        Returns:
+            GitIndex: the loaded index
+        '''
+        out_index: GitIndex = cls(os.path.join(kr_git_root_path, 'index'), repo_root_path)
+        try:
+            with open(out_index.index_file_path, 'rb') as index_file:
+                index_mtime_ns: int = os.fstat(index_file.fileno()).st_mtime_ns
+                contents: bytes = index_file.read()
+        except FileNotFoundError:
+            return out_index
+
+        fields: list[str] = contents.decode('utf-8', 'surrogateescape').split('\0')
+        if len(fields) < 3 or fields[0] != INDEX_MAGIC.decode() or fields[1] != str(INDEX_VERSION):
+            return out_index
+        if fields[2] != out_index.repo_root_path:
+            return out_index
+
+        idx: int = 3
+        try:
+            while idx < len(fields):
+                if fields[idx] in _ENTRY_TYPES_BY_RECORD:
+                    rel_path, size, mtime_ns, inode, sha1 = fields[idx + 1:idx + 6]
+                    out_index.blob_entries[rel_path] = GitIndexEntry(
+                        rel_path, int(size), int(mtime_ns), int(inode), sha1, _ENTRY_TYPES_BY_RECORD[fields[idx]])
+                    idx += 6
+                elif fields[idx] == 'T':
+                    rel_path, sha1, entry_count = fields[idx + 1:idx + 4]
+                    out_index.tree_entries[rel_path] = (sha1, int(entry_count))
+                    idx += 4
+                else:
+                    raise ValueError(f'Unknown index record type: {fields[idx]}')
+        except ValueError:
+            print('The .kr_git index is corrupt and will be rebuilt.')
+            out_index.blob_entries.clear()
+            out_index.tree_entries.clear()
+            return out_index
+
+        out_index.index_mtime_ns = index_mtime_ns
+        return out_index
@@ -0,0 +1,185 @@
+'''
+Contains the GitMigrate class, which rewrites an existing .kr_git object store to the v2 blob format.
+
+v1 blobs hash their absolute file path along with their contents, so identical files are stored once per path.
+Migrating rewrites every blob in the v2 format (where only the contents are hashed), which collapses those
+duplicates, and then rewrites the trees, commits, refs and HEAD that point at them. Packed objects are migrated
+along with loose ones; the rewritten objects are written loose, and the packed objects they replace are left for
+krgit prune to drop, since a pack cannot be edited in place.
+'''
+import os
+from classes.gitblob import GitBlob
+from classes.gittree import GitTree
+from classes.gitcommit import GitCommit
+from classes.gitcommitgraph import GitCommitGraph
+from classes.gitpack import GitPack
+from classes.gitref import GitRef
+from classes.gitrepository import ObjectStore, Repository
+from classes.utils import EntryType, find_commit_hash_from_head_file
+
+
+class GitMigrate:
+    '''
+    Migrates the object store of a .kr_git repo to the v2 blob format.
+
+    Attributes:
+        kr_git_root (str): path of the .kr_git repo
+        object_store (ObjectStore): the store of the repo's objects
+        blob_sha1_map (dict[str, str]): old blob sha1 to new blob sha1
+        tree_sha1_map (dict[str, str]): old tree sha1 to new tree sha1
+        commit_sha1_map (dict[str, str]): old commit sha1 to new commit sha1
+    '''
+
+    def __init__(self):
+        repository: Repository = Repository.current()
+        self.kr_git_root: str = repository.kr_git_root
+        self.object_store: ObjectStore = repository.object_store
+        self.blob_sha1_map: dict[str, str] = {}
+        self.tree_sha1_map: dict[str, str] = {}
+        self.commit_sha1_map: dict[str, str] = {}
+
+    def _iter_object_files(self, object_dir_name: str):
+        '''
+        Yields (sha1, file path) for every loose object in one of the object directories (blobs, trees, commits).
+        '''
+        object_dir_path: str = os.path.join(self.kr_git_root, object_dir_name)
+        if not os.path.isdir(object_dir_path):
+            return
+        for fan_out_name in sorted(os.listdir(object_dir_path)):
+            fan_out_path: str = os.path.join(object_dir_path, fan_out_name)
+            if len(fan_out_name) != 2 or not os.path.isdir(fan_out_path):
+                continue
+            for object_file_name in sorted(os.listdir(fan_out_path)):
+                yield fan_out_name + object_file_name, os.path.join(fan_out_path, object_file_name)
+
+    def _iter_object_sha1s(self, object_dir_name: str) -> list[str]:
+        '''
+        Returns the sha1 of every object in one of the object directories (blobs, trees, commits), loose or packed.
+        '''
+        object_sha1s: set[str] = {sha1 for sha1, _ in self._iter_object_files(object_dir_name)}
+        for pack in GitPack.load_packs(self.kr_git_root, reload=True):
+            object_sha1s.update(sha1 for sha1, pack_entry in pack.iter_entries()
+                                if pack_entry.object_dir_name == object_dir_name)
+        return sorted(object_sha1s)
+
+    def _store_size(self) -> int:
+        '''
+        Returns the total size in bytes of every loose object and pack in the store.
+        '''
+        total_size: int = 0
+        for object_dir_name in ('blobs', 'trees', 'commits'):
+            for _, object_file_path in self._iter_object_files(object_dir_name):
+                total_size += os.path.getsize(object_file_path)
+        for pack in GitPack.load_packs(self.kr_git_root, reload=True):
+            total_size += os.path.getsize(pack.pack_file_path) + os.path.getsize(pack.idx_file_path)
+        return total_size
+
+    def _migrate_blobs(self) -> None:
+        for blob_sha1 in self._iter_object_sha1s('blobs'):
+            file_path, content_size = GitBlob.read_header_from_blob_hash(blob_sha1, self.object_store)
+            if file_path is None:
+                # already a v2 blob
+                self.blob_sha1_map[blob_sha1] = blob_sha1
+                continue
+            self.blob_sha1_map[blob_sha1] = GitBlob.write_from_chunks(
+                GitBlob.iter_contents_from_blob_hash(blob_sha1, self.object_store), content_size, f'blob {blob_sha1}')
+
+    def _migrate_tree(self, tree_sha1: str) -> str:
+        if tree_sha1 in self.tree_sha1_map:
+            return self.tree_sha1_map[tree_sha1]
+        curr_tree_object: GitTree = GitTree.init_from_tree_hash(tree_sha1)
+        for curr_tree_entry in curr_tree_object.internal_tree.values():
+            if curr_tree_entry.entry_type in (EntryType.BLOB, EntryType.SYMLINK):
+                curr_tree_entry.entry_hash = self.blob_sha1_map[curr_tree_entry.entry_hash]
+            elif curr_tree_entry.entry_type == EntryType.TREE:
+                curr_tree_entry.entry_hash = self._migrate_tree(curr_tree_entry.entry_hash)
+        curr_tree_object.write_git_tree_to_file()
+        self.tree_sha1_map[tree_sha1] = curr_tree_object.sha1
+        return curr_tree_object.sha1
+
+    def _migrate_commit(self, commit_sha1: str) -> None:
+        # a commit's sha1 covers its parents' sha1s, so parents are rewritten before their children
+        pending_sha1s: list[str] = [commit_sha1]
+        while pending_sha1s:
+            curr_sha1: str = pending_sha1s[-1]
+            if curr_sha1 in self.commit_sha1_map:
+                pending_sha1s.pop()
+                continue
+            curr_commit_obj: GitCommit = GitCommit.init_from_commit_hash(curr_sha1)
+            unmigrated_parent_sha1s: list[str] = [parent_sha1 for parent_sha1 in curr_commit_obj.parent_sha1s
+                                                  if parent_sha1 not in self.commit_sha1_map]
+            if unmigrated_parent_sha1s:
+                pending_sha1s.extend(unmigrated_parent_sha1s)
+                continue
+            pending_sha1s.pop()
+            curr_commit_obj.root_tree_sha1 = self._migrate_tree(curr_commit_obj.root_tree_sha1)
+            curr_commit_obj.parent_sha1s = [self.commit_sha1_map[parent_sha1]
+                                            for parent_sha1 in curr_commit_obj.parent_sha1s]
+            curr_commit_obj.write_commit_to_file()
+            self.commit_sha1_map[curr_sha1] = curr_commit_obj.commit_sha1
+
+    def _migrate_commits(self) -> None:
+        for commit_sha1 in self._iter_object_sha1s('commits'):
+            self._migrate_commit(commit_sha1)
+
+    def _migrate_refs(self) -> None:
+        refs_dir_path: str = os.path.join(self.kr_git_root, 'refs')
+        if os.path.isdir(refs_dir_path):
+            for ref_name in os.listdir(refs_dir_path):
+                curr_ref_obj: GitRef = GitRef.init_from_ref_file(os.path.join(refs_dir_path, ref_name))
+                new_commit_sha1: str = self.commit_sha1_map.get(curr_ref_obj.target_commit_sha1)
+                if new_commit_sha1 and new_commit_sha1 != curr_ref_obj.target_commit_sha1:
+                    GitRef.init_using_commit_sha1(new_commit_sha1, ref_name).write_to_file()
+
+        head_file_path: str = os.path.join(self.kr_git_root, 'HEAD')
+        if os.path.isfile(head_file_path):
+            head_commit_sha1: str = find_commit_hash_from_head_file(head_file_path)
+            new_commit_sha1: str = self.commit_sha1_map.get(head_commit_sha1)
+            if new_commit_sha1 and new_commit_sha1 != head_commit_sha1:
+                with open(head_file_path, 'r', encoding='utf8') as head_file:
+                    head_ref_name: str = head_file.read().split('@')[0]
+                Repository.current().object_store.write_repo_file(
+                    'HEAD', f'{head_ref_name}@{new_commit_sha1}'.encode('utf8'))
+
+    def _remove_replaced_objects(self) -> int:
+        '''
+        Deletes the loose objects that were replaced, returning how many replaced objects are packed instead.
+        '''
+        packed_count: int = 0
+        for object_dir_name, sha1_map in (('blobs', self.blob_sha1_map), ('trees', self.tree_sha1_map),
+                                          ('commits', self.commit_sha1_map)):
+            for old_sha1, new_sha1 in sha1_map.items():
+                if old_sha1 == new_sha1:
+                    continue
+                try:
+                    os.remove(self.object_store.object_path(object_dir_name, old_sha1))
+                except FileNotFoundError:
+                    packed_count += 1
+        return packed_count
+
+    def migrate(self) -> None:
+        '''
+        Rewrites every blob in the v2 format, then every tree and commit that points at a rewritten blob, then the
+        refs and HEAD. The objects that were replaced are deleted once everything points at their replacements,
+        and the space saved is reported.
+        '''
+        size_before: int = self._store_size()
+        self._migrate_blobs()
+        self._migrate_commits()
+        self._migrate_refs()
+        packed_replaced_count: int = self._remove_replaced_objects()
+        # the commit-graph still lists the replaced commits, so it is rebuilt from the rewritten ones
+        GitCommitGraph.update(self.kr_git_root, set(self.commit_sha1_map.values()), rebuild=True)
+        size_after: int = self._store_size()
+
+        rewritten_blob_count: int = sum(1 for old, new in self.blob_sha1_map.items() if old != new)
+        unique_blob_count: int = len(set(self.blob_sha1_map.values()))
+        rewritten_commit_count: int = sum(1 for old, new in self.commit_sha1_map.items() if old != new)
+        print(f'Migrated {rewritten_blob_count} blobs to the v2 format '
+              f'({len(self.blob_sha1_map)} blobs -> {unique_blob_count} unique), '
+              f'{rewritten_commit_count} commits rewritten')
+        print(f'Object store size: {size_before} bytes -> {size_after} bytes '
+              f'({size_before - size_after} bytes saved)')
+        if packed_replaced_count:
+            print(f'{packed_replaced_count} replaced objects are still in packs; run krgit prune --expire 0 to '
+                  'remove them')
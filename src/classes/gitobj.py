@@ -1,6 +1,13 @@
 import hashlib
-import zlib
 from abc import ABC, abstractmethod
+from typing import BinaryIO, Iterator
+from classes import gitcompression
+from classes.gitpack import InflatedObjectReader
+from classes.gitrepository import ObjectStore, Repository
+from classes.gittrace import tracer
+
+# size of the pieces that large objects are read, hashed, compressed and written in
+STREAM_CHUNK_SIZE: int = 1024 * 1024
 
 class GitObject(ABC):
     @abstractmethod
@@ -9,14 +16,105 @@ class GitObject(ABC):
 
     @classmethod
     def deserialize(cls, file_path: str) -> bytes:
-        with open(file_path, 'rb') as f:
-            return zlib.decompress(f.read())
+        with tracer.phase('read'):
+            with open(file_path, 'rb') as f:
+                compressed_data: bytes = f.read()
+        with tracer.phase('inflate'):
+            return gitcompression.decompress(compressed_data)
+
+    @classmethod
+    def open_object(cls, object_dir_name: str, sha1: str, object_store: ObjectStore = None) -> BinaryIO:
+        '''
+        Opens the compressed data of an object, wherever it is stored. Packs are searched first (an in-memory
+        binary search), then the loose object file. If neither has the object, packs written since they were last
+        loaded are picked up and searched once more.
+
+        Args:
+            object_dir_name (str): the kind of object ('blobs', 'trees' or 'commits')
+            sha1 (str): hex sha1 of the object
+            object_store (ObjectStore): the store to read from, if not that of the current repository
+
+        Returns:
+            BinaryIO: a readable file of the object's compressed data
+
+        Throws:
+            FileNotFoundError: if the object is not in the repo
+        '''
+        return (object_store or Repository.current().object_store).open(object_dir_name, sha1)
+
+    @classmethod
+    def read_object(cls, object_dir_name: str, sha1: str, object_store: ObjectStore = None) -> bytes:
+        '''
+        Returns the decompressed contents of an object, wherever it is stored. See open_object.
+        '''
+        with cls.open_object(object_dir_name, sha1, object_store) as compressed_file:
+            return b''.join(cls.inflate_stream(compressed_file))
+
+    @classmethod
+    def object_exists(cls, object_dir_name: str, sha1: str, object_store: ObjectStore = None) -> bool:
+        '''
+        Checks whether an object is already stored, either loose or in a pack, in object_store if given and in the
+        current repository otherwise.
+        '''
+        return (object_store or Repository.current().object_store).has(object_dir_name, sha1)
 
     @classmethod
     def hash(cls, data: bytes) -> str:
-        return hashlib.sha1(data).hexdigest()
+        tracer.count('bytes_hashed', len(data))
+        with tracer.phase('hash'):
+            return hashlib.sha1(data).hexdigest()
     
     @classmethod
-    def compress(cls, data: bytes) -> bytes:
-        return zlib.compress(data)
-    
+    def compress(cls, data: bytes, path_hint: str = None, repository: Repository = None) -> bytes:
+        '''
+        Compresses serialized data with the codec that the repo's compression policy chooses for it. The result
+        starts with the codec header that inflate_stream and deserialize dispatch on.
+
+        Args:
+            data (bytes): the serialized object
+            path_hint (str): the path of the file the object holds, if it holds one, for the policy's extension rules
+            repository (Repository): the repository whose policy to use, if not the current one
+
+        Returns:
+            bytes: the data to store
+        '''
+        with tracer.phase('compress'):
+            compressed_data: bytes = (repository or Repository.current()).compression_policy.compress(data, path_hint)
+        tracer.count('bytes_raw', len(data))
+        tracer.count('bytes_compressed', len(compressed_data))
+        return compressed_data
+
+    @classmethod
+    def inflate_stream(cls, compressed_file: BinaryIO) -> Iterator[bytes]:
+        '''
+        Decompresses an object file piece by piece, never holding more than about STREAM_CHUNK_SIZE bytes of
+        compressed or decompressed data at a time. The codec is taken from the object's header.
+
+        Args:
+            compressed_file (BinaryIO): an open file positioned at the start of the compressed data
+
+        Returns:
+            Iterator[bytes]: the decompressed data, in order
+        '''
+        if isinstance(compressed_file, InflatedObjectReader):
+            # objects rebuilt from a pack delta chain are already decompressed
+            yield from compressed_file.iter_chunks(STREAM_CHUNK_SIZE)
+            return
+        with tracer.phase('read'):
+            compressed_chunk: bytes = compressed_file.read(STREAM_CHUNK_SIZE)
+        codec, compressed_chunk = gitcompression.split_codec_header(compressed_chunk)
+        decompressor = codec.decompressor()
+        while not decompressor.eof:
+            if not compressed_chunk and decompressor.needs_input:
+                with tracer.phase('read'):
+                    compressed_chunk = compressed_file.read(STREAM_CHUNK_SIZE)
+                if not compressed_chunk:
+                    if codec.ends_at_eof:
+                        return
+                    raise ValueError('Compressed object data ended unexpectedly')
+            with tracer.phase('inflate'):
+                decompressed_chunk: bytes = decompressor.decompress(compressed_chunk, STREAM_CHUNK_SIZE)
+            compressed_chunk = b''
+            tracer.count('bytes_inflated', len(decompressed_chunk))
+            if decompressed_chunk:
+                yield decompressed_chunk
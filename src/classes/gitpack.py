@@ -0,0 +1,414 @@
+'''
+A module that contains classes that relate to pack files, which store many objects in a single file.
+
+Each pack lives in .kr_git/packs as a pair of files:
+
+    pack-<name>.pack: PACK_MAGIC, a version byte and the object count, followed by the compressed data of every
+        object back to back, and a trailing sha1 of everything before it.
+    pack-<name>.idx: IDX_MAGIC and a version byte, a 256-entry fan-out table (the number of objects whose sha1
+        starts with a byte <= i), the sorted binary sha1s of every object, and one fixed-width record per object
+        holding its offset and length in the pack and its object type.
+
+A packed blob may be stored as a delta against another object in the same pack, in which case its type byte has
+PACK_DELTA_FLAG set and its data is the 20-byte sha1 of the base followed by the compressed delta (see
+gitdelta). Both full objects and deltas carry the codec header described in gitcompression. Reading such a blob reconstructs it from its chain of bases, keeping recently used bases in a
+DeltaBaseCache.
+
+Indexes are read through mmap and searched with a binary search bounded by the fan-out table, so finding an
+object costs a handful of page reads no matter how many objects the pack holds.
+
+Classes contained:
+    1. PackEntry
+    2. PackObjectReader
+    3. InflatedObjectReader
+    4. GitPack
+'''
+from __future__ import annotations
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable, Iterator
+from classes import gitcompression
+from classes.gitdelta import DeltaBaseCache, apply_delta
+
+PACK_MAGIC: bytes = b'KRPACK\0'
+IDX_MAGIC: bytes = b'KRPIDX\0'
+PACK_VERSION: int = 1
+
+# object directories and the type byte that their objects are stored with in a pack
+PACK_OBJECT_TYPES: dict[str, int] = {'blobs': 1, 'trees': 2, 'commits': 3}
+PACK_OBJECT_DIRS: dict[int, str] = {type_byte: dir_name for dir_name, type_byte in PACK_OBJECT_TYPES.items()}
+PACK_DELTA_FLAG: int = 0x80
+
+PACK_HEADER_STRUCT = struct.Struct('>BI')
+FAN_OUT_STRUCT = struct.Struct('>256I')
+IDX_RECORD_STRUCT = struct.Struct('>QQB')
+COPY_BUFFER_SIZE: int = 1024 * 1024
+DELTA_BASE_CACHE_SIZE: int = 64 * 1024 * 1024
+
+_loaded_packs: dict[str, list[GitPack]] = {}
+_delta_base_cache: DeltaBaseCache = DeltaBaseCache(DELTA_BASE_CACHE_SIZE)
+
+
+@dataclass
+class PackEntry():
+    '''
+    The location of a single object inside a pack.
+
+    Attributes:
+        object_dir_name (str): the kind of object ('blobs', 'trees' or 'commits')
+        offset (int): offset of the object's compressed data in the pack file
+        length (int): length of the object's compressed data
+        is_delta (bool): whether the object is stored as a delta against another object in the pack
+    '''
+    object_dir_name: str
+    offset: int
+    length: int
+    is_delta: bool = False
+
+
+class PackObjectReader:
+    '''
+    A read-only file-like view over the compressed data of one object inside a memory-mapped pack.
+
+    Attributes:
+        pack_map (mmap.mmap): the memory-mapped pack file
+        position (int): offset in the pack of the next byte to read
+        end (int): offset in the pack just past the object's data
+    '''
+
+    def __init__(self, pack_map: mmap.mmap, offset: int, length: int):
+        self.pack_map: mmap.mmap = pack_map
+        self.position: int = offset
+        self.end: int = offset + length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or self.position + size > self.end:
+            size = self.end - self.position
+        out: bytes = self.pack_map[self.position:self.position + size]
+        self.position += size
+        return out
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> PackObjectReader:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class InflatedObjectReader:
+    '''
+    Holds an object that had to be reconstructed from a delta chain and is therefore already decompressed.
+    GitObject.inflate_stream recognizes it and hands out its data as is.
+
+    Attributes:
+        data (bytes): the decompressed contents of the object
+    '''
+
+    def __init__(self, data: bytes):
+        self.data: bytes = data
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[bytes]:
+        data_view = memoryview(self.data)
+        for start in range(0, len(self.data), chunk_size):
+            yield bytes(data_view[start:start + chunk_size])
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> InflatedObjectReader:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class GitPack:
+    '''
+    A pack file together with its memory-mapped index.
+
+    Attributes:
+        pack_file_path (str): path of the .pack file
+        idx_file_path (str): path of the .idx file
+        object_count (int): number of objects in the pack
+    '''
+
+    def __init__(self, idx_file_path: str):
+        self.idx_file_path: str = idx_file_path
+        self.pack_file_path: str = idx_file_path[:-len('.idx')] + '.pack'
+        with open(idx_file_path, 'rb') as idx_file:
+            self._idx_map: mmap.mmap = mmap.mmap(idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._idx_map[:len(IDX_MAGIC)] != IDX_MAGIC or self._idx_map[len(IDX_MAGIC)] != PACK_VERSION:
+            raise ValueError(f'{idx_file_path} is not a pack index')
+        self._fan_out: tuple[int, ...] = FAN_OUT_STRUCT.unpack_from(self._idx_map, len(IDX_MAGIC) + 1)
+        self.object_count: int = self._fan_out[255]
+        self._sha1_table_offset: int = len(IDX_MAGIC) + 1 + FAN_OUT_STRUCT.size
+        self._record_table_offset: int = self._sha1_table_offset + 20 * self.object_count
+        self._pack_map: mmap.mmap = None
+
+    def _get_pack_map(self) -> mmap.mmap:
+        if self._pack_map is None:
+            with open(self.pack_file_path, 'rb') as pack_file:
+                self._pack_map = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._pack_map
+
+    def _find_position(self, sha1_bytes: bytes) -> int:
+        '''
+        Binary searches the sorted sha1 table for an object, only looking at the objects whose sha1 starts with
+        the same byte.
+
+        Returns:
+            int: the position of the object in the index, or -1 if the pack does not contain it
+        '''
+        first_byte: int = sha1_bytes[0]
+        low: int = self._fan_out[first_byte - 1] if first_byte else 0
+        high: int = self._fan_out[first_byte]
+        while low < high:
+            mid: int = (low + high) // 2
+            mid_offset: int = self._sha1_table_offset + 20 * mid
+            mid_sha1: bytes = self._idx_map[mid_offset:mid_offset + 20]
+            if mid_sha1 < sha1_bytes:
+                low = mid + 1
+            elif mid_sha1 > sha1_bytes:
+                high = mid
+            else:
+                return mid
+        return -1
+
+    def _entry_at(self, position: int) -> PackEntry:
+        offset, length, type_byte = IDX_RECORD_STRUCT.unpack_from(
+            self._idx_map, self._record_table_offset + IDX_RECORD_STRUCT.size * position)
+        return PackEntry(PACK_OBJECT_DIRS[type_byte & ~PACK_DELTA_FLAG], offset, length,
+                         bool(type_byte & PACK_DELTA_FLAG))
+
+    def find(self, sha1: str) -> PackEntry:
+        '''
+        Looks up an object in the pack.
+
+        Args:
+            sha1 (str): hex sha1 of the object
+
+        Returns:
+            PackEntry: where the object is stored, or None if the pack does not contain it
+        '''
+        position: int = self._find_position(bytes.fromhex(sha1))
+        if position == -1:
+            return None
+        return self._entry_at(position)
+
+    def open_object(self, object_dir_name: str, sha1: str) -> PackObjectReader | InflatedObjectReader:
+        '''
+        Opens the compressed data of an object in the pack. Objects stored as deltas are reconstructed first and
+        handed out already decompressed.
+
+        Args:
+            object_dir_name (str): the kind of object expected ('blobs', 'trees' or 'commits')
+            sha1 (str): hex sha1 of the object
+
+        Returns:
+            PackObjectReader | InflatedObjectReader: a reader over the object's data, or None if the pack does not
+                contain it
+        '''
+        pack_entry: PackEntry = self.find(sha1)
+        if pack_entry is None or pack_entry.object_dir_name != object_dir_name:
+            return None
+        if pack_entry.is_delta:
+            return InflatedObjectReader(self.resolve_delta(sha1, pack_entry))
+        return PackObjectReader(self._get_pack_map(), pack_entry.offset, pack_entry.length)
+
+    def resolve_delta(self, sha1: str, pack_entry: PackEntry) -> bytes:
+        '''
+        Reconstructs an object stored as a delta. The chain of bases is followed until an object that is stored in
+        full (or is in the delta base cache) is found, then the deltas are applied from there back up to the
+        requested object. Every base on the chain is added to the cache.
+
+        Args:
+            sha1 (str): hex sha1 of the object
+            pack_entry (PackEntry): where the object is stored in the pack
+
+        Returns:
+            bytes: the decompressed contents of the object
+        '''
+        pending_deltas: list[tuple[str, bytes]] = []
+        curr_sha1: str = sha1
+        curr_entry: PackEntry = pack_entry
+        while True:
+            curr_data: bytes = _delta_base_cache.get(curr_sha1) if curr_sha1 != sha1 else None
+            if curr_data is not None:
+                break
+            if not curr_entry.is_delta:
+                curr_data = gitcompression.decompress(self.read_raw(curr_entry))
+                break
+            raw_data: bytes = self.read_raw(curr_entry)
+            pending_deltas.append((curr_sha1, raw_data[20:]))
+            curr_sha1 = raw_data[:20].hex()
+            curr_entry = self.find(curr_sha1)
+            if curr_entry is None:
+                raise ValueError(f'Delta base {curr_sha1} is missing from {self.pack_file_path}')
+
+        for delta_sha1, compressed_delta in reversed(pending_deltas):
+            # curr_sha1 is the base that the next delta applies to
+            _delta_base_cache.put(curr_sha1, curr_data)
+            curr_data = apply_delta(curr_data, gitcompression.decompress(compressed_delta))
+            curr_sha1 = delta_sha1
+        return curr_data
+
+    def iter_entries(self, start: int = 0, end: int = None) -> Iterable[tuple[str, PackEntry]]:
+        '''
+        Yields (hex sha1, PackEntry) for every object in the pack, or for those at positions start to end of the
+        index, in sha1 order.
+        '''
+        for position in range(start, self.object_count if end is None else end):
+            sha1_offset: int = self._sha1_table_offset + 20 * position
+            yield self._idx_map[sha1_offset:sha1_offset + 20].hex(), self._entry_at(position)
+
+    def read_raw(self, pack_entry: PackEntry) -> bytes:
+        '''
+        Returns the compressed data of an object exactly as it is stored in the pack.
+        '''
+        return self._get_pack_map()[pack_entry.offset:pack_entry.offset + pack_entry.length]
+
+    def close(self) -> None:
+        self._idx_map.close()
+        if self._pack_map is not None:
+            self._pack_map.close()
+
+    @classmethod
+    def load_packs(cls, kr_git_root_path: str, reload: bool = False) -> list[GitPack]:
+        '''
+        Returns the packs of a .kr_git repo. Packs are opened once per process and cached; pass reload=True to pick
+        up packs written since they were last loaded. A reload keeps the packs that are still there and never closes
+        any pack, since other threads may be reading it; a pack that was removed is unmapped once nothing
+        references it any more.
+
+        Args:
+            cls: the GitPack class
+            kr_git_root_path (str): path of the .kr_git repo
+            reload (bool): whether to rescan the packs directory
+
+        Returns:
+            list[GitPack]: the packs of the repo, newest first
+        '''
+        cache_key: str = str(kr_git_root_path)
+        if not reload and cache_key in _loaded_packs:
+            return _loaded_packs[cache_key]
+        # a pack's name is the checksum of its contents, so a pack with the same name is still the same pack
+        old_packs: dict[str, GitPack] = {old_pack.idx_file_path: old_pack
+                                         for old_pack in _loaded_packs.get(cache_key, [])}
+        packs_dir_path: str = os.path.join(kr_git_root_path, 'packs')
+        packs: list[GitPack] = []
+        if os.path.isdir(packs_dir_path):
+            idx_file_paths: list[str] = [
+                os.path.join(packs_dir_path, file_name) for file_name in os.listdir(packs_dir_path)
+                if file_name.startswith('pack-') and file_name.endswith('.idx')]
+            idx_file_paths.sort(key=os.path.getmtime, reverse=True)
+            packs = [old_packs.get(idx_file_path) or cls(idx_file_path) for idx_file_path in idx_file_paths]
+        _loaded_packs[cache_key] = packs
+        return packs
+
+    @classmethod
+    def open_packed_object(cls, kr_git_root_path: str, object_dir_name: str, sha1: str,
+                           reload: bool = False) -> PackObjectReader:
+        '''
+        Searches every pack of a repo for an object.
+
+        Returns:
+            PackObjectReader: a reader over the object's compressed data, or None if no pack contains it
+        '''
+        for pack in cls.load_packs(kr_git_root_path, reload):
+            object_reader: PackObjectReader = pack.open_object(object_dir_name, sha1)
+            if object_reader is not None:
+                return object_reader
+        return None
+
+    @classmethod
+    def write_pack(cls, kr_git_root_path: str,
+                   objects: Iterable[tuple[str, str, BinaryIO, str]]) -> tuple[str, int]:
+        '''
+        Writes a new pack (and its index) out of a stream of objects. The pack is written under a temporary name
+        and the index is renamed into place last, so readers never see a partial pack. The pack is named after the
+        checksum of its contents; if an identical pack already exists it is kept and the new one discarded, so an
+        index is never paired with a pack it was not written for.
+
+        Args:
+            cls: the GitPack class
+            kr_git_root_path (str): path of the .kr_git repo
+            objects (Iterable[tuple[str, str, BinaryIO, str]]): (object dir name, hex sha1, file of compressed data,
+                delta base sha1) for every object to pack. If the delta base sha1 is not None, the file holds the
+                compressed delta against that base, which must also be in the pack. Objects appearing more than
+                once are only packed once.
+
+        Returns:
+            tuple[str, int]: path of the new .pack file and the number of objects in it
+        '''
+        packs_dir_path: str = os.path.join(kr_git_root_path, 'packs')
+        os.makedirs(packs_dir_path, exist_ok=True)
+        records: dict[bytes, tuple[int, int, int]] = {}
+        pack_hasher = hashlib.sha1()
+        temp_fd, temp_pack_path = tempfile.mkstemp(prefix='tmp_', suffix='.pack', dir=packs_dir_path)
+        temp_idx_path: str = temp_pack_path[:-len('.pack')] + '.idx'
+        try:
+            with os.fdopen(temp_fd, 'wb') as pack_file:
+                # the object count is patched in once all objects are written
+                header: bytes = PACK_MAGIC + PACK_HEADER_STRUCT.pack(PACK_VERSION, 0)
+                pack_file.write(header)
+                offset: int = len(header)
+                for object_dir_name, sha1, compressed_file, delta_base_sha1 in objects:
+                    sha1_bytes: bytes = bytes.fromhex(sha1)
+                    if sha1_bytes in records:
+                        continue
+                    type_byte: int = PACK_OBJECT_TYPES[object_dir_name]
+                    length: int = 0
+                    if delta_base_sha1 is not None:
+                        type_byte |= PACK_DELTA_FLAG
+                        pack_file.write(bytes.fromhex(delta_base_sha1))
+                        length += 20
+                    while chunk := compressed_file.read(COPY_BUFFER_SIZE):
+                        pack_file.write(chunk)
+                        length += len(chunk)
+                    records[sha1_bytes] = (offset, length, type_byte)
+                    offset += length
+                pack_file.seek(len(PACK_MAGIC))
+                pack_file.write(PACK_HEADER_STRUCT.pack(PACK_VERSION, len(records)))
+            with open(temp_pack_path, 'r+b') as pack_file:
+                while chunk := pack_file.read(COPY_BUFFER_SIZE):
+                    pack_hasher.update(chunk)
+                pack_file.write(pack_hasher.digest())
+                pack_file.flush()
+                os.fsync(pack_file.fileno())
+
+            sorted_sha1s: list[bytes] = sorted(records)
+            fan_out: list[int] = [0] * 256
+            for sha1_bytes in sorted_sha1s:
+                fan_out[sha1_bytes[0]] += 1
+            for byte_value in range(1, 256):
+                fan_out[byte_value] += fan_out[byte_value - 1]
+            with open(temp_idx_path, 'wb') as idx_file:
+                idx_file.write(IDX_MAGIC + bytes([PACK_VERSION]))
+                idx_file.write(FAN_OUT_STRUCT.pack(*fan_out))
+                idx_file.write(b''.join(sorted_sha1s))
+                idx_file.write(b''.join(IDX_RECORD_STRUCT.pack(*records[sha1_bytes]) for sha1_bytes in sorted_sha1s))
+                idx_file.flush()
+                os.fsync(idx_file.fileno())
+
+            pack_name: str = f'pack-{pack_hasher.hexdigest()}'
+            pack_file_path: str = os.path.join(packs_dir_path, f'{pack_name}.pack')
+            idx_file_path: str = os.path.join(packs_dir_path, f'{pack_name}.idx')
+            if os.path.exists(idx_file_path):
+                for temp_path in (temp_pack_path, temp_idx_path):
+                    os.remove(temp_path)
+            else:
+                os.replace(temp_pack_path, pack_file_path)
+                os.replace(temp_idx_path, idx_file_path)
+        except BaseException:
+            for temp_path in (temp_pack_path, temp_idx_path):
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            raise
+        return pack_file_path, len(records)
@@ -0,0 +1,385 @@
+'''
+Contains the GitPrune class, which deletes (or quarantines) the objects of a .kr_git repo that nothing refers to.
+
+Objects are marked reachable starting from every ref, HEAD, the commits recorded by incremental restores and the
+blobs and trees recorded in the index. Commits are walked through the commit-graph, and trees level by level on a
+pool of processes, so a tree shared by many commits is only read once. Marks are kept as a set of binary sha1s.
+
+An unreachable object is only removed once it is older than the expiry period (the mtime of its loose file, or of
+its pack), which leaves objects that a commit or a watcher has just written but not yet pointed a ref at alone.
+Every object reachable from such a young object is kept along with it, so the store never holds an object without
+the objects it references. Loose objects are deleted (or moved to .kr_git/quarantine), and packs that hold expired
+objects are rewritten without them. If any commit was removed, the commit-graph is rebuilt from the remaining ones.
+'''
+from __future__ import annotations
+import io
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Iterable, Iterator
+from classes.gitblob import CHUNKED_HEADER_PREFIX, GitBlob
+from classes.gitcommitgraph import GitCommitGraph
+from classes.githistory import GitHistory
+from classes.gitindex import GitIndex
+from classes.gitobj import GitObject
+from classes.gitpack import GitPack, PackEntry
+from classes.gitref import GitRef
+from classes.gitrepository import ObjectStore, Repository
+from classes.gittree import GitTree
+from classes.gitwatch import is_watched
+from classes.utils import EntryType, find_commit_hash_from_head_file
+
+DEFAULT_EXPIRE_DAYS: float = 14
+QUARANTINE_DIR_NAME: str = 'quarantine'
+# the number of trees read by one task of the mark phase
+MARK_BATCH_SIZE: int = 1024
+
+
+@dataclass
+class UnreachableObject():
+    '''
+    An object that was not reachable from the refs when the store was swept.
+
+    Attributes:
+        object_dir_name (str): the kind of object ('blobs', 'trees' or 'commits')
+        sha1 (bytes): binary sha1 of the object
+        source (str | tuple[GitPack, PackEntry]): the loose file path, or the pack and the object's entry in it
+        mtime (float): modification time of the loose file or pack
+    '''
+    object_dir_name: str
+    sha1: bytes
+    source: str | tuple[GitPack, PackEntry]
+    mtime: float
+
+
+def read_tree_references(kr_git_root: str, tree_sha1s: bytes) -> tuple[bytes, bytes, bytes]:
+    '''
+    Reads a batch of trees. Run on the worker processes.
+
+    Args:
+        kr_git_root (str): path of the .kr_git repo
+        tree_sha1s (bytes): the binary sha1s of the trees, back to back
+
+    Returns:
+        tuple[bytes, bytes, bytes]: the binary sha1s of the subtrees, of the other blobs and of the manifests of
+            chunked files that the trees reference, each back to back
+    '''
+    object_store: ObjectStore = Repository.open(kr_git_root).object_store
+    referenced_sha1s: dict[EntryType, bytearray] = {EntryType.TREE: bytearray(), EntryType.BLOB: bytearray(),
+                                                    EntryType.CHUNKED: bytearray()}
+    for offset in range(0, len(tree_sha1s), 20):
+        curr_tree_object: GitTree = GitTree.init_from_tree_hash(tree_sha1s[offset:offset + 20].hex(), object_store)
+        for curr_tree_entry in curr_tree_object.iter_entries():
+            # symlinks are ordinary blobs as far as reachability goes
+            referenced_sha1s.get(curr_tree_entry.entry_type, referenced_sha1s[EntryType.BLOB]).extend(
+                bytes.fromhex(curr_tree_entry.entry_hash))
+    return (bytes(referenced_sha1s[EntryType.TREE]), bytes(referenced_sha1s[EntryType.BLOB]),
+            bytes(referenced_sha1s[EntryType.CHUNKED]))
+
+
+def read_manifest_chunks(kr_git_root: str, manifest_sha1s: bytes) -> bytes:
+    '''
+    Reads a batch of manifests of chunked files, returning the binary sha1s of their chunks back to back. Run on the
+    worker processes.
+    '''
+    object_store: ObjectStore = Repository.open(kr_git_root).object_store
+    chunk_sha1s = bytearray()
+    for offset in range(0, len(manifest_sha1s), 20):
+        for chunk_sha1, _ in GitBlob.read_manifest(manifest_sha1s[offset:offset + 20].hex(), object_store):
+            chunk_sha1s.extend(bytes.fromhex(chunk_sha1))
+    return bytes(chunk_sha1s)
+
+
+def _split_sha1s(sha1s: bytes) -> Iterator[bytes]:
+    for offset in range(0, len(sha1s), 20):
+        yield sha1s[offset:offset + 20]
+
+
+class GitPrune:
+    '''
+    Removes the unreachable objects of a .kr_git repo that are older than the expiry period.
+
+    Attributes:
+        repository (Repository): the repository to prune
+        expire_days (float): unreachable objects modified less than this many days ago are kept
+        quarantine (bool): move removed loose objects to .kr_git/quarantine instead of deleting them
+        jobs (int): number of worker processes that read trees
+        reachable_sha1s (set[bytes]): binary sha1s of every object marked as kept
+        kept_commit_sha1s (list[str]): hex sha1s of every commit marked as kept
+    '''
+
+    def __init__(self, expire_days: float = DEFAULT_EXPIRE_DAYS, quarantine: bool = False, jobs: int = None):
+        self.repository: Repository = Repository.current()
+        self.expire_days: float = expire_days
+        self.quarantine: bool = quarantine
+        self.jobs: int = jobs or os.cpu_count() or 1
+        self.reachable_sha1s: set[bytes] = set()
+        self.kept_commit_sha1s: list[str] = []
+        self._history: GitHistory = GitHistory(self.repository)
+
+    def _map(self, executor: Executor, function: Callable, batches: list[bytes]) -> Iterable:
+        kr_git_root: str = self.repository.kr_git_root
+        if executor is None or len(batches) == 1:
+            return (function(kr_git_root, batch) for batch in batches)
+        return executor.map(function, [kr_git_root] * len(batches), batches)
+
+    def _mark_chunks(self, executor: Executor, manifest_sha1s: list[bytes]) -> None:
+        batches: list[bytes] = [b''.join(manifest_sha1s[start:start + MARK_BATCH_SIZE])
+                                for start in range(0, len(manifest_sha1s), MARK_BATCH_SIZE)]
+        for chunk_sha1s in self._map(executor, read_manifest_chunks, batches):
+            self.reachable_sha1s.update(_split_sha1s(chunk_sha1s))
+
+    def _mark_trees(self, executor: Executor, tree_sha1s: Iterable[bytes]) -> None:
+        '''
+        Marks trees and everything below them, one level of trees at a time. Trees that are already marked are not
+        read again, since everything below them is marked too.
+        '''
+        frontier_sha1s: list[bytes] = [tree_sha1 for tree_sha1 in dict.fromkeys(tree_sha1s)
+                                       if tree_sha1 not in self.reachable_sha1s]
+        self.reachable_sha1s.update(frontier_sha1s)
+        while frontier_sha1s:
+            batches: list[bytes] = [b''.join(frontier_sha1s[start:start + MARK_BATCH_SIZE])
+                                    for start in range(0, len(frontier_sha1s), MARK_BATCH_SIZE)]
+            frontier_sha1s = []
+            manifest_sha1s: list[bytes] = []
+            for subtree_sha1s, blob_sha1s, chunked_sha1s in self._map(executor, read_tree_references, batches):
+                for subtree_sha1 in _split_sha1s(subtree_sha1s):
+                    if subtree_sha1 not in self.reachable_sha1s:
+                        self.reachable_sha1s.add(subtree_sha1)
+                        frontier_sha1s.append(subtree_sha1)
+                self.reachable_sha1s.update(_split_sha1s(blob_sha1s))
+                for manifest_sha1 in _split_sha1s(chunked_sha1s):
+                    if manifest_sha1 not in self.reachable_sha1s:
+                        self.reachable_sha1s.add(manifest_sha1)
+                        manifest_sha1s.append(manifest_sha1)
+            self._mark_chunks(executor, manifest_sha1s)
+
+    def _mark_commits(self, executor: Executor, commit_sha1s: Iterable[str]) -> None:
+        '''
+        Marks commits, their ancestors and everything below their root trees.
+        '''
+        root_tree_sha1s: list[bytes] = []
+        pending_sha1s: list[str] = list(commit_sha1s)
+        while pending_sha1s:
+            commit_sha1: str = pending_sha1s.pop()
+            if bytes.fromhex(commit_sha1) in self.reachable_sha1s:
+                continue
+            self.reachable_sha1s.add(bytes.fromhex(commit_sha1))
+            self.kept_commit_sha1s.append(commit_sha1)
+            # a missing commit raises here, before anything is removed
+            commit_entry = self._history.entry(commit_sha1)
+            root_tree_sha1s.append(bytes.fromhex(commit_entry.root_tree_sha1))
+            pending_sha1s.extend(commit_entry.parent_sha1s)
+        self._mark_trees(executor, root_tree_sha1s)
+
+    def _root_commit_sha1s(self) -> list[str]:
+        '''
+        Returns the commits that refs, HEAD and the records of incremental restores point at.
+        '''
+        kr_git_root: str = self.repository.kr_git_root
+        commit_sha1s: list[str] = []
+        for _, ref_file_path in GitRef.iter_ref_files(kr_git_root):
+            commit_sha1s.append(GitRef.init_from_ref_file(ref_file_path).target_commit_sha1)
+        head_file_path: str = os.path.join(kr_git_root, 'HEAD')
+        if os.path.isfile(head_file_path):
+            commit_sha1s.append(find_commit_hash_from_head_file(head_file_path))
+        restores_dir_path: str = os.path.join(kr_git_root, 'restores')
+        if os.path.isdir(restores_dir_path):
+            for record_file_name in os.listdir(restores_dir_path):
+                with open(os.path.join(restores_dir_path, record_file_name), 'r', encoding='utf8') as record_file:
+                    restored_commit_sha1: str = record_file.readline().strip()
+                # an incremental restore compares against the trees of the commit it last restored
+                if self.repository.object_store.has('commits', restored_commit_sha1):
+                    commit_sha1s.append(restored_commit_sha1)
+        return commit_sha1s
+
+    def _mark_index(self, executor: Executor) -> None:
+        '''
+        Marks the blobs and trees recorded in the index, which a commit reuses without checking that they exist.
+        '''
+        index: GitIndex = GitIndex.load(self.repository.kr_git_root, self.repository.repo_root)
+        manifest_sha1s: list[bytes] = []
+        for index_entry in index.blob_entries.values():
+            blob_sha1: bytes = bytes.fromhex(index_entry.sha1)
+            if index_entry.entry_type == EntryType.CHUNKED and blob_sha1 not in self.reachable_sha1s:
+                manifest_sha1s.append(blob_sha1)
+            self.reachable_sha1s.add(blob_sha1)
+        self._mark_chunks(executor, manifest_sha1s)
+        # a tree the index names that is already gone cannot be kept, and must not stop the prune
+        self._mark_trees(executor, (bytes.fromhex(tree_sha1) for tree_sha1, _ in index.tree_entries.values()
+                                    if self.repository.object_store.has('trees', tree_sha1)))
+
+    def _collect_unreachable(self, packs: list[GitPack]) -> list[UnreachableObject]:
+        object_store: ObjectStore = self.repository.object_store
+        unreachable_objects: list[UnreachableObject] = []
+        for object_dir_name, fan_out_name in object_store.iter_fan_out_dirs():
+            for dir_entry in object_store.iter_loose_objects(object_dir_name, fan_out_name):
+                sha1: bytes = bytes.fromhex(fan_out_name + dir_entry.name)
+                if sha1 not in self.reachable_sha1s:
+                    unreachable_objects.append(
+                        UnreachableObject(object_dir_name, sha1, dir_entry.path, dir_entry.stat().st_mtime))
+        for pack in packs:
+            pack_mtime: float = os.path.getmtime(pack.pack_file_path)
+            for sha1_hex, pack_entry in pack.iter_entries():
+                sha1: bytes = bytes.fromhex(sha1_hex)
+                if sha1 not in self.reachable_sha1s:
+                    unreachable_objects.append(
+                        UnreachableObject(pack_entry.object_dir_name, sha1, (pack, pack_entry), pack_mtime))
+        return unreachable_objects
+
+    def _is_manifest(self, blob_sha1: str) -> bool:
+        with self.repository.object_store.open('blobs', blob_sha1) as compressed_file:
+            first_piece: bytes = next(GitObject.inflate_stream(compressed_file), b'')
+        return first_piece.startswith(CHUNKED_HEADER_PREFIX)
+
+    def _mark_young(self, executor: Executor, young_objects: list[UnreachableObject]) -> None:
+        '''
+        Keeps unreachable objects that are younger than the expiry period, and everything they reference.
+        '''
+        self._mark_commits(executor, [young_object.sha1.hex() for young_object in young_objects
+                                      if young_object.object_dir_name == 'commits'])
+        self._mark_trees(executor, [young_object.sha1 for young_object in young_objects
+                                    if young_object.object_dir_name == 'trees'])
+        manifest_sha1s: list[bytes] = []
+        for young_object in young_objects:
+            if young_object.object_dir_name == 'blobs' and young_object.sha1 not in self.reachable_sha1s:
+                self.reachable_sha1s.add(young_object.sha1)
+                if self._is_manifest(young_object.sha1.hex()):
+                    manifest_sha1s.append(young_object.sha1)
+        self._mark_chunks(executor, manifest_sha1s)
+
+    def _open_full(self, pack: GitPack, sha1: str, pack_entry: PackEntry) -> BinaryIO:
+        if pack_entry.is_delta:
+            return io.BytesIO(self.repository.compression_policy.compress(pack.resolve_delta(sha1, pack_entry)))
+        return pack.open_object(pack_entry.object_dir_name, sha1)
+
+    def _quarantine_path(self, object_dir_name: str, sha1: str) -> str:
+        quarantine_path: str = os.path.join(self.repository.kr_git_root, QUARANTINE_DIR_NAME, object_dir_name,
+                                            sha1[:2], sha1[2:])
+        os.makedirs(os.path.dirname(quarantine_path), exist_ok=True)
+        return quarantine_path
+
+    def _remove_loose(self, expired_objects: list[UnreachableObject]) -> int:
+        removed_bytes: int = 0
+        for expired_object in expired_objects:
+            removed_bytes += os.path.getsize(expired_object.source)
+            if self.quarantine:
+                os.replace(expired_object.source,
+                           self._quarantine_path(expired_object.object_dir_name, expired_object.sha1.hex()))
+            else:
+                os.remove(expired_object.source)
+            fan_out_path: str = os.path.dirname(expired_object.source)
+            if not os.listdir(fan_out_path):
+                os.rmdir(fan_out_path)
+        return removed_bytes
+
+    def _iter_kept_pack_objects(self, pack: GitPack,
+                                expired_sha1s: set[bytes]) -> Iterator[tuple[str, str, BinaryIO, str]]:
+        for sha1, pack_entry in pack.iter_entries():
+            if bytes.fromhex(sha1) in expired_sha1s:
+                continue
+            if pack_entry.is_delta:
+                raw_data: bytes = pack.read_raw(pack_entry)
+                if raw_data[:20] not in expired_sha1s:
+                    yield pack_entry.object_dir_name, sha1, io.BytesIO(raw_data[20:]), raw_data[:20].hex()
+                    continue
+            # a delta whose base is removed is stored in full instead
+            with self._open_full(pack, sha1, pack_entry) as compressed_file:
+                yield pack_entry.object_dir_name, sha1, compressed_file, None
+
+    def _rewrite_packs(self, expired_objects: list[UnreachableObject]) -> int:
+        '''
+        Writes every pack that holds expired objects again without them, and removes the old packs once the new
+        ones are on disk.
+        '''
+        expired_by_pack: dict[str, tuple[GitPack, list[UnreachableObject]]] = {}
+        for expired_object in expired_objects:
+            pack, _ = expired_object.source
+            expired_by_pack.setdefault(pack.idx_file_path, (pack, []))[1].append(expired_object)
+        removed_bytes: int = 0
+        for pack, pack_expired_objects in expired_by_pack.values():
+            for expired_object in pack_expired_objects:
+                _, pack_entry = expired_object.source
+                removed_bytes += pack_entry.length
+                if self.quarantine:
+                    sha1: str = expired_object.sha1.hex()
+                    with self._open_full(pack, sha1, pack_entry) as compressed_file, \
+                            open(self._quarantine_path(expired_object.object_dir_name, sha1), 'wb') as out_file:
+                        out_file.write(compressed_file.read())
+            expired_sha1s: set[bytes] = {expired_object.sha1 for expired_object in pack_expired_objects}
+            if len(expired_sha1s) < pack.object_count:
+                GitPack.write_pack(self.repository.kr_git_root, self._iter_kept_pack_objects(pack, expired_sha1s))
+        for pack, _ in expired_by_pack.values():
+            pack.close()
+            os.remove(pack.idx_file_path)
+            os.remove(pack.pack_file_path)
+        GitPack.load_packs(self.repository.kr_git_root, reload=True)
+        return removed_bytes
+
+    def _remove_stale_temp_files(self, expire_before: float) -> int:
+        '''
+        Removes the temporary files of writes that were interrupted before the expiry period.
+        '''
+        removed_count: int = 0
+        for dir_name in ('blobs', 'trees', 'commits', 'packs'):
+            dir_path: str = os.path.join(self.repository.kr_git_root, dir_name)
+            if not os.path.isdir(dir_path):
+                continue
+            for file_name in os.listdir(dir_path):
+                file_path: str = os.path.join(dir_path, file_name)
+                if file_name.startswith('tmp_') and os.path.getmtime(file_path) < expire_before:
+                    os.remove(file_path)
+                    removed_count += 1
+        return removed_count
+
+    def prune(self) -> None:
+        '''
+        Marks every reachable object, then removes the unreachable ones older than the expiry period and reports
+        how many objects and bytes were removed.
+
+        Throws:
+            RuntimeError: if a watcher is running for the repository, since the trees it holds in memory may refer
+                to objects that no commit does yet
+        '''
+        kr_git_root: str = self.repository.kr_git_root
+        if is_watched(kr_git_root):
+            raise RuntimeError('krgit watch is running for this repository; stop it before pruning')
+        start_time: float = time.perf_counter()
+        expire_before: float = time.time() - self.expire_days * 24 * 60 * 60
+        packs: list[GitPack] = GitPack.load_packs(kr_git_root, reload=True)
+        executor: Executor = ProcessPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+        try:
+            self._mark_commits(executor, self._root_commit_sha1s())
+            self._mark_index(executor)
+            unreachable_objects: list[UnreachableObject] = self._collect_unreachable(packs)
+            young_objects: list[UnreachableObject] = [unreachable_object for unreachable_object in unreachable_objects
+                                                      if unreachable_object.mtime >= expire_before]
+            self._mark_young(executor, young_objects)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        expired_objects: list[UnreachableObject] = [unreachable_object for unreachable_object in unreachable_objects
+                                                    if unreachable_object.sha1 not in self.reachable_sha1s]
+
+        removed_bytes: int = self._remove_loose([expired_object for expired_object in expired_objects
+                                                 if isinstance(expired_object.source, str)])
+        removed_bytes += self._rewrite_packs([expired_object for expired_object in expired_objects
+                                              if not isinstance(expired_object.source, str)])
+        if any(expired_object.object_dir_name == 'commits' for expired_object in expired_objects):
+            # the graph must not list commits that are gone, so it is rebuilt from the ones that are kept, along with
+            # whatever the refs point at now, under the graph's lock so that a commit landing meanwhile is not lost
+            with GitCommitGraph.locked(kr_git_root):
+                GitCommitGraph.update(kr_git_root, self.kept_commit_sha1s + [
+                    commit_sha1 for commit_sha1 in self._root_commit_sha1s()
+                    if self.repository.object_store.has('commits', commit_sha1)], rebuild=True)
+        temp_file_count: int = self._remove_stale_temp_files(expire_before)
+
+        elapsed_seconds: float = time.perf_counter() - start_time
+        kept_young_count: int = len(unreachable_objects) - len(expired_objects)
+        print(f'Marked {len(self.reachable_sha1s) - kept_young_count} reachable objects; kept {kept_young_count} '
+              f'unreachable objects modified in the last {self.expire_days:g} days')
+        quarantine_note: str = (f' into {os.path.join(kr_git_root, QUARANTINE_DIR_NAME)}'
+                                if self.quarantine and expired_objects else '')
+        print(f'{"Quarantined" if self.quarantine else "Pruned"} {len(expired_objects)} objects ({removed_bytes} '
+              f'bytes){quarantine_note} and {temp_file_count} stale temporary files in {elapsed_seconds:.2f}s')
@@ -0,0 +1,161 @@
+'''
+Contains the GitPush class, which sends a ref and every object its commit needs to another repository.
+
+The objects to send are found by walking from the commit down, asking the receiver which objects it is missing one
+level at a time: commits are walked back through their parents until the receiver has them, and trees are walked
+breadth first, so every subtree whose sha1 the receiver already has is skipped without being read. A receiver never
+holds an object without the objects below it (see Transport), so nothing below an object it has needs to be asked
+about.
+'''
+from __future__ import annotations
+from dataclasses import dataclass
+from classes.gitblob import GitBlob
+from classes.gitcommit import GitCommit
+from classes.githistory import GitHistory
+from classes.gitrepository import Repository
+from classes.gittrace import tracer
+from classes.gittransport import TransferStats, Transport
+from classes.gittree import GitTree
+from classes.utils import EntryType
+
+
+@dataclass
+class PushResult():
+    '''
+    What a push of one ref did.
+
+    Attributes:
+        ref_name (str): the ref pushed
+        old_commit_sha1 (str): the commit the receiver's ref pointed at before the push, or None
+        new_commit_sha1 (str): the commit pushed
+        object_count (int): number of objects sent
+        skipped_tree_count (int): number of subtrees skipped because the receiver already had them
+        transfer_stats (TransferStats): how the objects were sent, or None if nothing had to be sent
+    '''
+    ref_name: str
+    old_commit_sha1: str
+    new_commit_sha1: str
+    object_count: int = 0
+    skipped_tree_count: int = 0
+    transfer_stats: TransferStats = None
+
+
+class GitPush:
+    '''
+    Pushes refs of a repository through a Transport.
+
+    Attributes:
+        source (Repository): the repository pushed from
+        transport (Transport): the receiving end
+    '''
+
+    def __init__(self, source: Repository, transport: Transport):
+        self.source: Repository = source
+        self.transport: Transport = transport
+
+    def _missing_commits(self, tip_commit_sha1: str) -> list[GitCommit]:
+        '''
+        Returns the commits reachable from tip_commit_sha1 that the receiver does not have.
+        '''
+        missing_commits: list[GitCommit] = []
+        seen_sha1s: set[str] = {tip_commit_sha1}
+        frontier_sha1s: list[str] = [tip_commit_sha1]
+        while frontier_sha1s:
+            next_frontier_sha1s: list[str] = []
+            for commit_sha1 in self.transport.missing_objects('commits', frontier_sha1s):
+                curr_commit_obj: GitCommit = GitCommit.init_from_commit_hash(commit_sha1, self.source.object_store)
+                missing_commits.append(curr_commit_obj)
+                for parent_sha1 in curr_commit_obj.parent_sha1s:
+                    if parent_sha1 not in seen_sha1s:
+                        seen_sha1s.add(parent_sha1)
+                        next_frontier_sha1s.append(parent_sha1)
+            frontier_sha1s = next_frontier_sha1s
+        return missing_commits
+
+    def _missing_objects(self, root_tree_sha1s: list[str],
+                         result: PushResult) -> tuple[list[str], list[tuple[str, str]]]:
+        '''
+        Walks the trees below root_tree_sha1s level by level, only descending into the trees the receiver is
+        missing.
+
+        Returns:
+            tuple[list[str], list[tuple[str, str]]]: the missing blobs that reference nothing, and (object dir
+                name, sha1) of the missing manifests and trees
+        '''
+        seen_sha1s: set[str] = set(root_tree_sha1s)
+        frontier_sha1s: list[str] = list(dict.fromkeys(root_tree_sha1s))
+        tree_sha1s: list[str] = []
+        blob_sha1s: list[str] = []
+        manifest_sha1s: list[str] = []
+        while frontier_sha1s:
+            missing_tree_sha1s: list[str] = self.transport.missing_objects('trees', frontier_sha1s)
+            result.skipped_tree_count += len(frontier_sha1s) - len(missing_tree_sha1s)
+            tree_sha1s.extend(missing_tree_sha1s)
+            frontier_sha1s = []
+            for tree_sha1 in missing_tree_sha1s:
+                for curr_tree_entry in GitTree.init_from_tree_hash(tree_sha1, self.source.object_store).iter_entries():
+                    if curr_tree_entry.entry_hash in seen_sha1s:
+                        continue
+                    seen_sha1s.add(curr_tree_entry.entry_hash)
+                    if curr_tree_entry.entry_type == EntryType.TREE:
+                        frontier_sha1s.append(curr_tree_entry.entry_hash)
+                    elif curr_tree_entry.entry_type == EntryType.CHUNKED:
+                        manifest_sha1s.append(curr_tree_entry.entry_hash)
+                    else:
+                        blob_sha1s.append(curr_tree_entry.entry_hash)
+
+        missing_blob_sha1s: list[str] = self.transport.missing_objects('blobs', blob_sha1s)
+        missing_manifest_sha1s: list[str] = self.transport.missing_objects('blobs', manifest_sha1s)
+        # only the chunks of manifests the receiver lacks are asked about; a chunk can be shared by many files
+        chunk_sha1s: list[str] = []
+        for manifest_sha1 in missing_manifest_sha1s:
+            for chunk_sha1, _ in GitBlob.read_manifest(manifest_sha1, self.source.object_store):
+                if chunk_sha1 not in seen_sha1s:
+                    seen_sha1s.add(chunk_sha1)
+                    chunk_sha1s.append(chunk_sha1)
+        missing_blob_sha1s.extend(self.transport.missing_objects('blobs', chunk_sha1s))
+
+        referencing_objects: list[tuple[str, str]] = [('blobs', manifest_sha1)
+                                                      for manifest_sha1 in missing_manifest_sha1s]
+        referencing_objects.extend(('trees', tree_sha1) for tree_sha1 in tree_sha1s)
+        return missing_blob_sha1s, referencing_objects
+
+    def push(self, ref_name: str, commit_sha1: str, force: bool = False) -> PushResult:
+        '''
+        Sends commit_sha1 and every object it needs that the receiver is missing, then moves the receiver's ref_name
+        to it.
+
+        Args:
+            ref_name (str): the ref to update in the receiver
+            commit_sha1 (str): the commit to push, which must be in the source repository
+            force (bool): move the ref even if the push would drop commits the ref points at
+
+        Returns:
+            PushResult: what was sent
+
+        Throws:
+            ValueError: if the receiver's ref points at a commit that commit_sha1 does not descend from, and not
+                force
+            RuntimeError: if the receiver's ref was moved by someone else during the push
+        '''
+        old_commit_sha1: str = self.transport.list_refs().get(ref_name)
+        result = PushResult(ref_name, old_commit_sha1, commit_sha1)
+        if old_commit_sha1 == commit_sha1:
+            return result
+        if old_commit_sha1 is not None and not force:
+            # the old commit can only be an ancestor if the source has it too
+            if (not self.source.object_store.has('commits', old_commit_sha1)
+                    or not GitHistory(self.source).is_ancestor(old_commit_sha1, commit_sha1)):
+                raise ValueError(f'{ref_name} points at {old_commit_sha1}, which {commit_sha1} does not descend '
+                                 'from; use --force to overwrite it')
+
+        with tracer.phase('negotiate'):
+            missing_commits: list[GitCommit] = self._missing_commits(commit_sha1)
+            blob_sha1s, referencing_objects = self._missing_objects(
+                [curr_commit_obj.root_tree_sha1 for curr_commit_obj in missing_commits], result)
+        referencing_objects.extend(('commits', curr_commit_obj.commit_sha1) for curr_commit_obj in missing_commits)
+        result.object_count = len(blob_sha1s) + len(referencing_objects)
+        if result.object_count:
+            result.transfer_stats = self.transport.send_objects(self.source, blob_sha1s, referencing_objects)
+        self.transport.update_ref(ref_name, old_commit_sha1, commit_sha1)
+        return result
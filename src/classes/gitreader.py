@@ -0,0 +1,154 @@
+'''
+A module that contains the classes used to read the files of a commit without restoring it.
+
+Nothing is read ahead of the caller: a walk over a commit loads each tree only when it reaches it, a path is found by
+reading just the trees on the way to it, and a blob is inflated as it is read. Pulling one file out of a huge snapshot
+therefore costs one tree per directory on its path plus the file's own blob.
+
+Classes contained:
+    1. BlobReader
+    2. GitReader
+'''
+from __future__ import annotations
+import io
+from typing import Iterator
+from classes.gitblob import GitBlob
+from classes.githistory import GitHistory
+from classes.gitrepository import Repository
+from classes.gittree import GitTree, GitTreeEntry
+from classes.utils import EntryType
+
+
+def split_tree_path(path: str) -> list[str]:
+    '''
+    Splits a path relative to the repository root into the names of its components.
+    '''
+    return [name for name in path.replace('\\', '/').split('/') if name not in ('', '.')]
+
+
+class BlobReader(io.RawIOBase):
+    '''
+    A read-only file over the contents of a blob, inflated piece by piece as it is read. The contents of a chunked
+    file are read one chunk after the other.
+    '''
+
+    def __init__(self, content_chunks: Iterator[bytes]):
+        self._content_chunks: Iterator[bytes] = content_chunks
+        self._pending: memoryview = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: bytearray) -> int:
+        while not self._pending:
+            content_chunk: bytes = next(self._content_chunks, None)
+            if content_chunk is None:
+                return 0
+            self._pending = memoryview(content_chunk)
+        read_size: int = min(len(buffer), len(self._pending))
+        buffer[:read_size] = self._pending[:read_size]
+        self._pending = self._pending[read_size:]
+        return read_size
+
+    def close(self) -> None:
+        # closing the generator closes the object file it is reading
+        self._content_chunks.close()
+        super().close()
+
+
+class GitReader:
+    '''
+    Reads the trees and blobs of the commits of a repository.
+
+    Attributes:
+        repository (Repository): the repository read from
+    '''
+
+    def __init__(self, repository: Repository = None):
+        self.repository: Repository = repository or Repository.current()
+        self._history: GitHistory = GitHistory(self.repository)
+
+    def find_entry(self, commit_sha1: str, path: str) -> GitTreeEntry:
+        '''
+        Looks a path up in a commit, reading only the trees on the way to it.
+
+        Args:
+            commit_sha1 (str): the commit to look in
+            path (str): path relative to the repository root; an empty path names the root directory
+
+        Returns:
+            GitTreeEntry: the entry the path names
+
+        Throws:
+            FileNotFoundError: if the path is not in the commit
+        '''
+        curr_entry = GitTreeEntry('', EntryType.TREE, self._history.entry(commit_sha1).root_tree_sha1)
+        for name in split_tree_path(path):
+            if curr_entry.entry_type != EntryType.TREE:
+                raise FileNotFoundError(f'{path} is not in commit {commit_sha1}')
+            curr_tree_object: GitTree = GitTree.init_from_tree_hash(curr_entry.entry_hash,
+                                                                    self.repository.object_store)
+            curr_entry = next((curr_tree_entry for curr_tree_entry in curr_tree_object.iter_entries()
+                               if curr_tree_entry.entry_name == name), None)
+            if curr_entry is None:
+                raise FileNotFoundError(f'{path} is not in commit {commit_sha1}')
+        return curr_entry
+
+    def entry_size(self, tree_entry: GitTreeEntry) -> int:
+        '''
+        Returns the size of a file's contents (the length of its target, for a symlink), or None for a directory.
+        Only the start of the blob is inflated; a chunked file's size is in its manifest's header.
+        '''
+        if tree_entry.entry_type == EntryType.TREE:
+            return None
+        return GitBlob.read_header_from_blob_hash(tree_entry.entry_hash, self.repository.object_store)[1]
+
+    def _iter_tree(self, tree_sha1: str, dir_path: str, recursive: bool,
+                   sizes: bool) -> Iterator[tuple[str, EntryType, str, int]]:
+        curr_tree_object: GitTree = GitTree.init_from_tree_hash(tree_sha1, self.repository.object_store)
+        for curr_tree_entry in curr_tree_object.iter_entries():
+            entry_path: str = f'{dir_path}/{curr_tree_entry.entry_name}' if dir_path else curr_tree_entry.entry_name
+            yield (entry_path, curr_tree_entry.entry_type, curr_tree_entry.entry_hash,
+                   self.entry_size(curr_tree_entry) if sizes else None)
+            if recursive and curr_tree_entry.entry_type == EntryType.TREE:
+                yield from self._iter_tree(curr_tree_entry.entry_hash, entry_path, recursive, sizes)
+
+    def iter_commit(self, commit_sha1: str, prefix: str = None, recursive: bool = True,
+                    sizes: bool = True) -> Iterator[tuple[str, EntryType, str, int]]:
+        '''
+        Yields the entries of a commit in path order, each directory followed by what is in it. A tree is only
+        loaded when the walk reaches it, so stopping early leaves the rest of the commit unread.
+
+        Args:
+            commit_sha1 (str): the commit to walk
+            prefix (str): only walk the directory at this path, or yield just the file at this path
+            recursive (bool): whether to walk into subdirectories, or only list the entries of the top directory
+            sizes (bool): whether to read the size of every file, which inflates the start of its blob
+
+        Returns:
+            Iterator[tuple[str, EntryType, str, int]]: the path relative to the repository root, entry type, sha1
+                and size (None for directories, or when sizes is False) of every entry
+
+        Throws:
+            FileNotFoundError: if prefix is not in the commit
+        '''
+        prefix_entry: GitTreeEntry = self.find_entry(commit_sha1, prefix or '')
+        prefix_path: str = '/'.join(split_tree_path(prefix or ''))
+        if prefix_entry.entry_type != EntryType.TREE:
+            yield (prefix_path, prefix_entry.entry_type, prefix_entry.entry_hash,
+                   self.entry_size(prefix_entry) if sizes else None)
+            return
+        yield from self._iter_tree(prefix_entry.entry_hash, prefix_path, recursive, sizes)
+
+    def open_blob(self, blob_sha1: str) -> io.BufferedReader:
+        '''
+        Opens the contents of a blob (or of a chunked file, given its manifest) for reading. The contents are
+        inflated as they are read, so blobs of any size can be read in bounded memory.
+
+        Throws:
+            FileNotFoundError: if the blob is not in the repo
+        '''
+        if not self.repository.object_store.has('blobs', blob_sha1):
+            raise FileNotFoundError(f'There is no blob {blob_sha1}')
+        return io.BufferedReader(
+            BlobReader(GitBlob.iter_contents_from_blob_hash(blob_sha1, self.repository.object_store)))
@@ -1,8 +1,14 @@
 from __future__ import annotations
 import os
-from pathlib import Path
+from typing import Iterator
+from classes.gitcommitgraph import GitCommitGraph
 from classes.gitobj import GitObject
-from classes.utils import find_kr_git_root
+from classes.gitrepository import Repository, TEMP_FILE_SUFFIX
+from classes.gittrace import tracer
+from classes.utils import find_commit_hash_from_head_file
+
+# lock files are never listed as refs
+REF_LOCK_SUFFIX: str = '.lock'
 
 class GitRef(GitObject):
 
@@ -22,11 +28,77 @@ class GitRef(GitObject):
             return
         uncompressed_content: bytes = self.serialize()
         compressed_content: bytes = self.compress(uncompressed_content)
-        target_dir = os.path.join(find_kr_git_root(Path.cwd()), 'refs')
-        os.makedirs(target_dir, exist_ok=True)
-        target_file_path = os.path.join(target_dir, self.ref_name)
-        with open(target_file_path, 'wb') as out_file:
-            out_file.write(compressed_content)
+        Repository.current().object_store.write_repo_file(os.path.join('refs', self.ref_name), compressed_content)
+
+    @classmethod
+    def iter_ref_files(cls, kr_git_root: str) -> Iterator[tuple[str, str]]:
+        '''
+        Yields the name and file path of every ref of a repository, skipping the lock and temporary files of ref
+        updates that are in progress (or were interrupted).
+        '''
+        refs_dir_path: str = os.path.join(kr_git_root, 'refs')
+        for dir_path, _, file_names in os.walk(refs_dir_path):
+            for file_name in file_names:
+                if file_name.endswith((REF_LOCK_SUFFIX, TEMP_FILE_SUFFIX)):
+                    continue
+                ref_file_path: str = os.path.join(dir_path, file_name)
+                yield os.path.relpath(ref_file_path, refs_dir_path).replace(os.sep, '/'), ref_file_path
+
+    @classmethod
+    def update(cls, repository: Repository, ref_name: str, old_commit_sha1: str, new_commit_sha1: str) -> None:
+        '''
+        Atomically moves a ref to a commit whose objects are already on disk, unless the ref no longer points at
+        old_commit_sha1, and adds the commit to the commit-graph. HEAD is moved along with the ref if it names the
+        ref or does not exist yet. Commits, pushes and clones all move refs through here, so two of them can never
+        interleave.
+
+        Args:
+            repository (Repository): the repository whose ref to move
+            ref_name (str): the ref to move
+            old_commit_sha1 (str): the commit the ref is expected to point at, or None if it should not exist
+            new_commit_sha1 (str): the commit to point the ref at
+
+        Throws:
+            RuntimeError: if the ref was moved or is locked by someone else
+        '''
+        kr_git_root: str = repository.kr_git_root
+        ref_file_path: str = os.path.join(kr_git_root, 'refs', ref_name)
+        lock_file_path: str = ref_file_path + REF_LOCK_SUFFIX
+        os.makedirs(os.path.dirname(ref_file_path), exist_ok=True)
+        try:
+            lock_fd: int = os.open(lock_file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            raise RuntimeError(f'{ref_name} is locked by another update (delete {lock_file_path} if it is stale)')
+        try:
+            # checked under the lock, so nobody can move the ref between the check and the update
+            current_commit_sha1: str = (cls.init_from_ref_file(ref_file_path).target_commit_sha1
+                                        if os.path.isfile(ref_file_path) else None)
+            if current_commit_sha1 != old_commit_sha1:
+                raise RuntimeError(f'{ref_name} was moved to {current_commit_sha1} by another update; try again')
+            ref_obj: GitRef = cls.init_using_commit_sha1(new_commit_sha1, ref_name)
+            with os.fdopen(lock_fd, 'wb') as lock_file:
+                lock_fd = None
+                lock_file.write(repository.compression_policy.compress(ref_obj.serialize()))
+                lock_file.flush()
+                with tracer.phase('fsync'):
+                    os.fsync(lock_file.fileno())
+            # the graph stays locked until the ref has moved, so a rebuild of the graph sees either neither or both
+            with GitCommitGraph.locked(kr_git_root):
+                GitCommitGraph.update(kr_git_root, [new_commit_sha1])
+                os.replace(lock_file_path, ref_file_path)
+        except BaseException:
+            if lock_fd is not None:
+                os.close(lock_fd)
+            os.remove(lock_file_path)
+            raise
+
+        head_file_path: str = os.path.join(kr_git_root, 'HEAD')
+        if os.path.isfile(head_file_path):
+            with open(head_file_path, 'r') as head_file:
+                head_ref_name: str = head_file.read().split('@')[0]
+            if head_ref_name != ref_name or find_commit_hash_from_head_file(head_file_path) == new_commit_sha1:
+                return
+        repository.object_store.write_repo_file('HEAD', f'{ref_name}@{new_commit_sha1}'.encode('utf8'))
 
     @classmethod
     def init_using_commit_sha1(cls, input_commit_sha1: str, ref_name: str) -> GitRef:
@@ -47,6 +119,5 @@ class GitRef(GitObject):
 
     @classmethod
     def init_from_ref_name(cls, ref_name: str) -> GitRef:
-        kr_git_root_path: str = find_kr_git_root(Path.cwd())
-        target_path = os.path.join(kr_git_root_path, 'refs', ref_name)
+        target_path = os.path.join(Repository.current().kr_git_root, 'refs', ref_name)
         return cls.init_from_ref_file(target_path)
@@ -0,0 +1,417 @@
+'''
+A module that contains the classes that every object class reads and writes the .kr_git repo through.
+
+Classes contained:
+    1. ObjectStore
+    2. Repository
+'''
+from __future__ import annotations
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator
+from classes.gitchunk import ChunkingPolicy
+from classes.gitcompression import CompressionPolicy
+from classes.gitpack import GitPack
+from classes.gittrace import tracer
+from classes.utils import find_kr_git_root
+
+# the suffix of the temporary files that files other than objects are written to before being renamed into place
+TEMP_FILE_SUFFIX: str = '.tmp'
+
+_repositories_by_cwd: dict[str, Repository] = {}
+_repositories_by_root: dict[str, Repository] = {}
+
+
+def write_file_atomically(target_file_path: str, data: bytes, sync: bool = True) -> None:
+    '''
+    Replaces a file by writing a uniquely named temporary file next to it and renaming it into place, so that
+    readers only ever see a whole file and concurrent writers never write into each other's temporary file.
+
+    Args:
+        target_file_path (str): the file to replace
+        data (bytes): the new contents of the file
+        sync (bool): whether to fsync the contents before the rename
+    '''
+    temp_fd, temp_file_path = tempfile.mkstemp(prefix=f'{os.path.basename(target_file_path)}.',
+                                               suffix=TEMP_FILE_SUFFIX, dir=os.path.dirname(target_file_path))
+    try:
+        with os.fdopen(temp_fd, 'wb') as out_file:
+            out_file.write(data)
+            if sync:
+                out_file.flush()
+                with tracer.phase('fsync'):
+                    os.fsync(out_file.fileno())
+        os.replace(temp_file_path, target_file_path)
+    except BaseException:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+
+
+class ObjectStore:
+    '''
+    Reads and writes the objects of a .kr_git repo, loose or packed.
+
+    Writes go to a temporary file that is renamed into place, so a crash can never leave a truncated object
+    behind, and are skipped entirely when the object is already stored, in which case its mtime is bumped instead
+    (see freshen). Outside of a batch every write is fsynced before it is renamed. Inside a batch, objects stay
+    under their temporary names (where has() and open() still find them) until the batch ends, when each one is
+    synced, then renamed into place, and then the directories holding them are synced.
+
+    Attributes:
+        kr_git_root (str): path of the .kr_git repo
+    '''
+
+    def __init__(self, kr_git_root: str):
+        self.kr_git_root: str = str(kr_git_root)
+        self._known_dir_paths: set[str] = set()
+        self._unsynced_paths: list[str] = []
+        self._pending_objects: dict[tuple[str, str], str] = {}
+        self._batch_depth: int = 0
+        self._lock = threading.Lock()
+
+    def object_path(self, object_dir_name: str, sha1: str) -> str:
+        '''
+        Returns the path that an object is (or would be) stored at as a loose file.
+        '''
+        return os.path.join(self.kr_git_root, object_dir_name, sha1[:2], sha1[2:])
+
+    def _ensure_dir(self, dir_path: str) -> None:
+        # directories are only created once per process instead of once per write
+        if dir_path not in self._known_dir_paths:
+            tracer.count('makedirs_calls')
+            os.makedirs(dir_path, exist_ok=True)
+            self._known_dir_paths.add(dir_path)
+
+    def has(self, object_dir_name: str, sha1: str) -> bool:
+        '''
+        Checks whether an object is already stored, either loose or in a pack, or written by the current batch.
+        '''
+        if (object_dir_name, sha1) in self._pending_objects:
+            return True
+        if os.path.exists(self.object_path(object_dir_name, sha1)):
+            return True
+        return any(pack.find(sha1) is not None for pack in GitPack.load_packs(self.kr_git_root))
+
+    def freshen(self, object_dir_name: str, sha1: str) -> bool:
+        '''
+        Checks whether an object is already stored and, if so, bumps the mtime of its loose file or pack, the way
+        git freshens objects. Writing an object that prune has found unreachable then keeps it young, so prune
+        leaves it alone while the commit that now refers to it is being made.
+
+        Returns:
+            bool: whether the object is already stored
+        '''
+        if (object_dir_name, sha1) in self._pending_objects:
+            return True
+        try:
+            os.utime(self.object_path(object_dir_name, sha1))
+            return True
+        except FileNotFoundError:
+            pass
+        for pack in GitPack.load_packs(self.kr_git_root):
+            if pack.find(sha1) is not None:
+                try:
+                    os.utime(pack.pack_file_path)
+                    return True
+                except FileNotFoundError:
+                    # the pack was removed by a gc or prune since it was loaded
+                    continue
+        return False
+
+    def open(self, object_dir_name: str, sha1: str) -> BinaryIO:
+        '''
+        Opens the compressed data of an object, wherever it is stored. Objects written by the current batch are
+        found first, then packs are searched (an in-memory binary search), then the loose object file. If neither
+        has the object, packs written since they were last loaded are picked up and searched once more.
+
+        Args:
+            object_dir_name (str): the kind of object ('blobs', 'trees' or 'commits')
+            sha1 (str): hex sha1 of the object
+
+        Returns:
+            BinaryIO: a readable file of the object's compressed data
+
+        Throws:
+            FileNotFoundError: if the object is not in the repo
+        '''
+        pending_file_path: str = self._pending_objects.get((object_dir_name, sha1))
+        if pending_file_path is not None:
+            return open(pending_file_path, 'rb')
+        packed_object: BinaryIO = GitPack.open_packed_object(self.kr_git_root, object_dir_name, sha1)
+        if packed_object is not None:
+            return packed_object
+        try:
+            return open(self.object_path(object_dir_name, sha1), 'rb')
+        except FileNotFoundError:
+            packed_object = GitPack.open_packed_object(self.kr_git_root, object_dir_name, sha1, reload=True)
+            if packed_object is None:
+                raise
+            return packed_object
+
+    def iter_fan_out_dirs(self) -> Iterator[tuple[str, str]]:
+        '''
+        Yields (object dir name, fan-out dir name) for every directory that loose objects are stored in.
+        '''
+        for object_dir_name in ('blobs', 'trees', 'commits'):
+            object_dir_path: str = os.path.join(self.kr_git_root, object_dir_name)
+            if not os.path.isdir(object_dir_path):
+                continue
+            for fan_out_name in sorted(os.listdir(object_dir_path)):
+                if len(fan_out_name) == 2 and os.path.isdir(os.path.join(object_dir_path, fan_out_name)):
+                    yield object_dir_name, fan_out_name
+
+    def iter_loose_objects(self, object_dir_name: str, fan_out_name: str) -> Iterator[os.DirEntry]:
+        '''
+        Yields the directory entry of every loose object in a fan-out directory; the object's sha1 is the fan-out
+        dir name followed by the entry's name.
+        '''
+        with os.scandir(os.path.join(self.kr_git_root, object_dir_name, fan_out_name)) as dir_entries:
+            yield from dir_entries
+
+    def create_temp_file(self, object_dir_name: str) -> tuple[int, str]:
+        '''
+        Creates a temporary file to stream an object into before its sha1 is known. Finish it with
+        install_temp_file.
+
+        Returns:
+            tuple[int, str]: the open file descriptor and the path of the temporary file
+        '''
+        object_dir_path: str = os.path.join(self.kr_git_root, object_dir_name)
+        self._ensure_dir(object_dir_path)
+        return tempfile.mkstemp(prefix='tmp_', dir=object_dir_path)
+
+    def _fsync_path(self, file_path: str) -> None:
+        file_fd: int = os.open(file_path, os.O_RDONLY)
+        try:
+            with tracer.phase('fsync'):
+                os.fsync(file_fd)
+        finally:
+            os.close(file_fd)
+
+    def _sync_or_defer(self, file_path: str) -> None:
+        '''
+        Syncs a new link and its directory, or, inside a batch, remembers it so that both are synced when the batch
+        ends.
+        '''
+        if self._batch_depth:
+            with self._lock:
+                self._unsynced_paths.append(file_path)
+            return
+        self._fsync_path(file_path)
+        self._fsync_dirs({os.path.dirname(file_path)})
+
+    def install_temp_file(self, object_dir_name: str, sha1: str, temp_file_path: str) -> bool:
+        '''
+        Moves a finished temporary file into place as an object, or discards it if the object is already stored.
+        Inside a batch, the file keeps its temporary name until the batch ends.
+
+        Returns:
+            bool: whether the object was written
+        '''
+        if self.freshen(object_dir_name, sha1):
+            tracer.count('objects_skipped')
+            os.remove(temp_file_path)
+            return False
+        if self._batch_depth:
+            with self._lock:
+                is_new: bool = (object_dir_name, sha1) not in self._pending_objects
+                if is_new:
+                    self._pending_objects[(object_dir_name, sha1)] = temp_file_path
+            if not is_new:
+                # another thread of the batch wrote the same object first
+                tracer.count('objects_skipped')
+                os.remove(temp_file_path)
+                return False
+            tracer.count('objects_written')
+            return True
+        target_file_path: str = self.object_path(object_dir_name, sha1)
+        self._ensure_dir(os.path.dirname(target_file_path))
+        self._fsync_path(temp_file_path)
+        os.replace(temp_file_path, target_file_path)
+        tracer.count('objects_written')
+        return True
+
+    def write(self, object_dir_name: str, sha1: str, compressed_data: bytes) -> bool:
+        '''
+        Writes an object, unless it is already stored.
+
+        Args:
+            object_dir_name (str): the kind of object ('blobs', 'trees' or 'commits')
+            sha1 (str): hex sha1 of the object
+            compressed_data (bytes): the compressed contents of the object
+
+        Returns:
+            bool: whether the object was written
+        '''
+        if self.freshen(object_dir_name, sha1):
+            tracer.count('objects_skipped')
+            return False
+        temp_fd, temp_file_path = self.create_temp_file(object_dir_name)
+        try:
+            with os.fdopen(temp_fd, 'wb') as out_file, tracer.phase('write'):
+                out_file.write(compressed_data)
+        except BaseException:
+            os.remove(temp_file_path)
+            raise
+        return self.install_temp_file(object_dir_name, sha1, temp_file_path)
+
+    def link(self, object_dir_name: str, sha1: str, source_file_path: str) -> bool:
+        '''
+        Stores an object by hard linking the loose object file of another repo, unless it is already stored. Objects
+        are never modified in place, so the two repos can share the file.
+
+        Returns:
+            bool: whether the object was linked
+
+        Throws:
+            OSError: if the file cannot be linked, e.g. because it is on another filesystem
+        '''
+        if self.freshen(object_dir_name, sha1):
+            tracer.count('objects_skipped')
+            return False
+        target_file_path: str = self.object_path(object_dir_name, sha1)
+        self._ensure_dir(os.path.dirname(target_file_path))
+        try:
+            # a link appears complete or not at all, so no temporary file is needed
+            os.link(source_file_path, target_file_path)
+        except FileExistsError:
+            tracer.count('objects_skipped')
+            return False
+        self._sync_or_defer(target_file_path)
+        tracer.count('objects_linked')
+        return True
+
+    def write_repo_file(self, relative_path: str, data: bytes) -> None:
+        '''
+        Atomically replaces a file in the .kr_git repo that is not an object, such as a ref or HEAD. The contents
+        are synced before the rename, even inside a batch.
+
+        Args:
+            relative_path (str): path of the file relative to the .kr_git repo
+            data (bytes): the new contents of the file
+        '''
+        target_file_path: str = os.path.join(self.kr_git_root, relative_path)
+        self._ensure_dir(os.path.dirname(target_file_path))
+        write_file_atomically(target_file_path, data)
+
+    @contextmanager
+    def batch(self) -> Iterator[ObjectStore]:
+        '''
+        Defers the fsync of every write made inside the block until the block exits, after which the objects
+        written are renamed into place and their directories synced. Batches may be nested; the sync happens when
+        the outermost one exits.
+        '''
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._sync_deferred()
+
+    def _fsync_dirs(self, dir_paths: set[str]) -> None:
+        # directories cannot be opened for fsync on Windows, where a rename is durable once it returns
+        if os.name == 'nt':
+            return
+        for dir_path in sorted(dir_paths):
+            self._fsync_path(dir_path)
+
+    def _sync_deferred(self) -> None:
+        with self._lock:
+            unsynced_paths: list[str] = self._unsynced_paths
+            pending_objects: dict[tuple[str, str], str] = self._pending_objects
+            self._unsynced_paths = []
+            self._pending_objects = {}
+        if not unsynced_paths and not pending_objects:
+            return
+        # the contents of every object are on disk before any of them appears under its real name
+        for file_path in unsynced_paths + list(pending_objects.values()):
+            self._fsync_path(file_path)
+        fan_out_dir_paths: set[str] = {os.path.dirname(file_path) for file_path in unsynced_paths}
+        for (object_dir_name, sha1), temp_file_path in pending_objects.items():
+            target_file_path: str = self.object_path(object_dir_name, sha1)
+            self._ensure_dir(os.path.dirname(target_file_path))
+            os.replace(temp_file_path, target_file_path)
+            fan_out_dir_paths.add(os.path.dirname(target_file_path))
+        # and the new names (and any new fan-out dirs) are on disk before a ref can be pointed at the objects
+        self._fsync_dirs(fan_out_dir_paths | {os.path.dirname(dir_path) for dir_path in fan_out_dir_paths})
+
+
+class Repository:
+    '''
+    A handle on a kr-git repository. The .kr_git root is resolved once and shared by every object read or
+    written through the handle.
+
+    Attributes:
+        kr_git_root (str): path of the .kr_git repo
+        repo_root (str): path of the directory that contains the .kr_git repo
+        object_store (ObjectStore): the store of the repo's objects
+        compression_policy (CompressionPolicy): chooses the codec of every object written, read from
+            .kr_git/compression.json the first time it is needed
+        chunking_policy (ChunkingPolicy): decides which files are split into content-defined chunks, read from
+            .kr_git/chunking.json the first time it is needed
+    '''
+
+    def __init__(self, kr_git_root: str):
+        self.kr_git_root: str = str(kr_git_root)
+        self.repo_root: str = os.path.dirname(self.kr_git_root)
+        self.object_store: ObjectStore = ObjectStore(self.kr_git_root)
+        kr_git_stat: os.stat_result = os.stat(self.kr_git_root)
+        self._identity: tuple[int, int] = (kr_git_stat.st_dev, kr_git_stat.st_ino)
+        self._compression_policy: CompressionPolicy = None
+        self._chunking_policy: ChunkingPolicy = None
+
+    @property
+    def compression_policy(self) -> CompressionPolicy:
+        if self._compression_policy is None:
+            self._compression_policy = CompressionPolicy.load(self.kr_git_root)
+        return self._compression_policy
+
+    @property
+    def chunking_policy(self) -> ChunkingPolicy:
+        if self._chunking_policy is None:
+            self._chunking_policy = ChunkingPolicy.load(self.kr_git_root)
+        return self._chunking_policy
+
+    def is_stale(self) -> bool:
+        '''
+        Checks whether the .kr_git repo this handle was opened on has since been removed or replaced, in which
+        case what the handle remembers about the store no longer holds.
+        '''
+        try:
+            kr_git_stat: os.stat_result = os.stat(self.kr_git_root)
+        except FileNotFoundError:
+            return True
+        return (kr_git_stat.st_dev, kr_git_stat.st_ino) != self._identity
+
+    @classmethod
+    def open(cls, start_path: str) -> Repository:
+        '''
+        Returns the handle of the repository that contains start_path.
+
+        Throws:
+            FileNotFoundError: if start_path is not inside a kr-git repository
+        '''
+        kr_git_root: str = str(find_kr_git_root(Path(start_path).resolve()))
+        repository: Repository = _repositories_by_root.get(kr_git_root)
+        if repository is None or repository.is_stale():
+            repository = cls(kr_git_root)
+            _repositories_by_root[kr_git_root] = repository
+        return repository
+
+    @classmethod
+    def current(cls) -> Repository:
+        '''
+        Returns the handle of the repository that contains the current working directory. The filesystem is only
+        searched the first time each working directory is seen.
+        '''
+        cwd: str = os.getcwd()
+        repository: Repository = _repositories_by_cwd.get(cwd)
+        if repository is None or repository.is_stale():
+            repository = cls.open(cwd)
+            _repositories_by_cwd[cwd] = repository
+        return repository
@@ -1,44 +1,338 @@
+import errno
+import hashlib
 import os
-from pathlib import Path
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from classes.gittree import GitTree, GitTreeEntry
 from classes.gitcommit import GitCommit
 from classes.gitblob import GitBlob
-from classes.utils import EntryType, find_kr_git_root, find_commit_hash_from_head_file
+from classes.gitobj import STREAM_CHUNK_SIZE
+from classes.gitreader import GitReader, split_tree_path
+from classes.gitrepository import ObjectStore, Repository
+from classes.gittrace import tracer
+from classes.utils import EntryType, find_commit_hash_from_head_file
 
 class GitRestore:
+    '''
+    Restores the commit in HEAD into a target directory.
 
-    def __init__(self, restore_target_dir_path: str):
+    The directory skeleton is created first by walking the commit's trees, then the blobs are inflated and written
+    concurrently on a pool of worker threads.
+
+    An incremental restore only writes what differs from what the target already holds. If the target was last
+    restored by kr-git, the commit's trees are compared against that snapshot's trees (recorded in
+    .kr_git/restores), skipping every subtree whose sha1 is unchanged. Otherwise they are compared against the files
+    on disk, rehashing files whose size matches.
+
+    A restore of a subpath only reads the trees on the way to it, and restores the directory or file it names (under
+    its own name) into the target.
+
+    Attributes:
+        target_dir_path (str): directory to restore into
+        repository (Repository): the repository restored from
+        object_store (ObjectStore): the object store of the repository, read once rather than for every object
+        kr_git_root (str): path of the .kr_git repo
+        jobs (int): number of worker threads that write files
+        incremental (bool): whether to only write files that differ from the target's current contents
+        delete_removed (bool): in an incremental restore, whether to delete files that are not in the commit
+        subpath (str): path of the directory or file of the commit to restore, or None to restore all of it
+        pending_files (list[tuple[str, str]]): (blob sha1, file path) of every file still to be written
+        pending_symlinks (list[tuple[str, str]]): (blob sha1, link path) of every symlink still to be created
+        skipped_file_count (int): number of files left alone because they were unchanged
+        skipped_tree_count (int): number of directories left alone because their tree was unchanged
+        deleted_count (int): number of files and directories deleted
+    '''
+
+    def __init__(self, restore_target_dir_path: str, jobs: int = None, incremental: bool = False,
+                 delete_removed: bool = False, subpath: str = None):
         self.target_dir_path: str = restore_target_dir_path
-        self.kr_git_root: str = find_kr_git_root(Path.cwd())
+        self.repository: Repository = Repository.current()
+        self.object_store: ObjectStore = self.repository.object_store
+        self.kr_git_root: str = self.repository.kr_git_root
+        self.jobs: int = jobs or os.cpu_count() or 1
+        self.incremental: bool = incremental
+        self.delete_removed: bool = delete_removed
+        self.subpath: str = '/'.join(split_tree_path(subpath or '')) or None
+        self.pending_files: list[tuple[str, str]] = []
+        self.pending_symlinks: list[tuple[str, str]] = []
+        self.skipped_file_count: int = 0
+        self.skipped_tree_count: int = 0
+        self.deleted_count: int = 0
 
-    def _restore_file(self, blob_sha1: str, current_path: str) -> None:
-        curr_blob_object: GitBlob = GitBlob.init_gitblob_from_blob_hash(blob_sha1)
-        curr_file_name: str = os.path.basename(curr_blob_object.file_path)
-        curr_file_path = os.path.join(current_path, curr_file_name)
+    def _restore_file(self, blob_sha1: str, curr_file_path: str) -> int:
         # print(f'RESTORING AT {curr_file_path}')
+        # blobs are streamed to disk as raw bytes so that memory use stays bounded for files of any size
+        bytes_written: int = 0
+        with os.fdopen(self._open_for_writing(curr_file_path), 'wb') as out_file:
+            for content_chunk in GitBlob.iter_contents_from_blob_hash(blob_sha1, self.object_store):
+                with tracer.phase('write'):
+                    out_file.write(content_chunk)
+                bytes_written += len(content_chunk)
+        tracer.count('files_restored')
+        tracer.count('bytes_written', bytes_written)
+        return bytes_written
+
+
+    def _open_for_writing(self, file_path: str) -> int:
+        # a symlink left where a file now goes is replaced rather than written through
+        open_flags: int = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
         try:
-            with open(curr_file_path, 'w', encoding='utf-8') as out_file:
-                out_file.write(curr_blob_object.binary_data.decode())
-        except UnicodeDecodeError:
-            with open(curr_file_path, 'wb') as out_file:
-                out_file.write(curr_blob_object.binary_data)
+            return os.open(file_path, open_flags | getattr(os, 'O_NOFOLLOW', 0), 0o666)
+        except OSError as open_error:
+            if open_error.errno != errno.ELOOP:
+                raise
+        os.remove(file_path)
+        return os.open(file_path, open_flags, 0o666)
 
+    def _restore_symlink(self, blob_sha1: str, link_path: str) -> None:
+        link_target: bytes = b''.join(GitBlob.iter_contents_from_blob_hash(blob_sha1, self.object_store))
+        if os.path.isdir(link_path) and not os.path.islink(link_path):
+            shutil.rmtree(link_path)
+        elif os.path.lexists(link_path):
+            os.remove(link_path)
+        os.symlink(os.fsdecode(link_target), link_path)
+        tracer.count('symlinks_restored')
+
+    def _symlink_matches_blob(self, link_path: str, blob_sha1: str) -> bool:
+        if not os.path.islink(link_path):
+            return False
+        return os.fsencode(os.readlink(link_path)) == b''.join(
+            GitBlob.iter_contents_from_blob_hash(blob_sha1, self.object_store))
 
     def _restore_tree(self, tree_hash: str, current_path: str) -> None:
-        curr_tree_object: GitTree = GitTree.init_from_tree_hash(tree_hash)
+        curr_tree_object: GitTree = GitTree.init_from_tree_hash(tree_hash, self.object_store)
         # print(f'CURR TREE DIRNAME: {curr_tree_object.directory_name}')
         curr_dir_path: str = os.path.join(current_path, curr_tree_object.directory_name)
         # print(f'RESTORING TREE AT {curr_dir_path}')
+        tracer.count('makedirs_calls')
         os.makedirs(curr_dir_path, exist_ok=True)
-        for entry_name in curr_tree_object.internal_tree:
-            curr_tree_entry: GitTreeEntry = curr_tree_object.internal_tree[entry_name]
-            if curr_tree_entry.entry_type == EntryType.BLOB:
-                self._restore_file(curr_tree_entry.entry_hash, curr_dir_path)
+        for curr_tree_entry in curr_tree_object.iter_entries():
+            entry_name: str = curr_tree_entry.entry_name
+            if curr_tree_entry.entry_type in (EntryType.BLOB, EntryType.CHUNKED):
+                self.pending_files.append((curr_tree_entry.entry_hash, os.path.join(curr_dir_path, entry_name)))
             elif curr_tree_entry.entry_type == EntryType.TREE:
                 self._restore_tree(curr_tree_entry.entry_hash, curr_dir_path)
+            elif curr_tree_entry.entry_type == EntryType.SYMLINK:
+                self.pending_symlinks.append((curr_tree_entry.entry_hash, os.path.join(curr_dir_path, entry_name)))
+
+    def _remove_path(self, path: str) -> None:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        self.deleted_count += 1
+
+    def _file_matches_blob(self, file_path: str, blob_sha1: str, entry_type: EntryType = EntryType.BLOB) -> bool:
+        '''
+        Checks whether a file on disk already holds the contents of a blob, by comparing sizes and then hashing
+        the file the way a v2 blob is hashed. A chunked file is hashed piece by piece, the way each of its chunks
+        was.
+        '''
+        tracer.count('stat_calls')
+        try:
+            file_size: int = os.stat(file_path).st_size
+        except FileNotFoundError:
+            return False
+        if entry_type == EntryType.CHUNKED:
+            expected_chunks: list[tuple[str, int]] = GitBlob.read_manifest(blob_sha1, self.object_store)
+        else:
+            expected_chunks: list[tuple[str, int]] = [
+                (blob_sha1, GitBlob.read_header_from_blob_hash(blob_sha1, self.object_store)[1])]
+        if not os.path.isfile(file_path) or file_size != sum(chunk_size for _, chunk_size in expected_chunks):
+            return False
+        with open(file_path, 'rb') as in_file:
+            for chunk_sha1, chunk_size in expected_chunks:
+                hasher = hashlib.sha1(f'blob {chunk_size}\0'.encode())
+                remaining_size: int = chunk_size
+                while remaining_size and (chunk := in_file.read(min(remaining_size, STREAM_CHUNK_SIZE))):
+                    remaining_size -= len(chunk)
+                    tracer.count('bytes_read', len(chunk))
+                    tracer.count('bytes_hashed', len(chunk))
+                    with tracer.phase('hash'):
+                        hasher.update(chunk)
+                if hasher.hexdigest() != chunk_sha1:
+                    return False
+        return True
+
+    def _update_tree(self, tree_hash: str, previous_tree_hash: str, current_path: str, dir_name: str) -> None:
+        '''
+        Brings a directory up to date with a tree, only queueing the files that differ.
+
+        Args:
+            tree_hash (str): sha1 of the tree to restore
+            previous_tree_hash (str): sha1 of the tree that was last restored at this location, or None to compare
+                against the files on disk instead
+            current_path (str): the directory that the tree's directory lives in
+            dir_name (str): the name of the tree's directory
+        '''
+        # an unchanged tree is only skipped if its directory is still there
+        if tree_hash == previous_tree_hash and os.path.isdir(os.path.join(current_path, dir_name)):
+            self.skipped_tree_count += 1
+            return
+        curr_tree_object: GitTree = GitTree.init_from_tree_hash(tree_hash, self.object_store)
+        curr_dir_path: str = os.path.join(current_path, curr_tree_object.directory_name)
+        if os.path.islink(curr_dir_path) or not os.path.isdir(curr_dir_path):
+            if os.path.lexists(curr_dir_path):
+                self._remove_path(curr_dir_path)
+            self._restore_tree(tree_hash, current_path)
+            return
+
+        previous_entries: dict[str, GitTreeEntry] = None
+        if previous_tree_hash is not None:
+            previous_entries = GitTree.init_from_tree_hash(previous_tree_hash, self.object_store).internal_tree
+        for entry_name, curr_tree_entry in curr_tree_object.internal_tree.items():
+            entry_path: str = os.path.join(curr_dir_path, entry_name)
+            previous_entry: GitTreeEntry = previous_entries.get(entry_name) if previous_entries is not None else None
+            if previous_entry is not None and previous_entry.entry_type != curr_tree_entry.entry_type:
+                previous_entry = None
+            if curr_tree_entry.entry_type == EntryType.TREE:
+                if os.path.islink(entry_path) or (os.path.lexists(entry_path) and not os.path.isdir(entry_path)):
+                    self._remove_path(entry_path)
+                self._update_tree(curr_tree_entry.entry_hash,
+                                  previous_entry.entry_hash if previous_entry is not None else None, curr_dir_path,
+                                  entry_name)
+            elif curr_tree_entry.entry_type in (EntryType.BLOB, EntryType.CHUNKED):
+                if os.path.islink(entry_path) or os.path.isdir(entry_path):
+                    self._remove_path(entry_path)
+                if previous_entries is not None:
+                    unchanged: bool = (previous_entry is not None
+                                       and previous_entry.entry_hash == curr_tree_entry.entry_hash
+                                       and os.path.isfile(entry_path))
+                else:
+                    unchanged: bool = self._file_matches_blob(entry_path, curr_tree_entry.entry_hash,
+                                                              curr_tree_entry.entry_type)
+                if unchanged:
+                    self.skipped_file_count += 1
+                else:
+                    self.pending_files.append((curr_tree_entry.entry_hash, entry_path))
+            elif curr_tree_entry.entry_type == EntryType.SYMLINK:
+                if previous_entries is not None:
+                    unchanged: bool = (previous_entry is not None
+                                       and previous_entry.entry_hash == curr_tree_entry.entry_hash
+                                       and os.path.islink(entry_path))
+                else:
+                    unchanged: bool = self._symlink_matches_blob(entry_path, curr_tree_entry.entry_hash)
+                if unchanged:
+                    self.skipped_file_count += 1
+                else:
+                    self.pending_symlinks.append((curr_tree_entry.entry_hash, entry_path))
+
+        if self.delete_removed:
+            # compared against a snapshot, only what the snapshot restored is removed; otherwise the directory is
+            # made to mirror the tree exactly
+            removable_names = previous_entries.keys() if previous_entries is not None else os.listdir(curr_dir_path)
+            for entry_name in list(removable_names):
+                entry_path: str = os.path.join(curr_dir_path, entry_name)
+                if entry_name not in curr_tree_object.internal_tree and os.path.lexists(entry_path):
+                    self._remove_path(entry_path)
+
+    def _restore_record_path(self) -> str:
+        # a subpath restored into a directory is recorded apart from the whole commit restored into it
+        target_name: str = os.path.abspath(self.target_dir_path) + (f'\0{self.subpath}' if self.subpath else '')
+        target_key: str = hashlib.sha1(target_name.encode()).hexdigest()
+        return os.path.join(self.kr_git_root, 'restores', target_key)
+
+    def _target_identity(self, root_dir_path: str) -> str:
+        '''
+        Returns the device and inode numbers of the target and of the restored root directory, which change when
+        either is removed and created again, or None if either is missing.
+        '''
+        dir_identities: list[str] = []
+        for dir_path in (self.target_dir_path, root_dir_path):
+            try:
+                dir_stat: os.stat_result = os.stat(dir_path)
+            except FileNotFoundError:
+                return None
+            dir_identities.append(f'{dir_stat.st_dev}:{dir_stat.st_ino}')
+        return ' '.join(dir_identities)
+
+    def _read_restore_record(self, root_dir_path: str) -> str:
+        '''
+        Returns the root tree sha1 of the snapshot last restored into the target, or None if there is no record or
+        the target is no longer the directory the record was written for.
+        '''
+        try:
+            with open(self._restore_record_path(), 'r', encoding='utf8') as record_file:
+                _, root_tree_sha1, _, recorded_identity, _ = record_file.read().split('\n', 4)
+        except (FileNotFoundError, ValueError):
+            return None
+        current_identity: str = self._target_identity(root_dir_path)
+        if current_identity is None or current_identity != recorded_identity:
+            return None
+        return root_tree_sha1
+
+    def _write_restore_record(self, commit_sha1: str, root_tree_sha1: str, root_dir_path: str) -> None:
+        record_file_path: str = self._restore_record_path()
+        self.object_store.write_repo_file(
+            os.path.relpath(record_file_path, self.kr_git_root),
+            f'{commit_sha1}\n{root_tree_sha1}\n{os.path.abspath(self.target_dir_path)}\n'
+            f'{self._target_identity(root_dir_path)}\n'.encode())
+
+    def _write_pending_files(self) -> int:
+        '''
+        Writes every pending file, on the worker pool if there is more than one job.
+
+        Returns:
+            int: the total number of bytes written
+        '''
+        if self.jobs > 1 and len(self.pending_files) > 1:
+            # zlib releases the GIL and file writes block outside of it, so threads keep every core busy
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                return sum(executor.map(lambda pending_file: self._restore_file(*pending_file), self.pending_files))
+        return sum(self._restore_file(blob_sha1, file_path) for blob_sha1, file_path in self.pending_files)
+
+    def _restore_single_entry(self, tree_entry: GitTreeEntry) -> None:
+        '''
+        Queues a subpath that names a file or symlink, unless an incremental restore finds it unchanged.
+        '''
+        os.makedirs(self.target_dir_path, exist_ok=True)
+        entry_path: str = os.path.join(self.target_dir_path, tree_entry.entry_name)
+        if tree_entry.entry_type == EntryType.SYMLINK:
+            if self.incremental and self._symlink_matches_blob(entry_path, tree_entry.entry_hash):
+                self.skipped_file_count += 1
+            else:
+                self.pending_symlinks.append((tree_entry.entry_hash, entry_path))
+            return
+        if os.path.islink(entry_path) or os.path.isdir(entry_path):
+            self._remove_path(entry_path)
+        if self.incremental and self._file_matches_blob(entry_path, tree_entry.entry_hash, tree_entry.entry_type):
+            self.skipped_file_count += 1
+        else:
+            self.pending_files.append((tree_entry.entry_hash, entry_path))
 
     def restore(self) -> None:
+        start_time: float = time.perf_counter()
         target_commit_hash: str = find_commit_hash_from_head_file(os.path.join(self.kr_git_root, 'HEAD'))
-        curr_commit_obj: GitCommit = GitCommit.init_from_commit_hash(target_commit_hash)
-        self._restore_tree(curr_commit_obj.root_tree_sha1, self.target_dir_path)
-
+        if self.subpath is not None:
+            restored_entry: GitTreeEntry = GitReader(self.repository).find_entry(target_commit_hash, self.subpath)
+        else:
+            curr_commit_obj: GitCommit = GitCommit.init_from_commit_hash(target_commit_hash, self.object_store)
+            restored_entry: GitTreeEntry = GitTreeEntry('', EntryType.TREE, curr_commit_obj.root_tree_sha1)
+        root_dir_path: str = None
+        if restored_entry.entry_type == EntryType.TREE:
+            root_dir_name: str = GitTree.init_from_tree_hash(restored_entry.entry_hash,
+                                                             self.object_store).directory_name
+            root_dir_path = os.path.join(self.target_dir_path, root_dir_name)
+        with tracer.phase('restore_trees'):
+            if restored_entry.entry_type != EntryType.TREE:
+                self._restore_single_entry(restored_entry)
+            elif self.incremental:
+                self._update_tree(restored_entry.entry_hash, self._read_restore_record(root_dir_path),
+                                  self.target_dir_path, root_dir_name)
+            else:
+                self._restore_tree(restored_entry.entry_hash, self.target_dir_path)
+        with tracer.phase('restore_files'):
+            for blob_sha1, link_path in self.pending_symlinks:
+                self._restore_symlink(blob_sha1, link_path)
+            bytes_written: int = self._write_pending_files()
+        if restored_entry.entry_type == EntryType.TREE:
+            self._write_restore_record(target_commit_hash, restored_entry.entry_hash, root_dir_path)
+        elapsed_seconds: float = time.perf_counter() - start_time
+        throughput: float = bytes_written / elapsed_seconds / (1024 * 1024) if elapsed_seconds > 0 else 0.0
+        symlinks_note: str = f' and {len(self.pending_symlinks)} symlinks' if self.pending_symlinks else ''
+        print(f'Restored {len(self.pending_files)} files{symlinks_note} ({bytes_written} bytes) in '
+              f'{elapsed_seconds:.2f}s ({throughput:.1f} MiB/s)')
+        if self.incremental:
+            print(f'Skipped {self.skipped_file_count} unchanged files and {self.skipped_tree_count} unchanged '
+                  f'directories, deleted {self.deleted_count} files and directories')
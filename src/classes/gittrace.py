@@ -0,0 +1,150 @@
+'''
+Contains the Tracer class, which records how long each phase of a command takes and counts the I/O it does, so
+that a slow commit or restore can be broken down into walking, reading, hashing, compressing and writing.
+
+Tracing is off unless KRGIT_TRACE=1 is set or --trace is passed, and while it is off every call into the tracer
+returns straight away. When it is on, a JSON summary of the cumulative time per phase and of every counter is
+written to stderr once the command finishes. Setting KRGIT_TRACE_EVENTS (or passing --trace-events) to a file path
+also writes every phase as a Chrome trace event, which can be opened in chrome://tracing or Perfetto.
+
+Phases nest (a commit's 'scan' phase contains the 'read', 'hash', 'compress' and 'write' phases of the blobs it
+writes inline), and phases on worker threads are added up, so the time of a phase can exceed the wall time.
+
+Classes contained:
+    1. Tracer
+'''
+from __future__ import annotations
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+TRACE_ENV_VAR: str = 'KRGIT_TRACE'
+TRACE_EVENTS_ENV_VAR: str = 'KRGIT_TRACE_EVENTS'
+
+_NO_OP_PHASE = contextlib.nullcontext()
+
+
+class _Phase:
+    '''
+    Times one run of a phase on the current thread.
+    '''
+
+    def __init__(self, phase_tracer: Tracer, phase_name: str):
+        self.phase_tracer: Tracer = phase_tracer
+        self.phase_name: str = phase_name
+        self.start_ns: int = None
+
+    def __enter__(self) -> _Phase:
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.phase_tracer.record_phase(self.phase_name, self.start_ns, time.perf_counter_ns() - self.start_ns)
+
+
+class Tracer:
+    '''
+    Accumulates phase times and counters for the running command. Safe to use from several threads.
+
+    Attributes:
+        enabled (bool): whether anything is being recorded
+        events_file_path (str): where to write Chrome trace events, or None to not record them
+        phase_ns (dict[str, int]): cumulative nanoseconds spent in each phase
+        phase_calls (dict[str, int]): number of times each phase ran
+        counters (dict[str, int]): the value of each counter
+    '''
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.events_file_path: str = None
+        self.phase_ns: dict[str, int] = defaultdict(int)
+        self.phase_calls: dict[str, int] = defaultdict(int)
+        self.counters: dict[str, int] = defaultdict(int)
+        self._events: list[dict] = []
+        self._start_ns: int = None
+        self._lock = threading.Lock()
+
+    def enable(self, events_file_path: str = None) -> None:
+        '''
+        Starts recording, optionally keeping every phase as a trace event to write to events_file_path.
+        '''
+        self.enabled = True
+        self.events_file_path = events_file_path or self.events_file_path
+        if self._start_ns is None:
+            self._start_ns = time.perf_counter_ns()
+
+    def enable_from_environment(self) -> None:
+        '''
+        Starts recording if KRGIT_TRACE is set to something other than 0, or KRGIT_TRACE_EVENTS is set.
+        '''
+        events_file_path: str = os.environ.get(TRACE_EVENTS_ENV_VAR)
+        if os.environ.get(TRACE_ENV_VAR, '0') not in ('', '0') or events_file_path:
+            self.enable(events_file_path)
+
+    def phase(self, phase_name: str) -> contextlib.AbstractContextManager:
+        '''
+        Returns a context manager that times the block it wraps as a run of phase_name.
+        '''
+        if not self.enabled:
+            return _NO_OP_PHASE
+        return _Phase(self, phase_name)
+
+    def record_phase(self, phase_name: str, start_ns: int, duration_ns: int) -> None:
+        with self._lock:
+            self.phase_ns[phase_name] += duration_ns
+            self.phase_calls[phase_name] += 1
+            if self.events_file_path is not None:
+                self._events.append({'name': phase_name, 'cat': 'krgit', 'ph': 'X',
+                                     'ts': (start_ns - self._start_ns) / 1000, 'dur': duration_ns / 1000,
+                                     'pid': os.getpid(), 'tid': threading.get_ident()})
+
+    def count(self, counter_name: str, amount: int = 1) -> None:
+        '''
+        Adds amount to a counter.
+        '''
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[counter_name] += amount
+
+    def summary(self, command_name: str = None) -> dict:
+        '''
+        Returns the cumulative time and number of runs of every phase and the value of every counter.
+        '''
+        with self._lock:
+            return {
+                'command': command_name,
+                'wall_seconds': (time.perf_counter_ns() - self._start_ns) / 1e9 if self._start_ns else 0.0,
+                'phases': {phase_name: {'seconds': self.phase_ns[phase_name] / 1e9,
+                                        'calls': self.phase_calls[phase_name]}
+                           for phase_name in sorted(self.phase_ns)},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def report(self, command_name: str = None) -> None:
+        '''
+        Writes the JSON summary to stderr and, if requested, the trace events to their file. Does nothing if
+        tracing is off.
+        '''
+        if not self.enabled:
+            return
+        summary: dict = self.summary(command_name)
+        print(json.dumps(summary, indent=2), file=sys.stderr)
+        if self.events_file_path is None:
+            return
+        with self._lock:
+            trace_events: list[dict] = list(self._events)
+        end_ts: float = summary['wall_seconds'] * 1_000_000
+        for counter_name, counter_value in summary['counters'].items():
+            trace_events.append({'name': counter_name, 'cat': 'krgit', 'ph': 'C', 'ts': end_ts, 'pid': os.getpid(),
+                                 'args': {counter_name: counter_value}})
+        with open(self.events_file_path, 'w', encoding='utf8') as events_file:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, events_file)
+
+
+# the tracer shared by every module
+tracer: Tracer = Tracer()
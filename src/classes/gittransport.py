@@ -0,0 +1,166 @@
+'''
+A module that contains the transports that push and clone send objects and ref updates through.
+
+GitPush only talks to the receiving repository through the Transport interface: it asks which objects are missing,
+sends them, and asks for a ref to be moved. LocalTransport implements it for a repository on a local path; a
+transport over a socket would implement the same methods as requests and a pack stream.
+
+Classes contained:
+    1. TransferStats
+    2. Transport
+    3. LocalTransport
+'''
+from __future__ import annotations
+import io
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator
+from classes.gitpack import GitPack, InflatedObjectReader
+from classes.gitref import GitRef
+from classes.gitrepository import Repository
+from classes.gittrace import tracer
+
+
+@dataclass
+class TransferStats():
+    '''
+    What a transport did to send a set of objects.
+
+    Attributes:
+        linked_count (int): objects hard linked from the sending repository
+        packed_count (int): objects written into a pack
+        packed_bytes (int): size of the pack written, if any
+    '''
+    linked_count: int = 0
+    packed_count: int = 0
+    packed_bytes: int = 0
+
+
+class Transport(ABC):
+    '''
+    The receiving end of a push. The receiving repository must never hold an object without every object it
+    references, since a push skips everything below an object the receiver already has.
+    '''
+
+    @abstractmethod
+    def list_refs(self) -> dict[str, str]:
+        '''
+        Returns the name and commit sha1 of every ref of the receiving repository.
+        '''
+
+    @abstractmethod
+    def missing_objects(self, object_dir_name: str, sha1s: list[str]) -> list[str]:
+        '''
+        Returns the sha1s, out of sha1s, of the objects that the receiving repository does not have.
+
+        Args:
+            object_dir_name (str): the kind of the objects ('blobs', 'trees' or 'commits')
+            sha1s (list[str]): hex sha1s of the objects to ask about, all at once
+        '''
+
+    @abstractmethod
+    def send_objects(self, source: Repository, blob_sha1s: list[str],
+                     referencing_objects: list[tuple[str, str]]) -> TransferStats:
+        '''
+        Copies objects from source to the receiving repository.
+
+        Args:
+            source (Repository): the repository the objects are read from
+            blob_sha1s (list[str]): blobs that reference no other object (file contents, symlink targets and the
+                chunks of chunked files)
+            referencing_objects (list[tuple[str, str]]): (object dir name, sha1) of the manifests, trees and
+                commits, which may only be stored once the objects they reference are
+
+        Returns:
+            TransferStats: how the objects were sent
+        '''
+
+    @abstractmethod
+    def update_ref(self, ref_name: str, old_commit_sha1: str, new_commit_sha1: str) -> None:
+        '''
+        Atomically moves a ref of the receiving repository to a commit whose objects it already has, unless the ref
+        no longer points at old_commit_sha1. HEAD is moved along with the ref if it names the ref or does not exist
+        yet.
+
+        Args:
+            ref_name (str): the ref to move
+            old_commit_sha1 (str): the commit the ref is expected to point at, or None if it should not exist
+            new_commit_sha1 (str): the commit to point the ref at
+
+        Throws:
+            RuntimeError: if the ref was moved or is locked by someone else
+        '''
+
+
+class LocalTransport(Transport):
+    '''
+    A transport to a repository on a local path. Loose blobs are hard linked when both repositories are on the same
+    filesystem; every other object is copied into a single new pack, which appears in the receiving repository all
+    at once after the linked blobs, so no object is ever stored before the objects it references.
+
+    Attributes:
+        repository (Repository): the receiving repository
+    '''
+
+    def __init__(self, repo_path: str):
+        repo_path = os.path.abspath(repo_path)
+        if os.path.basename(repo_path) != '.kr_git':
+            repo_path = os.path.join(repo_path, '.kr_git')
+        if not os.path.isdir(repo_path):
+            # not searched for upwards, so a typo can never push into an enclosing repository
+            raise FileNotFoundError(f'{os.path.dirname(repo_path)} is not a kr-git repository')
+        self.repository: Repository = Repository.open(repo_path)
+
+    def list_refs(self) -> dict[str, str]:
+        return {ref_name: GitRef.init_from_ref_file(ref_file_path).target_commit_sha1
+                for ref_name, ref_file_path in GitRef.iter_ref_files(self.repository.kr_git_root)}
+
+    def missing_objects(self, object_dir_name: str, sha1s: list[str]) -> list[str]:
+        # objects the push will point a ref at are freshened, so a concurrent prune leaves them alone
+        return [sha1 for sha1 in sha1s if not self.repository.object_store.freshen(object_dir_name, sha1)]
+
+    def _open_full(self, source: Repository, object_dir_name: str, sha1: str) -> BinaryIO:
+        '''
+        Opens the compressed data of an object of source as it would be stored in full.
+        '''
+        compressed_file: BinaryIO = source.object_store.open(object_dir_name, sha1)
+        if isinstance(compressed_file, InflatedObjectReader):
+            # a delta is only meaningful next to its base, so it is sent in full
+            return io.BytesIO(source.compression_policy.compress(compressed_file.data))
+        return compressed_file
+
+    def _iter_pack_objects(self, source: Repository,
+                           packed_objects: list[tuple[str, str]]) -> Iterator[tuple[str, str, BinaryIO, str]]:
+        for object_dir_name, sha1 in packed_objects:
+            with self._open_full(source, object_dir_name, sha1) as compressed_file:
+                yield object_dir_name, sha1, compressed_file, None
+
+    def send_objects(self, source: Repository, blob_sha1s: list[str],
+                     referencing_objects: list[tuple[str, str]]) -> TransferStats:
+        stats = TransferStats()
+        packed_objects: list[tuple[str, str]] = []
+        can_link: bool = (os.stat(source.kr_git_root).st_dev == os.stat(self.repository.kr_git_root).st_dev)
+        # the links are synced when the batch ends, before the pack that references them appears
+        with self.repository.object_store.batch(), tracer.phase('link'):
+            for blob_sha1 in blob_sha1s:
+                loose_file_path: str = source.object_store.object_path('blobs', blob_sha1)
+                if can_link and os.path.isfile(loose_file_path):
+                    try:
+                        stats.linked_count += self.repository.object_store.link('blobs', blob_sha1, loose_file_path)
+                        continue
+                    except OSError:
+                        # e.g. a filesystem without hard links; everything else is packed instead
+                        can_link = False
+                packed_objects.append(('blobs', blob_sha1))
+        packed_objects.extend(referencing_objects)
+        if packed_objects:
+            with tracer.phase('pack'):
+                pack_file_path, stats.packed_count = GitPack.write_pack(
+                    self.repository.kr_git_root, self._iter_pack_objects(source, packed_objects))
+            stats.packed_bytes = os.path.getsize(pack_file_path)
+            GitPack.load_packs(self.repository.kr_git_root, reload=True)
+        return stats
+
+    def update_ref(self, ref_name: str, old_commit_sha1: str, new_commit_sha1: str) -> None:
+        GitRef.update(self.repository, ref_name, old_commit_sha1, new_commit_sha1)
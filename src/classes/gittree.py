@@ -1,6 +1,11 @@
 '''
 A module that contains classes that relate to the Git Tree object.
 
+Trees are written in a binary format: the header `TREE2 {directory name}\0`, then for every entry (sorted by name)
+a type byte (the value of its EntryType), the entry's name, a NUL byte and the raw 20-byte sha1 of the entry. Unlike
+the older text format (`TREE {directory name}\0` followed by `name TYPE hexsha\n` lines, which can still be read),
+names may contain spaces and newlines, and sha1s take half the space.
+
 Classes contained:
     1. GitTreeEntry
     2. GitTree
@@ -8,13 +13,22 @@ Classes contained:
 
 from __future__ import annotations
 import os
-import zlib
-from pathlib import Path
+from concurrent.futures import Executor, Future
+from typing import Iterator
 from dataclasses import dataclass
 from sortedcontainers import SortedDict
 from classes.gitobj import GitObject
-from classes.utils import EntryType, find_kr_git_root
+from classes.utils import EntryType
 from classes.gitblob import GitBlob
+from classes.gitchunk import ChunkingPolicy
+from classes.gitignore import IgnoreRules
+from classes.gitindex import GitIndex
+from classes.gitrepository import ObjectStore, Repository
+from classes.gittrace import tracer
+from classes.gitwalk import scan_directory
+
+BINARY_TREE_HEADER_PREFIX: bytes = b'TREE2 '
+_ENTRY_TYPES_BY_BYTE: dict[int, EntryType] = {entry_type.value: entry_type for entry_type in EntryType}
 
 
 @dataclass
@@ -24,8 +38,9 @@ class GitTreeEntry():
 
     Attributes:
         entry_name (str): The name of the entry (file/folder)
-        entry_type (EntryType): indicates whether the entry is a BLOB (file) or TREE (folder)
-        entry_hash (bytes): The hash of the blob (if file) or tree (if folder)
+        entry_type (EntryType): indicates whether the entry is a BLOB (file), TREE (folder), SYMLINK or CHUNKED
+            (large file stored as chunks)
+        entry_hash (bytes): The hash of the blob (if file or symlink), manifest (if chunked) or tree (if folder)
     '''
     entry_name: str
     entry_type: EntryType
@@ -44,23 +59,81 @@ class GitTree(GitObject):
 
     def __init__(self):
         self.directory_name: str = None
-        self.internal_tree: SortedDict[str, GitTreeEntry] = SortedDict()
         self.sha1 = None
+        self._internal_tree: SortedDict[str, GitTreeEntry] = SortedDict()
+        self._serialized_tree: bytes = None
+        self._entries_offset: int = None
+        self._directory_path: str = None
+        self._pending_entries: dict[str, tuple[GitTree | Future, str, os.stat_result]] = {}
+
+    @property
+    def internal_tree(self) -> SortedDict[str, GitTreeEntry]:
+        # a tree read in the binary format is only turned into a SortedDict the first time it is needed
+        if self._internal_tree is None:
+            self._internal_tree = SortedDict(
+                (curr_tree_entry.entry_name, curr_tree_entry) for curr_tree_entry in self.iter_entries())
+            self._serialized_tree = None
+        return self._internal_tree
+
+    def iter_entries(self) -> Iterator[GitTreeEntry]:
+        '''
+        Yields the entries of the tree sorted by name. A tree read in the binary format is decoded straight out of
+        its serialized contents, one entry at a time.
+        '''
+        if self._serialized_tree is None:
+            yield from self.internal_tree.values()
+            return
+        serialized_tree: bytes = self._serialized_tree
+        tree_view = memoryview(serialized_tree)
+        position: int = self._entries_offset
+        while position < len(serialized_tree):
+            name_end: int = serialized_tree.index(b'\0', position + 1)
+            yield GitTreeEntry(str(tree_view[position + 1:name_end], 'utf8'),
+                               _ENTRY_TYPES_BY_BYTE[serialized_tree[position]],
+                               tree_view[name_end + 1:name_end + 21].hex())
+            position = name_end + 21
 
     def serialize(self: GitTree) -> bytes:
-        header: bytes = f'TREE {self.directory_name}\0'.encode()
+        header: bytes = BINARY_TREE_HEADER_PREFIX + f'{self.directory_name}\0'.encode()
         body = bytearray()
-        for git_entry in self.internal_tree.values():
-            body.extend(
-                f'{git_entry.entry_name} {str(git_entry.entry_type).split('.')[1]} {git_entry.entry_hash}\n'.encode())
+        for git_entry in self.iter_entries():
+            body.append(git_entry.entry_type.value)
+            body.extend(git_entry.entry_name.encode())
+            body.append(0)
+            body.extend(bytes.fromhex(git_entry.entry_hash))
         uncompressed_data: bytes = header + bytes(body)
         return uncompressed_data
 
     @classmethod
     def init_from_tree_file(cls, tree_file_path: str) -> GitTree:
+        tree_file_path_split: list[str] = tree_file_path.split('/')
+        full_tree_sha1: str = tree_file_path_split[-2] + tree_file_path_split[-1]
+        return cls.init_from_serialized(GitTree.deserialize(tree_file_path), full_tree_sha1)
+
+    @classmethod
+    def init_from_serialized(cls, uncompressed_contents: bytes, tree_sha1: str) -> GitTree:
+        '''
+        Creates a GitTree out of the decompressed contents of a tree object.
+
+        Args:
+            cls: the GitTree class
+            uncompressed_contents (bytes): the decompressed contents of the tree object
+            tree_sha1 (str): the sha1 of the tree object
+
+        Returns:
+            GitTree: the parsed tree
+        '''
         out_git_tree: GitTree = GitTree()
-        uncompressed_contents: bytes = GitTree.deserialize(tree_file_path)
         null_byte_idx: int = uncompressed_contents.find(b'\0')
+        if uncompressed_contents.startswith(BINARY_TREE_HEADER_PREFIX):
+            out_git_tree.directory_name = uncompressed_contents[len(BINARY_TREE_HEADER_PREFIX):null_byte_idx].decode()
+            out_git_tree._internal_tree = None
+            out_git_tree._serialized_tree = bytes(uncompressed_contents)
+            out_git_tree._entries_offset = null_byte_idx + 1
+            out_git_tree.sha1 = tree_sha1
+            return out_git_tree
+
+        # a tree in the older text format
         header: str = uncompressed_contents[:null_byte_idx].decode()
         _, dir_name = header.split()
         out_git_tree.directory_name = dir_name
@@ -73,64 +146,132 @@ class GitTree(GitObject):
             curr_git_entry: GitTreeEntry = GitTreeEntry(file_name, EntryType[entry_type_str], file_sha1)
             out_git_tree.internal_tree[file_name] = curr_git_entry
 
-        tree_file_path_split: list[str] = tree_file_path.split('/')
-        full_tree_sha1: str = tree_file_path_split[-2] + tree_file_path_split[-1]
-        out_git_tree.sha1 = full_tree_sha1
+        out_git_tree.sha1 = tree_sha1
 
         return out_git_tree
 
     @classmethod
-    def init_from_tree_hash(cls, tree_hash: str) -> GitTree:
-        kr_git_root_path: str = find_kr_git_root(Path.cwd())
-        tree_file_path: str = os.path.join(kr_git_root_path, 'trees', tree_hash[:2], tree_hash[2:])
-        return cls.init_from_tree_file(tree_file_path)
+    def init_from_tree_hash(cls, tree_hash: str, object_store: ObjectStore = None) -> GitTree:
+        return cls.init_from_serialized(GitTree.read_object('trees', tree_hash, object_store), tree_hash)
 
-    def write_git_tree_to_file(self) -> None:
-        kr_git_root: str = find_kr_git_root(Path.cwd())
+    def write_git_tree_to_file(self, repository: Repository = None) -> None:
         uncompressed_data: bytes = self.serialize()
-        uncompressed_sha1: bytes = self.hash(uncompressed_data)
-        compressed_data: bytes = zlib.compress(uncompressed_data)
-        target_dir_path: str = os.path.join(
-            kr_git_root, 'trees', uncompressed_sha1[:2])
-        os.makedirs(target_dir_path, exist_ok=True)
-        target_dir_path: str = os.path.join(
-            target_dir_path, uncompressed_sha1[2:])
-        with open(target_dir_path, 'wb') as out_file:
-            out_file.write(compressed_data)
+        uncompressed_sha1: str = self.hash(uncompressed_data)
+        repository = repository or Repository.current()
+        object_store: ObjectStore = repository.object_store
+        # an unchanged directory serializes to a tree that is already stored
+        if not object_store.freshen('trees', uncompressed_sha1):
+            object_store.write('trees', uncompressed_sha1, self.compress(uncompressed_data, repository=repository))
+        else:
+            tracer.count('objects_skipped')
         self.sha1 = uncompressed_sha1
 
     @classmethod
-    def init_from_directory(cls, directory_path: str, write_trees: bool) -> GitTree:
+    def init_from_directory(cls, directory_path: str, write_trees: bool, index: GitIndex = None,
+                            executor: Executor = None, repository: Repository = None) -> GitTree:
+        '''
+        Creates a GitTree out of a directory on disk, writing blobs for all of its files and symlinks and
+        (optionally) trees for all of its subdirectories. Paths matched by a .krgitignore file in the directory or
+        any of its subdirectories are left out.
+
+        The directory is first scanned in full, with blobs written either inline or on the executor's workers.
+        Trees are then assembled bottom-up once the hashes of all of their entries are known, so the resulting
+        objects are identical whether or not an executor is used.
+
+        Args:
+            cls: the GitTree class
+            directory_path (str): absolute path of the directory to create the tree from
+            write_trees (bool): whether to write the tree objects to files
+            index (GitIndex): stat cache of the repository. If given, files whose stat data is unchanged reuse their
+                cached blob sha1 and directories whose entries are all unchanged reuse their cached tree sha1.
+            executor (Executor): pool to read, hash, compress and write blobs on. Blobs are written serially if None.
+            repository (Repository): the repository to write to. Defaults to the current one, which is only looked
+                up once rather than for every object.
+
+        Returns:
+            GitTree: the tree representing the directory
+        '''
+        repository = repository or Repository.current()
+        with tracer.phase('scan'):
+            curr_tree: GitTree = cls._scan_directory(directory_path, index, executor, repository)
+        with tracer.phase('assemble'):
+            curr_tree._assemble(write_trees, index, repository)
+        return curr_tree
+
+    @classmethod
+    def _scan_directory(cls, directory_path: str, index: GitIndex, executor: Executor, repository: Repository,
+                        rel_path: str = '', ignore_rules: tuple[IgnoreRules, ...] = ()) -> GitTree:
+        '''
+        Walks a directory, creating a GitTree whose blob entries are either resolved (written inline or found in the
+        index) or pending on the executor, and whose tree entries are pending until the subtree is assembled.
+        Entries ignored by a .krgitignore file are left out, and symlinks are recorded as links without being
+        followed.
+        '''
         curr_tree: GitTree = GitTree()
         curr_tree.directory_name = os.path.basename(os.path.normpath(directory_path))
-        # print(curr_tree.directory_name)
-        for name in os.listdir(directory_path):
-            #TODO: implement a more comprehensive check of files and folders to ignore
-            if name == '.kr_git':
+        curr_tree._directory_path = os.path.normpath(directory_path)
+        walk_entries, child_ignore_rules = scan_directory(directory_path, rel_path, ignore_rules)
+        chunking_policy: ChunkingPolicy = repository.chunking_policy
+        for walk_entry in walk_entries:
+            name: str = walk_entry.name
+            if walk_entry.entry_type == EntryType.TREE:
+                curr_gittree: GitTree = GitTree._scan_directory(walk_entry.path, index, executor, repository,
+                                                                walk_entry.rel_path, child_ignore_rules)
+                curr_tree._pending_entries[name] = (curr_gittree, walk_entry.path, None)
+                curr_tree.internal_tree[name] = GitTreeEntry(name, EntryType.TREE, None)
+                continue
+
+            try:
+                curr_stat: os.stat_result = walk_entry.stat()
+            except FileNotFoundError:
+                # the entry was removed since the directory was listed
                 continue
-            curr_full_path: str = os.path.join(directory_path, name)
-            curr_entry: GitTreeEntry = None
-            if os.path.isdir(curr_full_path):
-                # if we are at a folder
-                if name in curr_tree.internal_tree:
-                    print(f'Duplicate name found for folder: {name}')
-                    continue
-                curr_gittree: GitTree = GitTree.init_from_directory(curr_full_path, write_trees)
-                curr_entry = GitTreeEntry(name, EntryType.TREE, curr_gittree.sha1)
-            elif os.path.isfile(curr_full_path):
-                # if we are at a file
-                if name in curr_tree.internal_tree:
-                    print(f'Duplicate name found for file: {name}')
-                    continue
-                curr_gitblob: GitBlob = GitBlob.init_gitblob_from_original_file(
-                    curr_full_path)
-                curr_gitblob.write_to_file()
-                curr_entry = GitTreeEntry(
-                    name, EntryType.BLOB, curr_gitblob.sha1)
-            
-            curr_tree.internal_tree[name] = curr_entry
-
-        if write_trees:
-            curr_tree.write_git_tree_to_file()
+            tracer.count('symlinks_scanned' if walk_entry.entry_type == EntryType.SYMLINK else 'files_scanned')
+            # large files are committed as chunks
+            entry_type: EntryType = chunking_policy.file_entry_type(walk_entry.entry_type, curr_stat.st_size)
+            blob_sha1: str = None
+            if index is not None:
+                blob_sha1 = index.lookup_blob(index.relative_path(walk_entry.path), curr_stat, entry_type)
+                if blob_sha1 is not None:
+                    tracer.count('index_hits')
+            if blob_sha1 is None and executor is not None:
+                blob_future: Future = executor.submit(GitBlob.write_entry, walk_entry.path, entry_type, repository)
+                curr_tree._pending_entries[name] = (blob_future, walk_entry.path, curr_stat)
+            elif blob_sha1 is None:
+                blob_sha1 = GitBlob.write_entry(walk_entry.path, entry_type, repository)
+                if index is not None:
+                    index.record_blob(index.relative_path(walk_entry.path), curr_stat, blob_sha1, entry_type)
+            curr_tree.internal_tree[name] = GitTreeEntry(name, entry_type, blob_sha1)
 
         return curr_tree
+
+    def _assemble(self, write_trees: bool, index: GitIndex, repository: Repository) -> None:
+        '''
+        Resolves the pending entries of a scanned tree bottom-up, then computes (or reuses from the index) the tree's
+        own sha1, writing it if requested.
+        '''
+        for name, (pending, full_path, entry_stat) in self._pending_entries.items():
+            if isinstance(pending, GitTree):
+                pending._assemble(write_trees, index, repository)
+                self.internal_tree[name].entry_hash = pending.sha1
+            else:
+                blob_sha1: str = pending.result()
+                if index is not None:
+                    index.record_blob(index.relative_path(full_path), entry_stat, blob_sha1,
+                                      self.internal_tree[name].entry_type)
+                self.internal_tree[name].entry_hash = blob_sha1
+        self._pending_entries = {}
+
+        if index is not None:
+            # the tree can reuse its cached sha1 only if every entry still has the sha1 it had in the index
+            rel_dir_path: str = index.relative_path(self._directory_path)
+            entries_unchanged: bool = all(
+                index.previous_sha1(index.relative_path(os.path.join(self._directory_path, name)),
+                                    entry.entry_type) == entry.entry_hash
+                for name, entry in self.internal_tree.items())
+            if entries_unchanged:
+                self.sha1 = index.lookup_tree(rel_dir_path, len(self.internal_tree))
+        if write_trees and self.sha1 is None:
+            self.write_git_tree_to_file(repository)
+        if index is not None and self.sha1 is not None:
+            index.record_tree(rel_dir_path, self.sha1, len(self.internal_tree))
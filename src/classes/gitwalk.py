@@ -0,0 +1,99 @@
+'''
+A module that contains the directory walker that commits read the working directory through.
+
+Directories are listed with os.scandir, whose entries already know whether they are files, directories or symlinks
+(from the directory listing itself on most filesystems), so only files and symlinks are ever stat-ed, and only once.
+Symlinks are never followed: they are reported as links, whatever they point at. Entries that are neither (sockets,
+FIFOs, devices) are skipped, as is .kr_git.
+
+Entries ignored by a .krgitignore file are dropped before they are returned, so ignored directories are never
+listed at all. See gitignore for the pattern syntax.
+
+Classes contained:
+    1. WalkEntry
+'''
+from __future__ import annotations
+import os
+from dataclasses import dataclass
+from classes.gitignore import IGNORE_FILE_NAME, IgnoreRules
+from classes.gittrace import tracer
+from classes.utils import EntryType
+
+SKIPPED_NAMES: frozenset[str] = frozenset({'.kr_git'})
+
+
+@dataclass
+class WalkEntry():
+    '''
+    A file, directory or symlink found by scan_directory.
+
+    Attributes:
+        name (str): the entry's name
+        path (str): the entry's full path
+        rel_path (str): the entry's path relative to the root of the walk, with / separators
+        entry_type (EntryType): BLOB for a regular file, TREE for a directory and SYMLINK for a symlink
+        dir_entry (os.DirEntry): the entry as listed, which caches its stat data
+    '''
+    name: str
+    path: str
+    rel_path: str
+    entry_type: EntryType
+    dir_entry: os.DirEntry
+
+    def stat(self) -> os.stat_result:
+        '''
+        Returns the stat data of the entry itself (not of a symlink's target).
+
+        Throws:
+            FileNotFoundError: if the entry was removed since its directory was listed
+        '''
+        tracer.count('stat_calls')
+        with tracer.phase('stat'):
+            return self.dir_entry.stat(follow_symlinks=False)
+
+
+def scan_directory(directory_path: str, rel_path: str = '',
+                   ignore_rules: tuple[IgnoreRules, ...] = ()) -> tuple[list[WalkEntry], tuple[IgnoreRules, ...]]:
+    '''
+    Lists the entries of one directory that are not ignored.
+
+    Args:
+        directory_path (str): path of the directory
+        rel_path (str): path of the directory relative to the root of the walk ('' for the root itself)
+        ignore_rules (tuple[IgnoreRules, ...]): the rules of every .krgitignore file in the directory's parents,
+            outermost first
+
+    Returns:
+        tuple[list[WalkEntry], tuple[IgnoreRules, ...]]: the directory's entries, in no particular order, and the
+            ignore rules to scan its subdirectories with (ignore_rules plus the directory's own .krgitignore)
+    '''
+    tracer.count('dirs_scanned')
+    tracer.count('listdir_calls')
+    with tracer.phase('listdir'):
+        with os.scandir(directory_path) as dir_iterator:
+            dir_entries: list[os.DirEntry] = list(dir_iterator)
+    for dir_entry in dir_entries:
+        if dir_entry.name == IGNORE_FILE_NAME and dir_entry.is_file(follow_symlinks=False):
+            own_rules: IgnoreRules = IgnoreRules.load(dir_entry.path, rel_path)
+            if own_rules is not None:
+                ignore_rules = ignore_rules + (own_rules,)
+            break
+
+    walk_entries: list[WalkEntry] = []
+    for dir_entry in dir_entries:
+        if dir_entry.name in SKIPPED_NAMES:
+            continue
+        if dir_entry.is_symlink():
+            entry_type: EntryType = EntryType.SYMLINK
+        elif dir_entry.is_dir(follow_symlinks=False):
+            entry_type = EntryType.TREE
+        elif dir_entry.is_file(follow_symlinks=False):
+            entry_type = EntryType.BLOB
+        else:
+            continue
+        entry_rel_path: str = f'{rel_path}/{dir_entry.name}' if rel_path else dir_entry.name
+        if ignore_rules and IgnoreRules.is_ignored(ignore_rules, entry_rel_path, entry_type == EntryType.TREE):
+            tracer.count('paths_ignored')
+            continue
+        walk_entries.append(WalkEntry(dir_entry.name, dir_entry.path, entry_rel_path, entry_type, dir_entry))
+    return walk_entries, ignore_rules
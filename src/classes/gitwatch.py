@@ -0,0 +1,685 @@
+'''
+A module that contains the classes behind `krgit watch`, a long-running process that keeps the trees of the working
+directory in memory so that commits only cost time proportional to what changed.
+
+The watcher scans the working directory once (reusing the index, like a commit) into a hierarchy of WatchedTrees.
+Changes are then picked up through Linux inotify, called through ctypes, with every directory of the working
+directory watched; where inotify is not available (or the watch limit is reached) the whole tree is re-stat-ed every
+poll interval instead. A change marks its directory for a rescan and every directory above it for a rewrite. Once no
+change has arrived for the debounce interval, only the marked directories are rescanned, only files whose stat data
+changed (or that inotify reported) are rehashed, and only the trees on the path from each change to the root are
+serialized again.
+
+`krgit commit` hands its work to a running watcher through a unix socket (WATCH_SOCKET_NAME inside .kr_git), so the
+commit only has to bring the dirty directories up to date and write the commit object and refs. When the watcher
+exits, the index is written from its in-memory state so that later commits start warm.
+
+Classes contained:
+    1. WatchedTree
+    2. Inotify
+    3. GitWatcher
+'''
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import selectors
+import signal
+import socket
+import struct
+import tempfile
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable
+from classes.gitblob import GitBlob
+from classes.gitchunk import ChunkingPolicy
+from classes.gitignore import IgnoreRules
+from classes.gitindex import GitIndex, GitIndexEntry
+from classes.gitrepository import Repository
+from classes.gittrace import tracer
+from classes.gittree import GitTree, GitTreeEntry
+from classes.gitwalk import SKIPPED_NAMES, scan_directory
+from classes.utils import EntryType
+
+WATCH_SOCKET_NAME: str = 'watch.sock'
+DEFAULT_DEBOUNCE_SECONDS: float = 1.0
+DEFAULT_POLL_SECONDS: float = 5.0
+# changes that keep arriving are still flushed after this many debounce intervals
+MAX_DEBOUNCE_FACTOR: int = 10
+# how long the main loop may block, so that a stop request is noticed
+MAX_SELECT_SECONDS: float = 1.0
+CONNECT_TIMEOUT_SECONDS: float = 1.0
+COMMIT_TIMEOUT_SECONDS: float = 3600.0
+# unix socket paths longer than this do not fit in sockaddr_un on every platform
+MAX_SOCKET_PATH_LENGTH: int = 100
+
+IN_MODIFY: int = 0x00000002
+IN_ATTRIB: int = 0x00000004
+IN_CLOSE_WRITE: int = 0x00000008
+IN_MOVED_FROM: int = 0x00000040
+IN_MOVED_TO: int = 0x00000080
+IN_CREATE: int = 0x00000100
+IN_DELETE: int = 0x00000200
+IN_DELETE_SELF: int = 0x00000400
+IN_MOVE_SELF: int = 0x00000800
+IN_Q_OVERFLOW: int = 0x00004000
+IN_IGNORED: int = 0x00008000
+IN_ONLYDIR: int = 0x01000000
+IN_DONT_FOLLOW: int = 0x02000000
+IN_EXCL_UNLINK: int = 0x04000000
+IN_ISDIR: int = 0x40000000
+WATCH_MASK: int = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                   | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+INOTIFY_EVENT_STRUCT = struct.Struct('iIII')
+INOTIFY_READ_SIZE: int = 64 * 1024
+
+
+def watch_socket_path(kr_git_root: str) -> str:
+    '''
+    Returns the path of the socket that the watcher of a repo listens on. It lives inside .kr_git unless that path
+    is too long for a unix socket, in which case it goes in the temporary directory under a name derived from the
+    repo's path.
+    '''
+    socket_path: str = os.path.join(kr_git_root, WATCH_SOCKET_NAME)
+    if len(os.fsencode(socket_path)) <= MAX_SOCKET_PATH_LENGTH:
+        return socket_path
+    repo_key: str = hashlib.sha1(os.fsencode(os.path.abspath(kr_git_root))).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f'krgit-{repo_key}.sock')
+
+
+def _connect(socket_path: str) -> socket.socket:
+    '''
+    Connects to the watcher listening on socket_path, returning None if there is none.
+    '''
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+    client_socket: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client_socket.settimeout(CONNECT_TIMEOUT_SECONDS)
+    try:
+        client_socket.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError, socket.timeout):
+        # a socket left behind by a watcher that did not exit cleanly
+        client_socket.close()
+        return None
+    return client_socket
+
+
+def request_commit(kr_git_root: str) -> str:
+    '''
+    Asks the watcher of a repo, if one is running, to commit the working directory.
+
+    Args:
+        kr_git_root (str): path of the .kr_git repo
+
+    Returns:
+        str: sha1 of the new commit, or None if no watcher is running
+
+    Throws:
+        RuntimeError: if the watcher failed to make the commit
+    '''
+    socket_path: str = watch_socket_path(kr_git_root)
+    client_socket: socket.socket = _connect(socket_path)
+    if client_socket is None:
+        return None
+    with client_socket:
+        client_socket.settimeout(COMMIT_TIMEOUT_SECONDS)
+        client_socket.sendall(b'commit\n')
+        response: bytes = b''
+        while not response.endswith(b'\n'):
+            response_chunk: bytes = client_socket.recv(4096)
+            if not response_chunk:
+                break
+            response += response_chunk
+    status, _, message = response.decode('utf8', 'replace').strip().partition(' ')
+    if status != 'ok':
+        raise RuntimeError(f'The watcher failed to commit: {message or "no response"}')
+    return message
+
+
+def is_watched(kr_git_root: str) -> bool:
+    '''
+    Checks whether a watcher is running for a repo.
+    '''
+    client_socket: socket.socket = _connect(watch_socket_path(kr_git_root))
+    if client_socket is None:
+        return False
+    client_socket.close()
+    return True
+
+
+class WatchedTree(GitTree):
+    '''
+    A GitTree that stays in memory while its directory is watched, along with its subtrees and what is needed to
+    tell which of its entries changed.
+
+    Attributes:
+        parent (WatchedTree): the tree of the directory above, or None for the root
+        rel_path (str): path of the directory relative to the root, with / separators ('' for the root)
+        ignore_rules (tuple[IgnoreRules, ...]): the rules of the .krgitignore files in the directory's parents
+        child_ignore_rules (tuple[IgnoreRules, ...]): ignore_rules plus the directory's own .krgitignore, if any
+        subtrees (dict[str, WatchedTree]): the trees of the directory's subdirectories
+        entry_stats (dict[str, tuple[int, int, int]]): (size, mtime_ns, inode) of each file and symlink when it was
+            last hashed
+        needs_scan (bool): whether the directory's own entries may have changed
+        needs_write (bool): whether the directory or anything below it changed since the tree was last written
+        changed_names (set[str]): entries reported as changed, which are rehashed even if their stat data is the same
+        scanned_ns (int): when the last scan started. Entries modified at or after it are rehashed by the next scan,
+            since a change within the timestamp granularity would not show in their stat data.
+        watch_descriptor (int): the inotify watch on the directory, or None
+    '''
+
+    def __init__(self, directory_path: str, rel_path: str = '', parent: WatchedTree = None,
+                 ignore_rules: tuple[IgnoreRules, ...] = ()):
+        super().__init__()
+        self.directory_name = os.path.basename(os.path.normpath(directory_path))
+        self._directory_path = os.path.normpath(directory_path)
+        self.parent: WatchedTree = parent
+        self.rel_path: str = rel_path
+        self.ignore_rules: tuple[IgnoreRules, ...] = ignore_rules
+        self.child_ignore_rules: tuple[IgnoreRules, ...] = ignore_rules
+        self.subtrees: dict[str, WatchedTree] = {}
+        self.entry_stats: dict[str, tuple[int, int, int]] = {}
+        self.needs_scan: bool = True
+        self.needs_write: bool = True
+        self.changed_names: set[str] = set()
+        self.scanned_ns: int = 0
+        self.watch_descriptor: int = None
+
+    def mark_changed(self, name: str = None) -> None:
+        '''
+        Marks the directory for a rescan, and it and every directory above it for a rewrite.
+
+        Args:
+            name (str): the entry that changed, if known, which is then rehashed whatever its stat data says
+        '''
+        self.needs_scan = True
+        if name is not None:
+            self.changed_names.add(name)
+        curr_tree: WatchedTree = self
+        while curr_tree is not None and not curr_tree.needs_write:
+            curr_tree.needs_write = True
+            curr_tree = curr_tree.parent
+
+    def mark_all_changed(self) -> None:
+        '''
+        Marks the directory and everything below it for a rescan.
+        '''
+        pending_trees: list[WatchedTree] = [self]
+        while pending_trees:
+            curr_tree: WatchedTree = pending_trees.pop()
+            curr_tree.needs_scan = True
+            curr_tree.needs_write = True
+            pending_trees.extend(curr_tree.subtrees.values())
+        self.mark_changed()
+
+    def iter_subtrees(self):
+        '''
+        Yields the tree and every tree below it.
+        '''
+        pending_trees: list[WatchedTree] = [self]
+        while pending_trees:
+            curr_tree: WatchedTree = pending_trees.pop()
+            yield curr_tree
+            pending_trees.extend(curr_tree.subtrees.values())
+
+    def _drop(self, name: str, watcher: GitWatcher) -> None:
+        self.internal_tree.pop(name, None)
+        self.entry_stats.pop(name, None)
+        self._pending_entries.pop(name, None)
+        subtree: WatchedTree = self.subtrees.pop(name, None)
+        if subtree is not None:
+            for curr_tree in subtree.iter_subtrees():
+                watcher.unwatch(curr_tree)
+
+    def _scan(self, watcher: GitWatcher) -> None:
+        '''
+        Lists the directory again, rehashing the files and symlinks that changed and adding or dropping entries.
+        '''
+        scan_start_ns: int = time.time_ns()
+        # cleared before the directory is listed, so that a change made while it is scanned marks it again
+        self.needs_scan = False
+        changed_names: set[str] = self.changed_names
+        self.changed_names = set()
+        try:
+            walk_entries, child_ignore_rules = scan_directory(self._directory_path, self.rel_path, self.ignore_rules)
+        except (FileNotFoundError, NotADirectoryError):
+            # the directory is gone; its parent drops it once it is rescanned
+            walk_entries, child_ignore_rules = [], self.ignore_rules
+        ignore_rules_changed: bool = child_ignore_rules != self.child_ignore_rules
+        self.child_ignore_rules = child_ignore_rules
+
+        current_names: set[str] = set()
+        for walk_entry in walk_entries:
+            name: str = walk_entry.name
+            curr_entry: GitTreeEntry = self.internal_tree.get(name)
+            if walk_entry.entry_type == EntryType.TREE:
+                current_names.add(name)
+                subtree: WatchedTree = self.subtrees.get(name)
+                if subtree is None:
+                    if curr_entry is not None:
+                        self._drop(name, watcher)
+                    subtree = WatchedTree(walk_entry.path, walk_entry.rel_path, self, child_ignore_rules)
+                    # the watch is added before the directory is scanned, so no change to it can be missed
+                    watcher.watch(subtree)
+                    self.subtrees[name] = subtree
+                    self.internal_tree[name] = GitTreeEntry(name, EntryType.TREE, None)
+                elif ignore_rules_changed:
+                    # the subtree passes the change on to its own subtrees when it is rescanned
+                    subtree.ignore_rules = child_ignore_rules
+                    subtree.needs_scan = True
+                    subtree.needs_write = True
+                continue
+
+            if name in self.subtrees:
+                self._drop(name, watcher)
+                curr_entry = None
+            try:
+                entry_stat: os.stat_result = walk_entry.stat()
+            except FileNotFoundError:
+                continue
+            current_names.add(name)
+            stat_key: tuple[int, int, int] = (entry_stat.st_size, entry_stat.st_mtime_ns, entry_stat.st_ino)
+            entry_type: EntryType = watcher.chunking_policy.file_entry_type(walk_entry.entry_type,
+                                                                            entry_stat.st_size)
+            if (curr_entry is not None and curr_entry.entry_type == entry_type
+                    and name not in changed_names and self.entry_stats.get(name) == stat_key
+                    and entry_stat.st_mtime_ns < self.scanned_ns):
+                continue
+            self.entry_stats[name] = stat_key
+            self._pending_entries.pop(name, None)
+            blob_sha1: str = None
+            if watcher.initial_index is not None:
+                blob_sha1 = watcher.initial_index.lookup_blob(
+                    watcher.initial_index.relative_path(walk_entry.path), entry_stat, entry_type)
+            if blob_sha1 is None:
+                tracer.count('files_rehashed')
+                if watcher.executor is not None:
+                    self._pending_entries[name] = (
+                        watcher.executor.submit(GitBlob.write_entry, walk_entry.path, entry_type, watcher.repository),
+                        walk_entry.path,
+                        entry_stat)
+                else:
+                    try:
+                        blob_sha1 = GitBlob.write_entry(walk_entry.path, entry_type, watcher.repository)
+                    except OSError:
+                        # the file changed or went away while it was read; it will be picked up again
+                        self.entry_stats.pop(name, None)
+                        self.mark_changed(name)
+            self.internal_tree[name] = GitTreeEntry(name, entry_type, blob_sha1)
+
+        for name in [name for name in self.internal_tree if name not in current_names]:
+            self._drop(name, watcher)
+        self.scanned_ns = scan_start_ns
+
+    def refresh(self, watcher: GitWatcher) -> None:
+        '''
+        Brings the tree up to date: rescans the directories marked for a rescan, then rewrites the trees of every
+        directory marked for a rewrite, bottom-up. Directories that are not marked are not touched.
+        '''
+        if not self.needs_write:
+            return
+        self.needs_write = False
+        if self.needs_scan:
+            self._scan(watcher)
+        for name, subtree in self.subtrees.items():
+            if subtree.needs_write:
+                subtree.refresh(watcher)
+                self.internal_tree[name].entry_hash = subtree.sha1
+        for name, (pending, _, _) in list(self._pending_entries.items()):
+            pending_future: Future = pending
+            try:
+                self.internal_tree[name].entry_hash = pending_future.result()
+            except OSError:
+                self.internal_tree.pop(name, None)
+                self.entry_stats.pop(name, None)
+                self.mark_changed(name)
+        self._pending_entries = {}
+        # entries whose blob could not be written are left out until the next refresh
+        for name in [name for name, entry in self.internal_tree.items() if entry.entry_hash is None]:
+            self.internal_tree.pop(name)
+        self.sha1 = None
+        self.write_git_tree_to_file(watcher.repository)
+
+
+class Inotify:
+    '''
+    A thin ctypes binding of the Linux inotify API.
+
+    Attributes:
+        fd (int): the non-blocking inotify file descriptor
+    '''
+
+    def __init__(self):
+        '''
+        Throws:
+            OSError: if inotify is not available
+        '''
+        libc_name: str = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError('inotify needs the C library')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not available on this platform')
+        self._libc.inotify_init1.argtypes = [ctypes.c_int]
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd: int = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise self._error('inotify_init1')
+
+    def _error(self, call_name: str, path: str = None) -> OSError:
+        error_number: int = ctypes.get_errno()
+        return OSError(error_number, f'{call_name}: {os.strerror(error_number)}', path)
+
+    def add_watch(self, directory_path: str) -> int:
+        '''
+        Watches a directory for changes to its entries. Watching the same directory again returns the same
+        descriptor.
+
+        Throws:
+            OSError: if the directory cannot be watched, with errno ENOSPC once the watch limit is reached
+        '''
+        watch_descriptor: int = self._libc.inotify_add_watch(self.fd, os.fsencode(directory_path), WATCH_MASK)
+        if watch_descriptor < 0:
+            raise self._error('inotify_add_watch', directory_path)
+        return watch_descriptor
+
+    def remove_watch(self, watch_descriptor: int) -> None:
+        self._libc.inotify_rm_watch(self.fd, watch_descriptor)
+
+    def read_events(self) -> list[tuple[int, int, str]]:
+        '''
+        Returns every event that is waiting, as (watch descriptor, mask, name) tuples. name is '' for events on the
+        watched directory itself.
+        '''
+        events: list[tuple[int, int, str]] = []
+        while True:
+            try:
+                event_data: bytes = os.read(self.fd, INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                return events
+            position: int = 0
+            while position < len(event_data):
+                watch_descriptor, mask, _, name_length = INOTIFY_EVENT_STRUCT.unpack_from(event_data, position)
+                position += INOTIFY_EVENT_STRUCT.size
+                name: str = os.fsdecode(event_data[position:position + name_length].rstrip(b'\0'))
+                position += name_length
+                events.append((watch_descriptor, mask, name))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class GitWatcher:
+    '''
+    Watches the working directory of a repo and serves commits of it.
+
+    Attributes:
+        repository (Repository): the repo being watched
+        root (WatchedTree): the tree of the working directory
+        commit_tree (Callable[[GitTree], str]): writes a commit of a root tree and moves HEAD to it, returning the
+            commit's sha1
+        debounce_seconds (float): how long to wait after the last change before refreshing the trees
+        poll_seconds (float): how often the whole tree is re-stat-ed when inotify is not used
+        executor (Executor): pool that changed files are hashed on, or None to hash them inline
+        inotify (Inotify): the inotify instance, or None when polling
+        initial_index (GitIndex): the index, used while the working directory is first scanned
+        chunking_policy (ChunkingPolicy): decides which files are committed as chunks
+        socket_path (str): the path of the socket that commits are requested on
+    '''
+
+    def __init__(self, repository: Repository, commit_tree: Callable[[GitTree], str],
+                 debounce_seconds: float = DEFAULT_DEBOUNCE_SECONDS, poll_seconds: float = DEFAULT_POLL_SECONDS,
+                 jobs: int = None, use_inotify: bool = True):
+        self.repository: Repository = repository
+        self.root: WatchedTree = WatchedTree(repository.repo_root)
+        self.commit_tree: Callable[[GitTree], str] = commit_tree
+        self.debounce_seconds: float = debounce_seconds
+        self.poll_seconds: float = poll_seconds
+        jobs = jobs or os.cpu_count() or 1
+        self.executor: Executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        self.inotify: Inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except OSError as inotify_error:
+                print(f'inotify is not available ({inotify_error}), polling every {poll_seconds}s instead')
+        self.initial_index: GitIndex = None
+        self.chunking_policy: ChunkingPolicy = repository.chunking_policy
+        self.socket_path: str = watch_socket_path(repository.kr_git_root)
+        self._trees_by_watch_descriptor: dict[int, WatchedTree] = {}
+        self._first_change_time: float = None
+        self._last_change_time: float = None
+        self._stopping: bool = False
+        self._refreshing: bool = False
+
+    def watch(self, tree: WatchedTree) -> None:
+        '''
+        Starts watching the directory of a tree. Once the inotify watch limit is reached, the watcher falls back to
+        polling.
+        '''
+        if self.inotify is None:
+            return
+        try:
+            tree.watch_descriptor = self.inotify.add_watch(tree._directory_path)
+        except FileNotFoundError:
+            return
+        except OSError as watch_error:
+            print(f'Could not watch {tree._directory_path} ({watch_error.strerror}), polling every '
+                  f'{self.poll_seconds}s instead')
+            self._stop_inotify()
+            return
+        self._trees_by_watch_descriptor[tree.watch_descriptor] = tree
+
+    def unwatch(self, tree: WatchedTree) -> None:
+        # a directory moved elsewhere in the working directory keeps its watch descriptor, which then belongs to the
+        # tree at the new location
+        if self.inotify is not None and self._trees_by_watch_descriptor.get(tree.watch_descriptor) is tree:
+            self.inotify.remove_watch(tree.watch_descriptor)
+            del self._trees_by_watch_descriptor[tree.watch_descriptor]
+        tree.watch_descriptor = None
+
+    def _stop_inotify(self) -> None:
+        if self.inotify is None:
+            return
+        self.inotify.close()
+        self.inotify = None
+        self._trees_by_watch_descriptor = {}
+
+    def _note_change(self) -> None:
+        self._last_change_time = time.monotonic()
+        if self._first_change_time is None:
+            self._first_change_time = self._last_change_time
+
+    def _handle_events(self) -> None:
+        if self.inotify is None:
+            return
+        for watch_descriptor, mask, name in self.inotify.read_events():
+            tracer.count('watch_events')
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, so nothing in the tree can be trusted any more
+                self.root.mark_all_changed()
+                self._note_change()
+                continue
+            tree: WatchedTree = self._trees_by_watch_descriptor.get(watch_descriptor)
+            if tree is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._trees_by_watch_descriptor[watch_descriptor]
+                tree.watch_descriptor = None
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if tree.parent is not None:
+                    tree.parent.mark_changed(tree.directory_name)
+                    self._note_change()
+                continue
+            if name in SKIPPED_NAMES:
+                continue
+            if tree.child_ignore_rules and IgnoreRules.is_ignored(
+                    tree.child_ignore_rules, f'{tree.rel_path}/{name}' if tree.rel_path else name,
+                    bool(mask & IN_ISDIR)):
+                continue
+            tree.mark_changed(name)
+            self._note_change()
+
+    def refresh(self) -> None:
+        '''
+        Picks up every change reported so far and brings the in-memory trees, and their objects, up to date.
+        '''
+        self._handle_events()
+        self._refreshing = True
+        with self.repository.object_store.batch(), tracer.phase('watch_refresh'):
+            self.root.refresh(self)
+        self._refreshing = False
+        self._first_change_time = None
+        self._last_change_time = None
+
+    def commit(self) -> str:
+        '''
+        Commits the working directory as it is now.
+
+        Returns:
+            str: sha1 of the new commit
+        '''
+        if self.inotify is None:
+            # without inotify nothing is known about changes made since the last poll
+            self.root.mark_all_changed()
+        self.refresh()
+        return self.commit_tree(self.root)
+
+    def _open_socket(self) -> socket.socket:
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError('krgit watch needs unix domain sockets, which this platform does not have')
+        existing_watcher: socket.socket = _connect(self.socket_path)
+        if existing_watcher is not None:
+            existing_watcher.close()
+            raise OSError(f'A watcher is already running for {self.repository.repo_root}')
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server_socket: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(self.socket_path)
+        server_socket.listen()
+        server_socket.setblocking(False)
+        return server_socket
+
+    def _serve_request(self, server_socket: socket.socket) -> None:
+        try:
+            client_socket, _ = server_socket.accept()
+        except BlockingIOError:
+            return
+        with client_socket:
+            client_socket.setblocking(True)
+            client_socket.settimeout(CONNECT_TIMEOUT_SECONDS)
+            request: bytes = b''
+            try:
+                while not request.endswith(b'\n'):
+                    request_chunk: bytes = client_socket.recv(1024)
+                    if not request_chunk:
+                        break
+                    request += request_chunk
+                request = request.strip()
+                # an empty request is another watcher checking whether this one is alive
+                if not request:
+                    return
+                if request != b'commit':
+                    client_socket.sendall(f'error unknown request {request!r}\n'.encode('utf8'))
+                    return
+                start_time: float = time.perf_counter()
+                try:
+                    commit_sha1: str = self.commit()
+                except Exception as commit_error:
+                    client_socket.sendall(f'error {commit_error}\n'.encode('utf8', 'replace'))
+                    return
+                client_socket.sendall(f'ok {commit_sha1}\n'.encode('utf8'))
+                print(f'Committed {commit_sha1} in {(time.perf_counter() - start_time) * 1000:.1f} ms')
+            except OSError:
+                # the client went away; a commit that was made stays made
+                return
+
+    def _write_index(self) -> None:
+        '''
+        Writes the index from the in-memory trees, so that commits made once the watcher has exited start warm.
+        '''
+        index: GitIndex = GitIndex(os.path.join(self.repository.kr_git_root, 'index'), self.repository.repo_root)
+        for tree in self.root.iter_subtrees():
+            if tree.needs_write or tree.sha1 is None:
+                continue
+            for name, entry in tree.internal_tree.items():
+                entry_stat: tuple[int, int, int] = tree.entry_stats.get(name)
+                if entry.entry_type == EntryType.TREE or entry_stat is None or entry.entry_hash is None:
+                    continue
+                rel_path: str = index.relative_path(os.path.join(tree._directory_path, name))
+                index.new_blob_entries[rel_path] = GitIndexEntry(rel_path, *entry_stat, entry.entry_hash,
+                                                                 entry.entry_type)
+            index.record_tree(index.relative_path(tree._directory_path), tree.sha1, len(tree.internal_tree))
+        index.write()
+
+    def stop(self) -> None:
+        '''
+        Makes run return once the request or refresh in progress is done.
+        '''
+        self._stopping = True
+
+    def run(self) -> None:
+        '''
+        Scans the working directory, then watches it and serves commit requests until stopped (by SIGINT or
+        SIGTERM).
+        '''
+        server_socket: socket.socket = self._open_socket()
+        previous_handler = signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        try:
+            start_time: float = time.perf_counter()
+            self.initial_index = GitIndex.load(self.repository.kr_git_root, self.repository.repo_root)
+            self.watch(self.root)
+            self.refresh()
+            self.initial_index = None
+            mode: str = 'inotify' if self.inotify is not None else f'polling every {self.poll_seconds}s'
+            print(f'Watching {self.repository.repo_root} ({mode}), scanned in '
+                  f'{time.perf_counter() - start_time:.2f}s. Commits are served on {self.socket_path}')
+            next_poll_time: float = time.monotonic() + self.poll_seconds
+            with selectors.DefaultSelector() as selector:
+                selector.register(server_socket, selectors.EVENT_READ)
+                inotify_fd: int = None
+                if self.inotify is not None:
+                    inotify_fd = self.inotify.fd
+                    selector.register(inotify_fd, selectors.EVENT_READ)
+                while not self._stopping:
+                    timeout: float = MAX_SELECT_SECONDS
+                    if self._last_change_time is not None:
+                        timeout = min(timeout, max(self._last_change_time + self.debounce_seconds - time.monotonic(),
+                                                   0.0))
+                    for selector_key, _ in selector.select(timeout):
+                        if selector_key.fileobj is server_socket:
+                            self._serve_request(server_socket)
+                        elif self.inotify is not None:
+                            self._handle_events()
+                    if self.inotify is None:
+                        if inotify_fd is not None:
+                            # inotify was given up on while running
+                            selector.unregister(inotify_fd)
+                            inotify_fd = None
+                        if time.monotonic() >= next_poll_time:
+                            self.root.mark_all_changed()
+                            self.refresh()
+                            next_poll_time = time.monotonic() + self.poll_seconds
+                    now: float = time.monotonic()
+                    if self._last_change_time is not None and (
+                            now - self._last_change_time >= self.debounce_seconds
+                            or now - self._first_change_time >= self.debounce_seconds * MAX_DEBOUNCE_FACTOR):
+                        self.refresh()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            server_socket.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self._stop_inotify()
+            if self.executor is not None:
+                self.executor.shutdown()
+            # trees left half refreshed by an interrupt would put stale tree sha1s in the index
+            if not self._refreshing:
+                self._write_index()
+            print('Stopped watching')
+
@@ -0,0 +1,61 @@
+'''
+Fixtures shared by the tests: every test that needs a repository gets a fresh one in its own temporary directory,
+and the working directory is changed into it, as krgit expects.
+'''
+import os
+import sys
+from typing import Callable
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import command_functions as cmd  # noqa: E402
+from classes.gitrepository import Repository  # noqa: E402
+
+
+def write_files(root_path: str, files: dict[str, bytes]) -> None:
+    '''
+    Writes files (path relative to root_path -> contents) below root_path, creating directories as needed.
+    '''
+    for relative_path, contents in files.items():
+        file_path: str = os.path.join(root_path, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as out_file:
+            out_file.write(contents)
+
+
+def head_commit_sha1(repo_root: str) -> str:
+    with open(os.path.join(repo_root, '.kr_git', 'HEAD'), 'r') as head_file:
+        return head_file.read().split('@')[1]
+
+
+@pytest.fixture
+def make_repo(tmp_path, monkeypatch) -> Callable[[str], str]:
+    '''
+    Returns a function that creates an empty repository in a new directory and changes into it.
+    '''
+    def _make_repo(name: str = 'repo') -> str:
+        repo_root: str = str(tmp_path / name)
+        os.makedirs(repo_root)
+        monkeypatch.chdir(repo_root)
+        cmd.init_kr_git_repo()
+        return repo_root
+    return _make_repo
+
+
+@pytest.fixture
+def repo(make_repo) -> str:
+    return make_repo()
+
+
+@pytest.fixture
+def commit_files() -> Callable[[dict[str, bytes]], str]:
+    '''
+    Returns a function that writes files into the current repository and commits them, returning the commit's sha1.
+    '''
+    def _commit_files(files: dict[str, bytes]) -> str:
+        repo_root: str = Repository.current().repo_root
+        write_files(repo_root, files)
+        cmd.make_commit(1)
+        return head_commit_sha1(repo_root)
+    return _commit_files
@@ -0,0 +1,39 @@
+import random
+from classes.gitchunk import ChunkingPolicy
+
+POLICY = ChunkingPolicy(min_file_size=0, min_chunk_size=2048, avg_chunk_size=8192, max_chunk_size=32768)
+
+
+def _random_bytes(seed: int, size: int) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def test_chunks_reassemble_and_respect_the_size_limits():
+    data: bytes = _random_bytes(1, 1 << 20)
+    chunks: list[bytes] = list(POLICY.split([data]))
+    assert b''.join(chunks) == data
+    assert all(POLICY.min_chunk_size <= len(chunk) <= POLICY.max_chunk_size for chunk in chunks[:-1])
+    assert 0 < len(chunks[-1]) <= POLICY.max_chunk_size
+
+
+def test_cuts_do_not_depend_on_how_the_data_is_read():
+    data: bytes = _random_bytes(2, 300_000)
+    pieces: list[bytes] = [data[start:start + 1000] for start in range(0, len(data), 1000)]
+    assert list(POLICY.split(pieces)) == list(POLICY.split([data]))
+
+
+def test_an_insert_only_changes_the_chunks_around_it():
+    data: bytes = _random_bytes(3, 1 << 20)
+    edited: bytes = data[:500_000] + b'a few inserted bytes' + data[500_000:]
+    original_chunks: list[bytes] = list(POLICY.split([data]))
+    edited_chunks: list[bytes] = list(POLICY.split([edited]))
+    assert b''.join(edited_chunks) == edited
+    new_chunks: list[bytes] = [chunk for chunk in edited_chunks if chunk not in set(original_chunks)]
+    # the boundaries resynchronize right after the insert, so only one or two chunks differ
+    assert 1 <= len(new_chunks) <= 2
+    assert len(edited_chunks) - len(new_chunks) >= len(original_chunks) - 2
+
+
+def test_runs_of_one_byte_are_cut_like_any_other_data():
+    data: bytes = _random_bytes(4, 50_000) + b'\0' * 200_000 + _random_bytes(5, 50_000)
+    assert list(POLICY.split([data[:100_000], data[100_000:]])) == list(POLICY.split([data]))
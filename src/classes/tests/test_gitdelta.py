@@ -0,0 +1,44 @@
+import random
+import pytest
+from classes.gitdelta import DeltaBaseCache, apply_delta, create_delta
+
+
+def _random_bytes(seed: int, size: int) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def test_delta_round_trip_of_an_edited_version():
+    base: bytes = _random_bytes(1, 200_000)
+    target: bytes = base[:50_000] + b'inserted line\n' + base[50_000:120_000] + base[130_000:] + b'appended'
+    delta: bytes = create_delta(base, target)
+    assert apply_delta(base, delta) == target
+    # everything but the edits is copied from the base
+    assert len(delta) < len(target) // 100
+
+
+def test_delta_round_trip_of_unrelated_and_empty_data():
+    base: bytes = _random_bytes(2, 5_000)
+    for target in (_random_bytes(3, 7_000), b'', base, base * 3):
+        assert apply_delta(base, create_delta(base, target)) == target
+    assert apply_delta(b'', create_delta(b'', b'abc')) == b'abc'
+
+
+def test_create_delta_gives_up_beyond_max_delta_size():
+    assert create_delta(_random_bytes(4, 10_000), _random_bytes(5, 10_000), max_delta_size=100) is None
+
+
+def test_apply_delta_rejects_the_wrong_base():
+    base: bytes = _random_bytes(6, 1_000)
+    delta: bytes = create_delta(base, base + b'x')
+    with pytest.raises(ValueError):
+        apply_delta(base[:-1], delta)
+
+
+def test_delta_base_cache_evicts_least_recently_used():
+    cache = DeltaBaseCache(10)
+    cache.put('a', b'12345')
+    cache.put('b', b'12345')
+    assert cache.get('a') == b'12345'
+    cache.put('c', b'12345')
+    assert cache.get('a') == b'12345'
+    assert cache.get('b') is None
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import time
+from classes import gitcompression
+from classes.gitreader import GitReader
+from classes.gitrepository import ObjectStore, Repository
+import command_functions as cmd
+
+
+def _write_unreachable_blob(data: bytes) -> str:
+    sha1: str = hashlib.sha1(data).hexdigest()
+    Repository.current().object_store.write('blobs', sha1, gitcompression.ZLIB.compress(data))
+    return sha1
+
+
+def _blob_sha1(commit_sha1: str, path: str) -> str:
+    return GitReader().find_entry(commit_sha1, path).entry_hash
+
+
+def test_fsck_passes_on_a_sound_repo(repo, commit_files):
+    commit_files({'a.txt': b'a', 'd/b.txt': b'b'})
+    commit_files({'a.txt': b'changed'})
+    assert cmd.fsck(1)
+
+
+def test_fsck_reports_a_corrupted_object(repo, commit_files, capsys):
+    commit_sha1: str = commit_files({'a.txt': b'original contents'})
+    object_store: ObjectStore = Repository.current().object_store
+    blob_sha1: str = _blob_sha1(commit_sha1, 'a.txt')
+    blob_path: str = object_store.object_path('blobs', blob_sha1)
+    assert os.path.exists(blob_path)
+    # objects may be hard links, so the corrupted file replaces the link rather than writing through it
+    os.remove(blob_path)
+    with open(blob_path, 'wb') as blob_file:
+        blob_file.write(gitcompression.ZLIB.compress(b'tampered contents'))
+    capsys.readouterr()
+    assert not cmd.fsck(1)
+    assert f'corrupt blob {blob_sha1}' in capsys.readouterr().out
+
+
+def test_fsck_reports_a_missing_object(repo, commit_files, capsys):
+    commit_sha1: str = commit_files({'a.txt': b'contents'})
+    os.remove(Repository.current().object_store.object_path('blobs', _blob_sha1(commit_sha1, 'a.txt')))
+    capsys.readouterr()
+    assert not cmd.fsck(1)
+    assert 'missing blob' in capsys.readouterr().out
+
+
+def test_prune_keeps_young_unreachable_objects(repo, commit_files):
+    commit_files({'a.txt': b'a'})
+    object_store: ObjectStore = Repository.current().object_store
+    unreachable_sha1: str = _write_unreachable_blob(b'nothing refers to this')
+    cmd.prune(jobs=1)
+    assert object_store.has('blobs', unreachable_sha1)
+
+
+def test_prune_removes_old_unreachable_objects_and_keeps_reachable_ones(repo, commit_files):
+    first_commit_sha1: str = commit_files({'a.txt': b'first', 'd/b.txt': b'b'})
+    second_commit_sha1: str = commit_files({'a.txt': b'second'})
+    object_store: ObjectStore = Repository.current().object_store
+    unreachable_sha1: str = _write_unreachable_blob(b'nothing refers to this')
+    old_time: float = time.time() - 30 * 24 * 3600
+    os.utime(object_store.object_path('blobs', unreachable_sha1), (old_time, old_time))
+
+    cmd.prune(expire_days=0, jobs=1)
+    assert not object_store.has('blobs', unreachable_sha1)
+    # the first commit is still reachable through the history of HEAD
+    assert object_store.has('commits', first_commit_sha1)
+    for commit_sha1, path in ((first_commit_sha1, 'a.txt'), (second_commit_sha1, 'a.txt'),
+                              (first_commit_sha1, 'd/b.txt')):
+        assert object_store.has('blobs', _blob_sha1(commit_sha1, path))
+    assert cmd.fsck(1)
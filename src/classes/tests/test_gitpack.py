@@ -0,0 +1,88 @@
+import hashlib
+import io
+import os
+import random
+from classes import gitcompression
+from classes.gitdelta import create_delta
+from classes.gitpack import GitPack
+from classes.gitreader import GitReader
+from classes.gitrepository import Repository
+import command_functions as cmd
+
+
+def _sha1(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def _full_object(object_dir_name: str, data: bytes) -> tuple[str, str, io.BytesIO, str]:
+    return object_dir_name, _sha1(data), io.BytesIO(gitcompression.ZLIB.compress(data)), None
+
+
+def test_pack_lookup_through_the_index(tmp_path):
+    kr_git_root: str = str(tmp_path)
+    contents: list[bytes] = [f'object {i}'.encode() * (i + 1) for i in range(300)]
+    _, object_count = GitPack.write_pack(kr_git_root, [_full_object('blobs', data) for data in contents]
+                                         + [_full_object('blobs', contents[0])])
+    assert object_count == 300
+
+    pack: GitPack = GitPack.load_packs(kr_git_root, reload=True)[0]
+    assert pack.object_count == 300
+    assert [sha1 for sha1, _ in pack.iter_entries()] == sorted(_sha1(data) for data in contents)
+    for data in contents:
+        pack_entry = pack.find(_sha1(data))
+        assert pack_entry.object_dir_name == 'blobs' and not pack_entry.is_delta
+        with pack.open_object('blobs', _sha1(data)) as object_reader:
+            assert gitcompression.decompress(object_reader.read()) == data
+    assert pack.find(_sha1(b'not in the pack')) is None
+    # an object is only found as the kind of object it was packed as
+    assert pack.open_object('trees', _sha1(contents[0])) is None
+
+
+def test_packed_delta_is_resolved_against_its_base(tmp_path):
+    kr_git_root: str = str(tmp_path)
+    base: bytes = random.Random(0).randbytes(50_000)
+    target: bytes = base[:20_000] + b'changed' + base[20_000:]
+    compressed_delta: bytes = gitcompression.ZLIB.compress(create_delta(base, target))
+    GitPack.write_pack(kr_git_root, [_full_object('blobs', base),
+                                     ('blobs', _sha1(target), io.BytesIO(compressed_delta), _sha1(base))])
+    pack: GitPack = GitPack.load_packs(kr_git_root, reload=True)[0]
+    assert pack.find(_sha1(target)).is_delta
+    with pack.open_object('blobs', _sha1(target)) as object_reader:
+        assert object_reader.data == target
+
+
+def test_writing_an_identical_pack_keeps_the_existing_one(tmp_path):
+    kr_git_root: str = str(tmp_path)
+    objects = lambda: [_full_object('commits', f'commit {i}'.encode()) for i in range(10)]
+    first_pack_path, _ = GitPack.write_pack(kr_git_root, objects())
+    first_pack: GitPack = GitPack.load_packs(kr_git_root, reload=True)[0]
+    second_pack_path, _ = GitPack.write_pack(kr_git_root, objects())
+    assert second_pack_path == first_pack_path
+    assert sorted(os.listdir(os.path.join(kr_git_root, 'packs'))) == sorted(
+        os.path.basename(first_pack_path)[:-len('.pack')] + suffix for suffix in ('.idx', '.pack'))
+    # a reload keeps the pack that is still there open, rather than closing it under its readers
+    assert GitPack.load_packs(kr_git_root, reload=True)[0] is first_pack
+
+
+def test_gc_packs_versions_as_deltas_and_they_read_back(repo, commit_files):
+    lines: list[bytes] = [f'line {i} {random.Random(i).random()}\n'.encode() for i in range(5_000)]
+    commit_sha1s: list[str] = []
+    for version in range(4):
+        lines[version * 100] = f'changed in version {version}\n'.encode()
+        commit_sha1s.append(commit_files({'cfg/big.conf': b''.join(lines) + b'v' * version}))
+    expected: list[bytes] = []
+    reader = GitReader()
+    for commit_sha1 in commit_sha1s:
+        with reader.open_blob(reader.find_entry(commit_sha1, 'cfg/big.conf').entry_hash) as blob_file:
+            expected.append(blob_file.read())
+
+    cmd.gc()
+    kr_git_root: str = Repository.current().kr_git_root
+    packs: list[GitPack] = GitPack.load_packs(kr_git_root, reload=True)
+    assert len(packs) == 1
+    assert any(pack_entry.is_delta for _, pack_entry in packs[0].iter_entries())
+    assert not os.path.isdir(os.path.join(kr_git_root, 'blobs')) or not any(
+        os.listdir(os.path.join(kr_git_root, 'blobs')))
+    for commit_sha1, contents in zip(commit_sha1s, expected):
+        with reader.open_blob(reader.find_entry(commit_sha1, 'cfg/big.conf').entry_hash) as blob_file:
+            assert blob_file.read() == contents
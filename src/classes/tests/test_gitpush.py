@@ -0,0 +1,80 @@
+import os
+import pytest
+from conftest import head_commit_sha1
+from classes.gitpush import GitPush, PushResult
+from classes.gitrepository import Repository
+from classes.gittransport import LocalTransport
+import command_functions as cmd
+
+
+@pytest.fixture
+def source_and_target(make_repo, commit_files, monkeypatch) -> tuple[str, str]:
+    target_root: str = make_repo('target')
+    source_root: str = make_repo('source')
+    commit_files({f'a/file{i}.txt': f'contents {i}'.encode() for i in range(20)} | {'b/x.txt': b'x'})
+    return source_root, target_root
+
+
+def test_push_sends_the_commit_and_moves_the_ref_and_head(source_and_target):
+    source_root, target_root = source_and_target
+    assert cmd.push(target_root)
+    assert head_commit_sha1(target_root) == head_commit_sha1(source_root)
+    assert LocalTransport(target_root).list_refs() == {'main': head_commit_sha1(source_root)}
+    assert cmd.fsck(1)
+
+
+def test_push_only_sends_what_the_receiver_is_missing(source_and_target, commit_files):
+    source_root, target_root = source_and_target
+    cmd.push(target_root)
+    commit_files({'b/x.txt': b'changed'})
+    push_result: PushResult = GitPush(Repository.current(), LocalTransport(target_root)).push(
+        'main', head_commit_sha1(source_root))
+    # the changed blob, the trees of b and the root, and the commit
+    assert push_result.object_count == 4
+    # the unchanged directory a was never walked
+    assert push_result.skipped_tree_count == 1
+    assert GitPush(Repository.current(), LocalTransport(target_root)).push(
+        'main', head_commit_sha1(source_root)).object_count == 0
+
+
+def test_push_refuses_to_drop_commits_unless_forced(source_and_target, commit_files, tmp_path, capsys):
+    source_root, target_root = source_and_target
+    cmd.push(target_root)
+    # another repository moves the target's ref on
+    other_root: str = str(tmp_path / 'other')
+    cmd.clone(target_root, other_root)
+    os.chdir(other_root)
+    commit_files({'b/other.txt': b'other'})
+    assert cmd.push(target_root)
+    other_commit_sha1: str = head_commit_sha1(other_root)
+
+    os.chdir(source_root)
+    commit_files({'b/mine.txt': b'mine'})
+    with pytest.raises(ValueError):
+        GitPush(Repository.current(), LocalTransport(target_root)).push('main', head_commit_sha1(source_root))
+    capsys.readouterr()
+    assert not cmd.push(target_root)
+    assert 'does not descend from' in capsys.readouterr().out
+    assert head_commit_sha1(target_root) == other_commit_sha1
+
+    assert cmd.push(target_root, force=True)
+    assert head_commit_sha1(target_root) == head_commit_sha1(source_root)
+
+
+def test_push_of_a_missing_ref_is_reported(source_and_target, capsys):
+    _, target_root = source_and_target
+    assert not cmd.push(target_root, 'feature/x')
+    assert capsys.readouterr().out == 'There is no ref feature/x\n'
+
+
+def test_clone_copies_every_ref_and_restores_the_same_files(source_and_target, tmp_path):
+    source_root, _ = source_and_target
+    clone_root: str = str(tmp_path / 'clone')
+    cmd.clone(source_root, clone_root)
+    assert LocalTransport(clone_root).list_refs() == LocalTransport(source_root).list_refs()
+    assert head_commit_sha1(clone_root) == head_commit_sha1(source_root)
+
+    os.chdir(clone_root)
+    assert cmd.restore(str(tmp_path / 'out'), 1)
+    with open(tmp_path / 'out' / 'source' / 'a' / 'file7.txt', 'rb') as restored_file:
+        assert restored_file.read() == b'contents 7'
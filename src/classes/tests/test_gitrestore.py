@@ -0,0 +1,47 @@
+import os
+from benchmarks import worker
+import command_functions as cmd
+
+
+def _read(file_path) -> bytes:
+    with open(file_path, 'rb') as in_file:
+        return in_file.read()
+
+
+def test_restore_of_a_subpath_directory_only_writes_that_directory(repo, commit_files, tmp_path):
+    commit_files({'top.txt': b'top', 'sub/one.txt': b'one', 'sub/deeper/two.txt': b'two', 'other/x.txt': b'x'})
+    target_path = tmp_path / 'out'
+    assert cmd.restore(str(target_path), 1, subpath='sub')
+    assert sorted(os.listdir(target_path)) == ['sub']
+    assert _read(target_path / 'sub' / 'one.txt') == b'one'
+    assert _read(target_path / 'sub' / 'deeper' / 'two.txt') == b'two'
+
+
+def test_restore_of_a_subpath_file_only_writes_that_file(repo, commit_files, tmp_path):
+    commit_files({'top.txt': b'top', 'sub/deeper/two.txt': b'two'})
+    target_path = tmp_path / 'out'
+    assert cmd.restore(str(target_path), 1, subpath='sub/deeper/two.txt')
+    assert os.listdir(target_path) == ['two.txt']
+    assert _read(target_path / 'two.txt') == b'two'
+
+
+def test_restore_of_a_missing_subpath_is_reported(repo, commit_files, tmp_path, capsys):
+    commit_files({'sub/one.txt': b'one'})
+    capsys.readouterr()
+    assert not cmd.restore(str(tmp_path / 'out'), 1, subpath='sub/nope')
+    assert len(capsys.readouterr().out.splitlines()) == 1
+
+
+def test_full_restore_writes_the_whole_commit(repo, commit_files, tmp_path):
+    commit_files({'top.txt': b'top', 'sub/one.txt': b'one'})
+    target_path = tmp_path / 'out'
+    assert cmd.restore(str(target_path), 1)
+    assert _read(target_path / 'repo' / 'top.txt') == b'top'
+    assert _read(target_path / 'repo' / 'sub' / 'one.txt') == b'one'
+
+
+def test_benchmark_restore_step_is_measured(repo, commit_files, tmp_path):
+    commit_files({'sub/one.txt': b'one'})
+    measurements: dict = worker.run_step('restore', repo, {'restore_path': str(tmp_path / 'out'), 'jobs': 1})
+    assert measurements['wall_seconds'] >= 0
+    assert _read(tmp_path / 'out' / 'repo' / 'sub' / 'one.txt') == b'one'
@@ -0,0 +1,56 @@
+import hashlib
+from classes.gittree import BINARY_TREE_HEADER_PREFIX, GitTree, GitTreeEntry
+from classes.utils import EntryType
+
+
+def _sha1(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def _make_tree(directory_name: str, entries: list[GitTreeEntry]) -> GitTree:
+    curr_tree = GitTree()
+    curr_tree.directory_name = directory_name
+    for curr_tree_entry in entries:
+        curr_tree.internal_tree[curr_tree_entry.entry_name] = curr_tree_entry
+    return curr_tree
+
+
+def test_binary_tree_round_trip():
+    entries: list[GitTreeEntry] = [
+        GitTreeEntry('with space.txt', EntryType.BLOB, _sha1(b'a')),
+        GitTreeEntry('new\nline', EntryType.BLOB, _sha1(b'b')),
+        GitTreeEntry('sub', EntryType.TREE, _sha1(b'c')),
+        GitTreeEntry('link', EntryType.SYMLINK, _sha1(b'd')),
+        GitTreeEntry('big.db', EntryType.CHUNKED, _sha1(b'e')),
+        GitTreeEntry('ünïcode', EntryType.BLOB, _sha1(b'f')),
+    ]
+    serialized: bytes = _make_tree('dir name', entries).serialize()
+    assert serialized.startswith(BINARY_TREE_HEADER_PREFIX + b'dir name\0')
+    # one type byte, the name, a NUL byte and a raw 20-byte sha1 per entry
+    assert len(serialized) == len(BINARY_TREE_HEADER_PREFIX + b'dir name\0') + sum(
+        1 + len(curr_tree_entry.entry_name.encode()) + 1 + 20 for curr_tree_entry in entries)
+
+    parsed: GitTree = GitTree.init_from_serialized(serialized, _sha1(serialized))
+    assert parsed.directory_name == 'dir name'
+    assert parsed.sha1 == _sha1(serialized)
+    assert list(parsed.iter_entries()) == sorted(entries, key=lambda curr_tree_entry: curr_tree_entry.entry_name)
+    assert parsed.serialize() == serialized
+
+
+def test_parsed_tree_can_be_edited_and_reserialized():
+    entries: list[GitTreeEntry] = [GitTreeEntry(f'file{i}', EntryType.BLOB, _sha1(bytes([i]))) for i in range(5)]
+    parsed: GitTree = GitTree.init_from_serialized(_make_tree('d', entries).serialize(), None)
+    parsed.internal_tree['file2'].entry_hash = _sha1(b'changed')
+    del parsed.internal_tree['file4']
+    expected: list[GitTreeEntry] = (entries[:2] + [GitTreeEntry('file2', EntryType.BLOB, _sha1(b'changed'))]
+                                    + entries[3:4])
+    reparsed: GitTree = GitTree.init_from_serialized(parsed.serialize(), None)
+    assert reparsed.internal_tree == _make_tree('d', expected).internal_tree
+
+
+def test_text_trees_of_older_versions_are_still_read():
+    serialized: bytes = (f'TREE docs\0readme.md BLOB {_sha1(b"r")}\nimages TREE {_sha1(b"i")}\n').encode()
+    parsed: GitTree = GitTree.init_from_serialized(serialized, _sha1(serialized))
+    assert parsed.directory_name == 'docs'
+    assert list(parsed.iter_entries()) == [GitTreeEntry('images', EntryType.TREE, _sha1(b'i')),
+                                           GitTreeEntry('readme.md', EntryType.BLOB, _sha1(b'r'))]
@@ -4,6 +4,10 @@ from pathlib import Path
 class EntryType(Enum):
     BLOB = 1
     TREE = 2
+    # a symbolic link, whose blob holds the link's target
+    SYMLINK = 3
+    # a large file split into content-defined chunks, whose blob is a manifest listing the chunks' blobs
+    CHUNKED = 4
 
 def find_kr_git_root(curr_path: Path) -> str:
     '''
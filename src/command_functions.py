@@ -1,10 +1,25 @@
 import os
-from pathlib import Path
-from classes.utils import find_kr_git_root
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from classes.gitrepository import Repository
+from classes.gittrace import tracer
 from classes.gittree import GitTree
+from classes.gitindex import GitIndex
 from classes.gitcommit import GitCommit
 from classes.gitref import GitRef
+from classes.githistory import GitHistory
+from classes.gitdiff import DiffEntry, DiffStatus, GitDiff
 from classes.gitrestore import GitRestore
+from classes.gitreader import GitReader
+from classes.gitmigrate import GitMigrate
+from classes.gitgc import GitGC, DEFAULT_DELTA_WINDOW, DEFAULT_MAX_DELTA_DEPTH
+from classes.gitfsck import GitFsck
+from classes.gitprune import GitPrune, DEFAULT_EXPIRE_DAYS
+from classes.gitpush import GitPush, PushResult
+from classes.gittransport import LocalTransport
+from classes.gitchunk import POLICY_FILE_NAME as CHUNKING_POLICY_FILE_NAME
+from classes.gitcompression import POLICY_FILE_NAME as COMPRESSION_POLICY_FILE_NAME
+from classes.gitwatch import GitWatcher, DEFAULT_DEBOUNCE_SECONDS, DEFAULT_POLL_SECONDS, request_commit
 
 def init_kr_git_repo() -> None:
     '''
@@ -15,26 +30,342 @@ def init_kr_git_repo() -> None:
     except(FileExistsError):
         print('There is already a .kr_git folder in this directory – a git repo might already exist.')
 
-def make_commit() -> None:
+def _read_head(repository: Repository) -> tuple[str, str]:
     '''
-    Creates a commit based off the current repository state
+    Returns the ref HEAD names and the commit it points at, or main and None if there is no HEAD yet.
+    '''
+    head_file_path: str = os.path.join(repository.kr_git_root, 'HEAD')
+    if not os.path.isfile(head_file_path):
+        return 'main', None
+    with open(head_file_path, 'r') as head_file:
+        head_ref_name, head_commit_sha1 = head_file.read().split('@')
+    return head_ref_name, head_commit_sha1
+
+
+def _write_commit(repository: Repository, root_tree: GitTree) -> GitCommit:
+    '''
+    Writes a commit of root_tree on top of the commit HEAD points at, if any.
+    '''
+    head_commit_sha1: str = _read_head(repository)[1]
+    parent_sha1s: list[str] = [head_commit_sha1] if head_commit_sha1 is not None else []
+    commit_obj: GitCommit = GitCommit.init_from_tree_object(root_tree, parent_sha1s)
+    commit_obj.write_commit_to_file(repository)
+    return commit_obj
+
+
+def _move_head(repository: Repository, commit_obj: GitCommit) -> None:
+    '''
+    Points the ref HEAD names, and HEAD, at a commit whose objects are already on disk, and adds it to the
+    commit-graph. The ref is only moved if it still points at the commit's parent.
+
+    Throws:
+        RuntimeError: if the ref was moved or is locked by someone else since the commit was made
+    '''
+    head_ref_name: str = _read_head(repository)[0]
+    parent_sha1: str = commit_obj.parent_sha1s[0] if commit_obj.parent_sha1s else None
+    GitRef.update(repository, head_ref_name, parent_sha1, commit_obj.commit_sha1)
+
+
+def _commit_watched_tree(root_tree: GitTree) -> str:
+    '''
+    Commits the up-to-date root tree of a watcher, returning the commit's sha1.
+    '''
+    repository: Repository = Repository.current()
+    with repository.object_store.batch(), tracer.phase('commit'):
+        commit_obj: GitCommit = _write_commit(repository, root_tree)
+    _move_head(repository, commit_obj)
+    return commit_obj.commit_sha1
+
+
+def make_commit(jobs: int = None) -> None:
+    '''
+    Creates a commit based off the current repository state. If `krgit watch` is running for the repo, the watcher
+    makes the commit from the trees it keeps in memory.
+
+    Args:
+        jobs (int): number of worker threads used to hash, compress and write blobs. Defaults to the CPU count;
+            1 writes every blob serially.
     '''
     # TODO: enable using refs other than main
-    kr_git_root_path = find_kr_git_root(Path.cwd())
-    repo_root_path: Path = Path(kr_git_root_path).parent
-    parent_git_tree: GitTree = GitTree.init_from_directory(str(repo_root_path), True)
-    # set the parent dir's dirname to None (for restore purposes)
-    parent_git_tree.directory_name = None
-    current_commit_obj: GitCommit = GitCommit.init_from_tree_object(parent_git_tree)
-    current_commit_obj.write_commit_to_file()
-    current_ref_obj: GitRef = GitRef.init_using_commit_sha1(current_commit_obj.commit_sha1, 'main')
-    current_ref_obj.write_to_file()
-    head_file_path: str = os.path.join(kr_git_root_path, 'HEAD')
-    with open(head_file_path, 'w', encoding='utf8') as head_file:
-        head_file.write(f'main@{current_ref_obj.target_commit_sha1}')
-    
-def restore(restore_path: str) -> None:
-    curr_git_restore_obj: GitRestore = GitRestore(restore_path)
-    curr_git_restore_obj.restore()
+    repository: Repository = Repository.current()
+    if request_commit(repository.kr_git_root) is not None:
+        return
+    # the index lets unchanged files and directories reuse the sha1s computed by the previous commit
+    index: GitIndex = GitIndex.load(repository.kr_git_root, repository.repo_root)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    # every object of the commit is fsynced at once when the batch ends, instead of one at a time
+    with repository.object_store.batch(), tracer.phase('commit'):
+        if jobs > 1:
+            # zlib and hashlib release the GIL, so threads are enough to keep every core busy
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                parent_git_tree: GitTree = GitTree.init_from_directory(repository.repo_root, True, index, executor,
+                                                                       repository)
+        else:
+            parent_git_tree: GitTree = GitTree.init_from_directory(repository.repo_root, True, index,
+                                                                   repository=repository)
+        # set the parent dir's dirname to None (for restore purposes)
+        parent_git_tree.directory_name = None
+        # the new commit is made on top of the one HEAD points at, if any
+        current_commit_obj: GitCommit = _write_commit(repository, parent_git_tree)
+    # the refs are only moved once the objects they point at are on disk
+    _move_head(repository, current_commit_obj)
+    index.write()
+
+
+def watch(debounce_seconds: float = DEFAULT_DEBOUNCE_SECONDS, poll_seconds: float = DEFAULT_POLL_SECONDS,
+          use_inotify: bool = True, jobs: int = None) -> None:
+    '''
+    Watches the working directory and serves commits of it until interrupted
+
+    Args:
+        debounce_seconds (float): how long to wait after the last change before hashing what changed
+        poll_seconds (float): how often to look for changes when inotify is not used
+        use_inotify (bool): whether to use inotify, or only poll
+        jobs (int): number of worker threads used to hash changed files. Defaults to the CPU count.
+    '''
+    watcher: GitWatcher = GitWatcher(Repository.current(), _commit_watched_tree, debounce_seconds, poll_seconds,
+                                     jobs, use_inotify)
+    watcher.run()
+
+def restore(restore_path: str, jobs: int = None, incremental: bool = False, delete_removed: bool = False,
+            subpath: str = None) -> bool:
+    '''
+    Restores the commit in HEAD into restore_path
+
+    Args:
+        restore_path (str): directory to restore into
+        jobs (int): number of worker threads that write files. Defaults to the CPU count.
+        incremental (bool): only write the files that differ from what restore_path already holds
+        delete_removed (bool): with incremental, also delete files that are not in the commit
+        subpath (str): only restore the directory or file at this path of the commit
+
+    Returns:
+        bool: whether the commit (or subpath) was restored, which it is not if something it needs is missing
+    '''
+    curr_git_restore_obj: GitRestore = GitRestore(restore_path, jobs, incremental, delete_removed, subpath)
+    try:
+        curr_git_restore_obj.restore()
+    except FileNotFoundError as not_found_error:
+        print(not_found_error)
+        return False
+    return True
+
+def migrate() -> None:
+    '''
+    Rewrites the object store to the v2 blob format, in which identical file contents share a single blob
+    '''
+    curr_git_migrate_obj: GitMigrate = GitMigrate()
+    curr_git_migrate_obj.migrate()
+
+def gc(delta_window: int = None, max_delta_depth: int = None) -> None:
+    '''
+    Packs every object in the repo into a single pack file and removes the loose object files
+
+    Args:
+        delta_window (int): how many other versions of the same file each blob is tried against as a delta base
+        max_delta_depth (int): the longest chain of deltas allowed in the pack
+    '''
+    curr_git_gc_obj: GitGC = GitGC(
+        delta_window if delta_window is not None else DEFAULT_DELTA_WINDOW,
+        max_delta_depth if max_delta_depth is not None else DEFAULT_MAX_DELTA_DEPTH)
+    curr_git_gc_obj.gc()
+
+def fsck(jobs: int = None) -> bool:
+    '''
+    Checks that every object in the repo hashes to its sha1 and that everything refs, commits and trees point at
+    exists, printing each problem found
 
+    Args:
+        jobs (int): number of processes that check objects. Defaults to the number of CPUs.
+
+    Returns:
+        bool: whether no problems were found
+    '''
+    curr_git_fsck_obj: GitFsck = GitFsck(jobs)
+    return curr_git_fsck_obj.fsck()
+
+def prune(expire_days: float = None, quarantine: bool = False, jobs: int = None) -> None:
+    '''
+    Removes the objects that no ref, HEAD, restore record or the index can reach, once they are older than
+    expire_days
+
+    Args:
+        expire_days (float): how many days an unreachable object is kept for after it was written
+        quarantine (bool): move the objects to .kr_git/quarantine instead of deleting them
+        jobs (int): number of processes that read trees. Defaults to the number of CPUs.
+    '''
+    curr_git_prune_obj: GitPrune = GitPrune(expire_days if expire_days is not None else DEFAULT_EXPIRE_DAYS,
+                                            quarantine, jobs)
+    curr_git_prune_obj.prune()
+
+def log(commit_names: list[str] = None, max_count: int = None) -> None:
+    '''
+    Prints the commits reachable from the given commits (HEAD by default), newest first
+
+    Args:
+        commit_names (list[str]): refs, commit sha1s or HEAD to start from
+        max_count (int): print at most this many commits
+    '''
+    history: GitHistory = GitHistory()
+    tip_commit_sha1s: list[str] = [history.resolve(commit_name) for commit_name in commit_names or ['HEAD']]
+    for commit_idx, commit_entry in enumerate(history.iter_log(tip_commit_sha1s)):
+        if max_count is not None and commit_idx >= max_count:
+            break
+        print(f'commit {commit_entry.commit_sha1}')
+        for parent_sha1 in commit_entry.parent_sha1s:
+            print(f'Parent: {parent_sha1}')
+        print(f'Tree:   {commit_entry.root_tree_sha1}')
+        print(f'Date:   {GitHistory.format_timestamp(commit_entry.timestamp)}')
+        print()
+
+def merge_base(first_commit_name: str, second_commit_name: str, show_all: bool = False,
+               is_ancestor: bool = False) -> bool:
+    '''
+    Prints the best common ancestor of two commits
+
+    Args:
+        first_commit_name (str): a ref, commit sha1 or HEAD
+        second_commit_name (str): a ref, commit sha1 or HEAD
+        show_all (bool): print every best common ancestor instead of just one
+        is_ancestor (bool): instead of printing anything, check whether the first commit is an ancestor of the second
+
+    Returns:
+        bool: whether a common ancestor was found (or, with is_ancestor, whether the first commit is an ancestor)
+    '''
+    history: GitHistory = GitHistory()
+    first_sha1: str = history.resolve(first_commit_name)
+    second_sha1: str = history.resolve(second_commit_name)
+    if is_ancestor:
+        return history.is_ancestor(first_sha1, second_sha1)
+    merge_base_sha1s: list[str] = history.merge_bases(first_sha1, second_sha1)
+    for merge_base_sha1 in merge_base_sha1s if show_all else merge_base_sha1s[:1]:
+        print(merge_base_sha1)
+    return bool(merge_base_sha1s)
+
+def diff(old_commit_name: str, new_commit_name: str, detect_renames: bool = False) -> None:
+    '''
+    Prints the files that were added (A), removed (D), modified (M) or renamed (R) between two commits
+
+    Args:
+        old_commit_name (str): a ref, commit sha1 or HEAD
+        new_commit_name (str): a ref, commit sha1 or HEAD
+        detect_renames (bool): report a removed and an added file with identical contents as a rename
+    '''
+    history: GitHistory = GitHistory()
+    diff_entries: list[DiffEntry] = GitDiff(detect_renames).diff_commits(
+        history.resolve(old_commit_name), history.resolve(new_commit_name))
+    for diff_entry in diff_entries:
+        if diff_entry.status == DiffStatus.RENAMED:
+            print(f'{diff_entry.status.value}\t{diff_entry.old_path}\t{diff_entry.path}')
+        else:
+            print(f'{diff_entry.status.value}\t{diff_entry.path}')
+
+def ls_tree(commit_name: str = 'HEAD', path: str = None, recursive: bool = False, show_sizes: bool = False) -> bool:
+    '''
+    Prints the entries of a directory of a commit, reading only the trees on the way to it and (when recursive) below
+    it
+
+    Args:
+        commit_name (str): a ref, commit sha1 or HEAD
+        path (str): the directory (or file) to list. Defaults to the root of the commit.
+        recursive (bool): also list everything in the subdirectories
+        show_sizes (bool): print the size of every file, which inflates the start of its blob
+
+    Returns:
+        bool: whether path is in the commit
+    '''
+    reader: GitReader = GitReader()
+    commit_sha1: str = GitHistory(reader.repository).resolve(commit_name)
+    try:
+        for entry_path, entry_type, entry_sha1, entry_size in reader.iter_commit(commit_sha1, path, recursive,
+                                                                                 show_sizes):
+            if show_sizes:
+                print(f'{entry_type.name.lower():<7} {entry_sha1} {"-" if entry_size is None else entry_size:>10}'
+                      f'\t{entry_path}')
+            else:
+                print(f'{entry_type.name.lower():<7} {entry_sha1}\t{entry_path}')
+    except FileNotFoundError as not_found_error:
+        print(not_found_error)
+        return False
+    return True
+
+def _print_push_result(push_result: PushResult, repo_path: str) -> None:
+    if push_result.old_commit_sha1 == push_result.new_commit_sha1:
+        print(f'{push_result.ref_name} is already up to date in {repo_path}')
+        return
+    old_name: str = push_result.old_commit_sha1[:12] if push_result.old_commit_sha1 else '(new)'
+    print(f'{push_result.ref_name}: {old_name} -> {push_result.new_commit_sha1[:12]}')
+    transfer_note: str = ''
+    if push_result.transfer_stats is not None:
+        transfer_note = (f' ({push_result.transfer_stats.linked_count} hard linked, '
+                         f'{push_result.transfer_stats.packed_count} packed in {push_result.transfer_stats.packed_bytes}'
+                         ' bytes)')
+    print(f'Sent {push_result.object_count} objects{transfer_note}; skipped {push_result.skipped_tree_count} '
+          f'directories {repo_path} already had')
+
+def push(repo_path: str, ref_name: str = None, force: bool = False) -> bool:
+    '''
+    Sends a ref, and every object its commit needs, to another repository on this machine
+
+    Args:
+        repo_path (str): the repository to push to
+        ref_name (str): the ref to push. Defaults to the one HEAD names.
+        force (bool): move the other repository's ref even if that drops commits from it
+
+    Returns:
+        bool: whether the ref was pushed, which it is not if it does not exist, repo_path is not a repository, or
+            the push was refused
+    '''
+    repository: Repository = Repository.current()
+    if ref_name is None or ref_name == 'HEAD':
+        with open(os.path.join(repository.kr_git_root, 'HEAD'), 'r') as head_file:
+            ref_name = head_file.read().split('@')[0]
+    ref_file_path: str = os.path.join(repository.kr_git_root, 'refs', ref_name)
+    if not os.path.isfile(ref_file_path):
+        print(f'There is no ref {ref_name}')
+        return False
+    commit_sha1: str = GitRef.init_from_ref_file(ref_file_path).target_commit_sha1
+    try:
+        push_result: PushResult = GitPush(repository, LocalTransport(repo_path)).push(ref_name, commit_sha1, force)
+    except (FileNotFoundError, ValueError, RuntimeError) as push_error:
+        print(push_error)
+        return False
+    _print_push_result(push_result, repo_path)
+    return True
+
+def clone(source_path: str, target_path: str) -> None:
+    '''
+    Creates a new repository at target_path holding every ref of the repository at source_path, along with its
+    compression and chunking policies. No files are checked out; use restore for that.
+
+    Args:
+        source_path (str): the repository to clone
+        target_path (str): directory to create the new repository in, which must not be a repository already
+    '''
+    source_transport: LocalTransport = LocalTransport(source_path)
+    source: Repository = source_transport.repository
+    target_kr_git_root: str = os.path.join(target_path, '.kr_git')
+    os.makedirs(target_path, exist_ok=True)
+    try:
+        os.mkdir(target_kr_git_root)
+    except FileExistsError:
+        raise FileExistsError(f'There is already a .kr_git folder in {target_path}')
+    for policy_file_name in (COMPRESSION_POLICY_FILE_NAME, CHUNKING_POLICY_FILE_NAME):
+        if os.path.isfile(os.path.join(source.kr_git_root, policy_file_name)):
+            shutil.copyfile(os.path.join(source.kr_git_root, policy_file_name),
+                            os.path.join(target_kr_git_root, policy_file_name))
 
+    source_refs: dict[str, str] = source_transport.list_refs()
+    head_file_path: str = os.path.join(source.kr_git_root, 'HEAD')
+    ref_names: list[str] = sorted(source_refs)
+    if os.path.isfile(head_file_path):
+        with open(head_file_path, 'r') as head_file:
+            head_ref_name: str = head_file.read().split('@')[0]
+        # the first ref pushed becomes the new repository's HEAD
+        if head_ref_name in source_refs:
+            ref_names.remove(head_ref_name)
+            ref_names.insert(0, head_ref_name)
+    git_push: GitPush = GitPush(source, LocalTransport(target_path))
+    for ref_name in ref_names:
+        _print_push_result(git_push.push(ref_name, source_refs[ref_name]), target_path)
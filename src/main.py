@@ -2,22 +2,127 @@
 
 import sys
 import command_functions as cmd
+from classes.gittrace import tracer
+
+def pop_option(args: list[str], option_name: str, default: str = None) -> str:
+    '''
+    Removes an option of the form `option_name VALUE` from args and returns its value.
+
+    Args:
+        args (list[str]): the command line arguments, modified in place
+        option_name (str): the option to look for, e.g. '--jobs'
+        default (str): the value to return if the option is not present
+
+    Returns:
+        str: the value of the option, or default if it was not supplied
+    '''
+    if option_name not in args:
+        return default
+    option_idx: int = args.index(option_name)
+    assert(option_idx + 1 < len(args)), f"{option_name} requires a value"
+    option_value: str = args[option_idx + 1]
+    del args[option_idx:option_idx + 2]
+    return option_value
+
+def pop_flag(args: list[str], flag_name: str) -> bool:
+    '''
+    Removes a flag (an option without a value) from args.
+
+    Args:
+        args (list[str]): the command line arguments, modified in place
+        flag_name (str): the flag to look for, e.g. '--incremental'
+
+    Returns:
+        bool: whether the flag was supplied
+    '''
+    if flag_name not in args:
+        return False
+    args.remove(flag_name)
+    return True
 
 def handle_arguments(args: list[str]):
 
+    # tracing can be turned on for any command, through the environment or these options
+    tracer.enable_from_environment()
+    trace_events_path: str = pop_option(args, '--trace-events')
+    if pop_flag(args, '--trace') or trace_events_path:
+        tracer.enable(trace_events_path)
+
     assert(len(args) > 1), "kr-git requires at least one argument!"
 
     if args[1] == 'init':
         cmd.init_kr_git_repo()
     elif args[1] == 'commit':
-        cmd.make_commit()
+        jobs: str = pop_option(args, '--jobs')
+        cmd.make_commit(int(jobs) if jobs else None)
     elif args[1] == 'restore':
+        jobs: str = pop_option(args, '--jobs')
+        incremental: bool = pop_flag(args, '--incremental')
+        delete_removed: bool = pop_flag(args, '--delete')
+        subpath: str = pop_option(args, '--subpath')
         assert(len(args) == 3), "For restore, please supply a path in which to restore to (and no other extra arguments)"
-        cmd.restore(args[2])
+        # exit with status 1 when the subpath (or an object the commit needs) is missing
+        sys.exit(0 if cmd.restore(args[2], int(jobs) if jobs else None, incremental, delete_removed, subpath) else 1)
+    elif args[1] == 'migrate':
+        cmd.migrate()
+    elif args[1] == 'gc':
+        delta_window: str = pop_option(args, '--window')
+        max_delta_depth: str = pop_option(args, '--depth')
+        cmd.gc(int(delta_window) if delta_window else None, int(max_delta_depth) if max_delta_depth else None)
+    elif args[1] == 'fsck':
+        jobs: str = pop_option(args, '--jobs')
+        assert(len(args) == 2), "fsck takes no arguments besides --jobs"
+        # exit with status 1 when anything is corrupt or missing, so that nightly jobs can alert on it
+        sys.exit(0 if cmd.fsck(int(jobs) if jobs else None) else 1)
+    elif args[1] == 'prune':
+        expire_days: str = pop_option(args, '--expire')
+        quarantine: bool = pop_flag(args, '--quarantine')
+        jobs: str = pop_option(args, '--jobs')
+        assert(len(args) == 2), "prune takes no arguments besides --expire, --quarantine and --jobs"
+        cmd.prune(float(expire_days) if expire_days else None, quarantine, int(jobs) if jobs else None)
+    elif args[1] == 'log':
+        max_count: str = pop_option(args, '-n')
+        cmd.log(args[2:], int(max_count) if max_count else None)
+    elif args[1] == 'diff':
+        detect_renames: bool = pop_flag(args, '--renames')
+        assert(len(args) == 4), "For diff, please supply the two commits to compare"
+        cmd.diff(args[2], args[3], detect_renames)
+    elif args[1] == 'ls-tree':
+        recursive: bool = pop_flag(args, '-r')
+        show_sizes: bool = pop_flag(args, '-l')
+        assert(len(args) <= 4), "For ls-tree, please supply at most a commit and a path"
+        sys.exit(0 if cmd.ls_tree(args[2] if len(args) > 2 else 'HEAD', args[3] if len(args) > 3 else None, recursive,
+                                  show_sizes) else 1)
+    elif args[1] == 'merge-base':
+        show_all: bool = pop_flag(args, '--all')
+        is_ancestor: bool = pop_flag(args, '--is-ancestor')
+        assert(len(args) == 4), "For merge-base, please supply two commits"
+        # like git, exit with status 1 when there is no merge base or the commit is not an ancestor
+        sys.exit(0 if cmd.merge_base(args[2], args[3], show_all, is_ancestor) else 1)
+    elif args[1] == 'watch':
+        debounce: str = pop_option(args, '--debounce')
+        poll_interval: str = pop_option(args, '--poll-interval')
+        use_inotify: bool = not pop_flag(args, '--poll')
+        jobs: str = pop_option(args, '--jobs')
+        assert(len(args) == 2), "watch takes no arguments besides --debounce, --poll, --poll-interval and --jobs"
+        cmd.watch(float(debounce) if debounce else cmd.DEFAULT_DEBOUNCE_SECONDS,
+                  float(poll_interval) if poll_interval else cmd.DEFAULT_POLL_SECONDS, use_inotify,
+                  int(jobs) if jobs else None)
+    elif args[1] == 'push':
+        force: bool = pop_flag(args, '--force')
+        assert(len(args) in (3, 4)), "For push, please supply the repository to push to and, optionally, a ref"
+        # exit with status 1 when the ref does not exist or the push was refused
+        sys.exit(0 if cmd.push(args[2], args[3] if len(args) == 4 else None, force) else 1)
+    elif args[1] == 'clone':
+        assert(len(args) == 4), "For clone, please supply the repository to clone and the directory to clone it into"
+        cmd.clone(args[2], args[3])
 
 if __name__ == '__main__':
 
-    handle_arguments(sys.argv)
+    try:
+        handle_arguments(sys.argv)
+    finally:
+        tracer.report(sys.argv[1] if len(sys.argv) > 1 else None)
 
 
 